@@ -0,0 +1,69 @@
+"""
+Recall vs latency of the IVF index against exact search.
+It runs on an embedding store (e.g., resources/embeddings/replies-openai) or, without one, on synthetic clustered
+vectors: `python -m benchmarks.ann --rows 100000`.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from core.utils.index import IvfIndex, exact_search
+from core.utils.store import EmbeddingStore
+
+argparser = argparse.ArgumentParser(description='Benchmark the approximate nearest-neighbour index')
+argparser.add_argument('--store',
+                       type=str,
+                       help='The embedding store to index (synthetic vectors when missing)',
+                       default=None)
+argparser.add_argument('--rows', type=int, help='Synthetic vectors', default=100_000)
+argparser.add_argument('--dim', type=int, help='Dimension of the synthetic vectors', default=256)
+argparser.add_argument('--queries', type=int, help='Number of queries', default=200)
+argparser.add_argument('--k', type=int, help='Neighbours per query', default=10)
+argparser.add_argument('--lists', type=int, help='Inverted lists (default: 4 sqrt(rows))', default=None)
+argparser.add_argument('--probes', type=str, help='Comma separated probes to try', default="1,2,4,8,16,32,64")
+argparser.add_argument('--metric', type=str, help='cosine or euclidean', default="cosine")
+
+
+def synthetic(directory: str, rows: int, dim: int) -> EmbeddingStore:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(max(1, rows // 100), dim)).astype(np.float32)
+    store = EmbeddingStore(directory)
+    for start in range(0, rows, 65536):
+        size = min(rows, start + 65536) - start
+        vectors = centers[rng.integers(len(centers), size=size)] + rng.normal(scale=0.3, size=(size, dim))
+        store.extend([("mode", i, 0) for i in range(start, start + size)], vectors)
+    return store
+
+
+def run(store: EmbeddingStore, args):
+    matrix = store.matrix()
+    rng = np.random.default_rng(1)
+    queries = np.asarray(matrix[np.sort(rng.choice(len(matrix), size=args.queries, replace=False))])
+    queries = queries + rng.normal(scale=0.01, size=queries.shape)
+    start = time.perf_counter()
+    _, exact = exact_search(matrix, queries, args.k, args.metric)
+    exact_time = (time.perf_counter() - start) / len(queries)
+    with tempfile.TemporaryDirectory() as directory:
+        index = IvfIndex(store, filename=f"{directory}/ivf.npz", metric=args.metric, lists=args.lists)
+        start = time.perf_counter()
+        index.update()
+        print(f"Build: {time.perf_counter() - start:.2f}s, {index.lists} lists, {len(index)} rows")
+        print(f"exact: {exact_time * 1000:.2f} ms/query")
+        for probes in map(int, args.probes.split(",")):
+            start = time.perf_counter()
+            _, found = index.search(queries, args.k, probes=probes)
+            latency = (time.perf_counter() - start) / len(queries)
+            recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(found, exact)])
+            print(f"probes={probes}: recall@{args.k}={recall:.3f}, {latency * 1000:.2f} ms/query, "
+                  f"{exact_time / latency:.1f}x")
+
+
+if __name__ == "__main__":
+    args = argparser.parse_args()
+    if args.store:
+        run(EmbeddingStore(args.store), args)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            run(synthetic(directory, args.rows, args.dim), args)
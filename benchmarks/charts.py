@@ -0,0 +1,43 @@
+"""
+Time and PDF size of an ensemble chart (8 modes) drawn with each render, as the points grow.
+`python -m benchmarks.charts --points 24000 240000 2400000 --scatter-limit 240000`
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import matplotlib
+import numpy as np
+
+from core.charting import RENDERS, draw_chart
+
+argparser = argparse.ArgumentParser(description='Benchmark the chart renders')
+argparser.add_argument('--points', type=int, nargs="+", help='Points per chart', default=[24_000, 240_000, 2_400_000])
+argparser.add_argument('--modes', type=int, help='Number of modes', default=8)
+argparser.add_argument('--scatter-limit', type=int, help='Largest size drawn point by point', default=240_000)
+
+
+def run(args):
+    import matplotlib.pyplot as plt
+    rng = np.random.default_rng(0)
+    print(f"{'points':>10} {'render':>8} {'seconds':>9} {'KB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.points:
+            modes = np.arange(n) % args.modes
+            projection = rng.normal(size=(n, 2)) + modes[:, None] * 0.5
+            labels = np.array([f"mode {i}" for i in range(args.modes)])[modes]
+            for render in RENDERS:
+                if render != "density" and n > args.scatter_limit:
+                    continue
+                where = os.path.join(directory, f"{render}.pdf")
+                start = time.perf_counter()
+                draw_chart(projection, where, labels=labels, render=render)
+                elapsed = time.perf_counter() - start
+                plt.close("all")
+                print(f"{n:>10} {render:>8} {elapsed:9.2f} {os.path.getsize(where) // 1024:>8}")
+
+
+if __name__ == "__main__":
+    matplotlib.use("Agg")
+    run(argparser.parse_args())
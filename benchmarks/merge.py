@@ -0,0 +1,66 @@
+"""
+Merge of the replies with the dataset at 1k/10k/100k questions: the previous per-row loops (human answers sliced
+row by row, one `copy.at` write per service and row) against the long table and its wide view.
+`python -m benchmarks.merge --questions 1000 10000 100000 --legacy-limit 10000`
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.utils.merge import human_replies, long_replies, with_responses
+
+argparser = argparse.ArgumentParser(description='Benchmark the merge of the replies')
+argparser.add_argument('--questions', type=int, nargs="+", help='Dataset sizes', default=[1_000, 10_000, 100_000])
+argparser.add_argument('--services', type=int, help='Number of services', default=7)
+argparser.add_argument('--samples', type=int, help='Replies per question', default=3)
+argparser.add_argument('--legacy-limit', type=int, help='Largest size timed with the per-row loops', default=10_000)
+
+
+def synthetic(questions: int, services: int, samples: int):
+    rng = np.random.default_rng(0)
+    dataset = pd.DataFrame({
+        "question": [f"question {i}" for i in range(questions)],
+        "human_answers": [[f"answer {i}.{j}" for j in range(n)] for i, n in enumerate(rng.integers(3, 7, questions))],
+    })
+    replies = {f"service{s}": [(i, [f"reply {s}.{i}.{j}" for j in range(samples)]) for i in range(questions)]
+               for s in range(services)}
+    return dataset, replies
+
+
+def legacy(dataset, replies):
+    human_responses = []
+    for i in range(0, len(dataset)):
+        data = dataset[i:i + 1]["human_answers"]
+        human_responses.append([i, [[response for _ in range(3)] for response in data.tolist()[0]]])
+    copy = dataset.copy()
+    for mode in replies:
+        copy[f"{mode}_response"] = ""
+        copy[f"{mode}_response"] = copy[f"{mode}_response"].astype(object)
+        for index, responses in replies[mode]:
+            copy.at[index, f"{mode}_response"] = responses
+    return human_responses, copy
+
+
+def vectorized(dataset, replies):
+    human = human_replies(dataset)
+    return human, with_responses(dataset, long_replies(dataset, replies))
+
+
+def timed(function, *arguments) -> float:
+    start = time.perf_counter()
+    function(*arguments)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    args = argparser.parse_args()
+    for questions in args.questions:
+        dataset, replies = synthetic(questions, args.services, args.samples)
+        new = timed(vectorized, dataset, replies)
+        line = f"{questions:>7} questions: long + wide {new:7.2f}s"
+        if questions <= args.legacy_limit:
+            old = timed(legacy, dataset, replies)
+            line += f", per-row loops {old:7.2f}s ({old / new:.1f}x)"
+        print(line)
@@ -0,0 +1,115 @@
+"""
+End-to-end benchmark of the pipeline against the local mock server (no network, no model).
+The stages are the reply generation (Azure with n choices, Ollama one sample per request), the safety filter,
+the question embeddings and the chart reducers; for each one it reports the throughput and the p50/p99
+latency of the requests (of the reductions, for the reducers).
+`python -m benchmarks.pipeline --questions 500 --latency 0.05 --rate-limit-rate 0.02`
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.charting.reduction import ReducerService, build_reducer
+from core.utils import embed_questions_if_not_cached, produce_response_for, remove_sensitive_rows
+from core.utils.llm import KeyLoader, LlmService, OllamaService, OpenAiService, ServiceWrapper
+from core.utils.llm.mock_server import MockServer
+from core.utils.llm.ratelimit import RateLimiter
+
+argparser = argparse.ArgumentParser(description='Benchmark the pipeline against a mock LLM server')
+argparser.add_argument('--questions', type=int, help='Questions in the synthetic dataset', default=500)
+argparser.add_argument('--how-many', type=int, help='Replies per question', default=3)
+argparser.add_argument('--concurrency', type=int, help='Questions in flight per service', default=16)
+argparser.add_argument('--latency', type=float, help='Seconds per request', default=0.05)
+argparser.add_argument('--per-token', type=float, help='Seconds per generated token', default=0.0)
+argparser.add_argument('--jitter', type=float, help='Uniform jitter of the latency', default=0.01)
+argparser.add_argument('--error-rate', type=float, help='Probability of a 500', default=0.0)
+argparser.add_argument('--rate-limit-rate', type=float, help='Probability of a 429', default=0.0)
+argparser.add_argument('--reducers', type=str, help='Comma separated reducers to time', default="pca,tsne")
+
+
+class StaticKey(KeyLoader):
+    def key(self) -> str:
+        return "mock"
+
+
+class Timed(ServiceWrapper):
+    """
+    Records the duration of every asynchronous request of the wrapped service.
+    """
+
+    def __init__(self, service: LlmService):
+        super().__init__(service)
+        self.durations = []
+
+    async def _timed(self, request):
+        start = time.perf_counter()
+        try:
+            return await request
+        finally:
+            self.durations.append(time.perf_counter() - start)
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        return await self._timed(self.service.acomplete(text, max_output))
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return await self._timed(self.service.acomplete_many(text, max_output, n))
+
+    async def acomplete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        return await self._timed(self.service.acomplete_samples(text, max_output, samples))
+
+    async def acheck(self, text) -> (bool, object):
+        return await self._timed(self.service.acheck(text))
+
+    async def aembedChucks(self, text: list[str]):
+        return await self._timed(self.service.aembedChucks(text))
+
+
+def report(stage: str, items: int, elapsed: float, durations: list):
+    p50, p99 = np.percentile(durations, [50, 99]) * 1000 if durations else (np.nan, np.nan)
+    print(f"{stage:28s} {len(durations):>8} {items:>8} {elapsed:9.2f} {items / elapsed:10.1f} {p50:9.1f} {p99:9.1f}")
+
+
+def run(args):
+    rng = np.random.default_rng(0)
+    dataset = pd.DataFrame({"question": [
+        f"question {i} about {'an unsafe' if rng.random() < 0.02 else 'a'} topic" for i in range(args.questions)
+    ]})
+    limiter = dict(max_concurrency=args.concurrency, max_retries=10, base_delay=0.05, max_delay=1.0)
+    with MockServer(latency=args.latency, per_token=args.per_token, jitter=args.jitter, error_rate=args.error_rate,
+                    rate_limit_rate=args.rate_limit_rate) as server, tempfile.TemporaryDirectory() as directory:
+        azure = OpenAiService(StaticKey(), server.url, "gpt-35", "2024-02-01", "gpt-35", RateLimiter(**limiter))
+        ollama = OllamaService("llama3", RateLimiter(**limiter), host=server.url)
+        print(f"{'stage':28s} {'requests':>8} {'items':>8} {'seconds':>9} {'items/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+        for name, service in [("generation (azure)", azure), ("generation (ollama)", ollama)]:
+            timed = Timed(service)
+            start = time.perf_counter()
+            produce_response_for(timed, dataset, max_tokens=50, how_many=args.how_many, concurrency=args.concurrency)
+            report(name, len(dataset) * args.how_many, time.perf_counter() - start, timed.durations)
+        timed = Timed(azure)
+        start = time.perf_counter()
+        removed = remove_sensitive_rows(dataset, os.path.join(directory, "filtered", "rows.json"), timed,
+                                        concurrency=args.concurrency)
+        report(f"safety filter ({len(removed)} removed)", len(dataset), time.perf_counter() - start, timed.durations)
+        embeddings = None
+        for name, service in [("embeddings (azure)", azure), ("embeddings (ollama)", ollama)]:
+            timed = Timed(service)
+            start = time.perf_counter()
+            embeddings = embed_questions_if_not_cached(timed, dataset, os.path.join(directory, name.split()[-1]))
+            report(name, len(dataset), time.perf_counter() - start, timed.durations)
+        reducers = ReducerService(os.path.join(directory, "projections"), workers=1)
+        for method in args.reducers.split(","):
+            # not the import of the backend
+            build_reducer(method, {})
+            start = time.perf_counter()
+            reducers.project(np.asarray(embeddings), method)
+            elapsed = time.perf_counter() - start
+            report(f"reducer ({method})", len(dataset), elapsed, [elapsed])
+        print(f"Server: {dict(server.requests)}")
+
+
+if __name__ == "__main__":
+    run(argparser.parse_args())
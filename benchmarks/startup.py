@@ -0,0 +1,40 @@
+"""
+Startup time of the command line: `python -m core <command> --help` against the imports every script paid
+before parsing its arguments (openai, ollama, umap, sklearn, seaborn, datasets, matplotlib).
+`python -m benchmarks.startup --repeat 5`
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from core.__main__ import COMMANDS
+
+EAGER = "import openai, ollama, umap, sklearn.decomposition, sklearn.manifold, seaborn, datasets, matplotlib.pyplot"
+
+argparser = argparse.ArgumentParser(description='Benchmark the startup of the command line')
+argparser.add_argument('--repeat', type=int, help='Runs per measure (the median is reported)', default=5)
+
+
+def measure(command: list[str], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    args = argparser.parse_args()
+    interpreter = measure([sys.executable, "-c", "pass"], args.repeat)
+    print(f"{'python -c pass':40s} {interpreter * 1000:8.0f} ms")
+    try:
+        eager = measure([sys.executable, "-c", EAGER], args.repeat)
+        print(f"{'eager imports (before)':40s} {eager * 1000:8.0f} ms")
+    except subprocess.CalledProcessError:
+        print("eager imports (before): some backend is not installed")
+    for command in [[], *[[name] for name in COMMANDS]]:
+        elapsed = measure([sys.executable, "-m", "core", *command, "--help"], args.repeat)
+        print(f"{' '.join(['core', *command, '--help']):40s} {elapsed * 1000:8.0f} ms")
@@ -0,0 +1,37 @@
+"""
+Single entry point of the experiment: `python -m core <command> [options]`.
+The commands import their dependencies (dataset loader, LLM clients, reducers, plotting) only when they run,
+so `--help` and argument errors are immediate.
+"""
+import argparse
+import importlib
+
+# command -> (module in core.cli, help)
+COMMANDS = {
+    "prepare-dataset": ("prepare_dataset", "Filter HC3 and sample the questions"),
+    "replies": ("replies", "Generate the replies of every service"),
+    "embed-questions": ("embed_questions", "Embed the questions and chart them"),
+    "embed-replies": ("embed_replies", "Embed the replies, compute the variability metrics and chart them"),
+    "charts": ("charts", "Chart the reply embeddings already stored"),
+    "pipeline": ("pipeline", "Run the stages that are out of date"),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m core", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, (module, description) in COMMANDS.items():
+        command = importlib.import_module(f"core.cli.{module}")
+        subparser = commands.add_parser(name, help=description, description=command.__doc__)
+        command.configure(subparser)
+        subparser.set_defaults(run=command.run)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
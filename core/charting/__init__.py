@@ -1,40 +1,125 @@
-import matplotlib.pyplot as plt
-import umap
-from sklearn.decomposition import PCA
-from sklearn.manifold import TSNE
-import seaborn as sns
+"""
+Charts of the embeddings. matplotlib, seaborn and the reducers are imported when a chart is drawn.
+The points are drawn one by one (`render="scatter"`), as one raster layer in the vector file ("raster") or, for
+large projections, binned with NumPy into a `bins` x `bins` image ("density"): every pixel takes the colours of the
+modes falling in it, weighted by their counts, and an opacity growing with the log of its count, so the time and
+the file size do not grow with the points.
+"""
+import numpy as np
+
+from core.charting.reduction import ReducerService, build_reducer
+
+RENDERS = ("scatter", "raster", "density")
+
+
+def as_matrix(embeddings):
+    # an EmbeddingStore is read through its memory map, without copies
+    return embeddings.matrix() if hasattr(embeddings, "matrix") else embeddings
 
 
 def create_chart(embeddings, reducer, where, axis=None, alpha=0.5, title=None, xlim=None, ylim=None, size=5,
-                 labels=None):
-    result = reducer.fit_transform(embeddings)
+                 labels=None, render="scatter", bins=256):
+    result = reducer.fit_transform(as_matrix(embeddings))
+    draw_chart(result, where, axis, alpha, title, xlim, ylim, size, labels, render, bins)
+
+
+def draw_chart(result, where, axis=None, alpha=0.5, title=None, xlim=None, ylim=None, size=5, labels=None,
+               render="scatter", bins=256):
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(size, size)) if not axis else None
-    plot_chart(axis if axis else plt, result, alpha, title, xlim, ylim, labels)
+    plot_chart(axis if axis else plt, result, alpha, title, xlim, ylim, labels, render, bins)
     plt.savefig(where) if where else {}
     plt.show() if not axis else None
 
 
-def plot_chart(plot, result, alpha, title, xlim, ylim, labels=None):
-    if plot is plt:
-        sns.scatterplot(x=result[:, 0], y=result[:, 1], hue=labels, legend='full', alpha=alpha)
-        plt.title(title)
+def plot_chart(plot, result, alpha, title, xlim, ylim, labels=None, render="scatter", bins=256):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if render == "density":
+        density_plot(plt.gca() if plot is plt else plot, result, labels, bins, xlim, ylim)
+    elif plot is plt:
+        sns.scatterplot(x=result[:, 0], y=result[:, 1], hue=labels, legend='full', alpha=alpha,
+                        rasterized=render == "raster")
     else:
-        sns.scatterplot(x=result[:, 0], y=result[:, 1], hue=labels, legend='full', alpha=alpha, ax=plot)
-        plot.set_title(title)
-    plot.legend() if labels else None
+        sns.scatterplot(x=result[:, 0], y=result[:, 1], hue=labels, legend='full', alpha=alpha, ax=plot,
+                        rasterized=render == "raster")
+    plt.title(title) if plot is plt else plot.set_title(title)
+    # the density image carries its own legend
+    plot.legend() if labels is not None and render != "density" else None
     if xlim: plot.set_xlim(-xlim, xlim)
     if ylim: plot.set_ylim(-ylim, ylim)
 
 
-def pca_chart(embeddings, where, axis=None, alpha=0.5, title=None, xlim=None, ylim=None, size=5, labels=None):
-    create_chart(embeddings, PCA(n_components=2), where, axis, alpha, title, xlim, ylim, size, labels)
+def density_image(result, labels=None, bins=256, extent=None, colors=None):
+    """
+    The `(bins, bins, 4)` RGBA image of the points of `result` (rows are y, from the bottom), its extent
+    `(xmin, xmax, ymin, ymax)` and the categories of the `labels` (sorted when numeric, otherwise in order of
+    appearance, like the hue levels of seaborn), coloured with the `colors` (RGB, one per category; default: the
+    seaborn palette).
+    """
+    import pandas as pd
+    result = np.asarray(result)
+    values = np.asarray(labels) if labels is not None else np.zeros(len(result), dtype=int)
+    codes, categories = pd.factorize(values, sort=pd.api.types.is_numeric_dtype(values))
+    if extent is None:
+        low, high = result.min(axis=0), result.max(axis=0)
+        margin = np.where(high > low, (high - low) * 0.02, 1.0)
+        extent = (low[0] - margin[0], high[0] + margin[0], low[1] - margin[1], high[1] + margin[1])
+    # the bin of every point, the ones out of the extent are left out
+    x = np.floor((result[:, 0] - extent[0]) / (extent[1] - extent[0]) * bins).astype(np.int64)
+    y = np.floor((result[:, 1] - extent[2]) / (extent[3] - extent[2]) * bins).astype(np.int64)
+    inside = (x >= 0) & (x < bins) & (y >= 0) & (y < bins)
+    counts = np.bincount((codes[inside] * bins + y[inside]) * bins + x[inside],
+                         minlength=len(categories) * bins * bins).reshape(len(categories), bins, bins)
+    total = counts.sum(axis=0)
+    if colors is None:
+        import seaborn as sns
+        colors = sns.color_palette(n_colors=len(categories))
+    colors = np.asarray(colors, dtype=float)[:len(categories), :3]
+    image = np.zeros((bins, bins, 4))
+    filled = total > 0
+    image[..., :3][filled] = np.tensordot(counts, colors, axes=(0, 0))[filled] / total[filled, None]
+    image[..., 3][filled] = 0.2 + 0.8 * np.log1p(total[filled]) / np.log1p(total.max())
+    return image, extent, list(categories)
+
+
+def density_plot(axis, result, labels=None, bins=256, xlim=None, ylim=None):
+    import seaborn as sns
+    from matplotlib.patches import Patch
+    extent = (-xlim, xlim, -ylim, ylim) if xlim and ylim else None
+    image, extent, categories = density_image(result, labels, bins, extent)
+    # the colours seaborn gives to the hue levels of a scatter plot
+    colors = sns.color_palette(n_colors=len(categories))
+    axis.imshow(image, origin="lower", extent=extent, aspect="auto", interpolation="nearest")
+    if labels is not None:
+        axis.legend(handles=[Patch(color=color, label=category) for color, category in zip(colors, categories)])
+
+
+def projected_chart(embeddings, method, params, where, axis, alpha, title, xlim, ylim, size, labels, projection,
+                    reducers, render="scatter", bins=256):
+    # a given projection (e.g., from ReducerService.project_many) or a cached one skip the reduction
+    if projection is None and reducers is not None:
+        projection = reducers.project(embeddings, method, **params)
+    if projection is None:
+        projection = build_reducer(method, ReducerService.parameters(method, params)).fit_transform(
+            as_matrix(embeddings))
+    draw_chart(projection, where, axis, alpha, title, xlim, ylim, size, labels, render, bins)
+
+
+def pca_chart(embeddings, where, axis=None, alpha=0.5, title=None, xlim=None, ylim=None, size=5, labels=None,
+              projection=None, reducers: ReducerService = None, render="scatter", bins=256):
+    projected_chart(embeddings, "pca", {}, where, axis, alpha, title, xlim, ylim, size, labels, projection, reducers,
+                    render, bins)
 
 
 def pca_compare(embeddings_a, embeddings_b, color='gray', alpha_a=0.1, alpha_b=0.5, title=None, xlim=None, ylim=None,
                 size=5, labels=None):
-    pca = PCA(n_components=2)
-    result_A = pca.fit_transform(embeddings_a)
-    result_B = pca.fit_transform(embeddings_b)
+    import matplotlib.pyplot as plt
+    from sklearn.decomposition import PCA
+    # one fit on both sets, so that they are drawn in the same space
+    embeddings_a, embeddings_b = as_matrix(embeddings_a), as_matrix(embeddings_b)
+    result = PCA(n_components=2).fit_transform(np.concatenate([embeddings_a, embeddings_b]))
+    result_A, result_B = result[:len(embeddings_a)], result[len(embeddings_a):]
     plt.figure(figsize=(size, size))
     plt.scatter(result_A[:, 0], result_A[:, 1], c=color, alpha=alpha_a)
     plt.scatter(result_B[:, 0], result_B[:, 1], c='blue', alpha=alpha_b)
@@ -44,11 +129,15 @@ def pca_compare(embeddings_a, embeddings_b, color='gray', alpha_a=0.1, alpha_b=0
     plt.show()
 
 
-def tsne_chart(embeddings, where, axis=None, alpha=0.5, title=None, xlim=None, ylim=None, size=5, labels=None):
-    create_chart(embeddings, TSNE(n_components=2, random_state=42), where, axis, alpha, title, xlim, ylim, size, labels)
+def tsne_chart(embeddings, where, axis=None, alpha=0.5, title=None, xlim=None, ylim=None, size=5, labels=None,
+               projection=None, reducers: ReducerService = None, render="scatter", bins=256):
+    projected_chart(embeddings, "tsne", {}, where, axis, alpha, title, xlim, ylim, size, labels, projection, reducers,
+                    render, bins)
 
 
 def umap_chart(embeddings, where, n_neighbors=15, min_dist=0.1, metric='euclidean', axis=None, alpha=0.5, title=None,
-               xlim=None, ylim=None, size=5, labels=None):
-    reducer = umap.UMAP(n_neighbors=n_neighbors, min_dist=min_dist, metric=metric)
-    create_chart(embeddings, reducer, where, axis, alpha, title, xlim, ylim, size, labels)
+               xlim=None, ylim=None, size=5, labels=None, projection=None, reducers: ReducerService = None,
+               render="scatter", bins=256):
+    params = {"n_neighbors": n_neighbors, "min_dist": min_dist, "metric": metric}
+    projected_chart(embeddings, "umap", params, where, axis, alpha, title, xlim, ylim, size, labels, projection,
+                    reducers, render, bins)
@@ -0,0 +1,146 @@
+"""
+Cached dimensionality reductions.
+A 2-D projection is stored on disk (`.npy`) under the hash of the embedding matrix, the reducer and its
+parameters, so re-rendering a chart only costs the plotting. Independent reductions run in a process pool.
+In streaming mode the embeddings are read chunk by chunk (e.g., from the memory map of an EmbeddingStore):
+incremental PCA over the chunks, UMAP and t-SNE fitted on a sample and then applied chunk by chunk.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DEFAULTS = {
+    "pca": {"n_components": 2},
+    "tsne": {"n_components": 2, "random_state": 42},
+    "umap": {"n_neighbors": 15, "min_dist": 0.1, "metric": "euclidean"},
+}
+
+
+def build_reducer(method: str, params: dict):
+    if method == "pca":
+        from sklearn.decomposition import PCA
+        return PCA(**params)
+    if method == "tsne":
+        from sklearn.manifold import TSNE
+        return TSNE(**params)
+    if method == "umap":
+        import umap
+        return umap.UMAP(**params)
+    raise ValueError(f"Unknown reducer: {method}")
+
+
+def reduce(embeddings, method: str, params: dict) -> np.ndarray:
+    return build_reducer(method, params).fit_transform(np.asarray(embeddings))
+
+
+def chunks(matrix, chunk: int):
+    for start in range(0, len(matrix), chunk):
+        yield start, np.asarray(matrix[start:start + chunk], dtype=np.float32)
+
+
+def streaming_reduce(embeddings, method: str, params: dict, chunk: int = 10_000, sample: int = 20_000,
+                     neighbors: int = 10, seed: int = 42) -> np.ndarray:
+    """
+    Reduces `embeddings` (anything sliceable: array, memory map, RowView) holding only one chunk in memory.
+    PCA is fitted incrementally on every chunk. UMAP is fitted on `sample` random rows and transforms the chunks.
+    t-SNE, which has no transform, is fitted on the sample and places every other row at the distance-weighted
+    mean of its `neighbors` nearest sampled rows.
+    """
+    total = len(embeddings)
+    result = np.empty((total, params.get("n_components", 2)), dtype=np.float32)
+    if method == "pca":
+        from sklearn.decomposition import IncrementalPCA
+        reducer = IncrementalPCA(n_components=params.get("n_components", 2))
+        for _, block in chunks(embeddings, chunk):
+            # a last chunk smaller than the components cannot be fitted, it is only transformed
+            if len(block) >= reducer.n_components:
+                reducer.partial_fit(block)
+        for start, block in chunks(embeddings, chunk):
+            result[start:start + len(block)] = reducer.transform(block)
+        return result
+    picked = np.sort(np.random.default_rng(seed).choice(total, size=min(sample, total), replace=False))
+    fitted = np.asarray(embeddings[picked], dtype=np.float32)
+    reducer = build_reducer(method, params)
+    if method == "umap":
+        reducer.fit(fitted)
+        for start, block in chunks(embeddings, chunk):
+            result[start:start + len(block)] = reducer.transform(block)
+        return result
+    if method == "tsne":
+        from sklearn.neighbors import NearestNeighbors
+        placed = reducer.fit_transform(fitted)
+        index = NearestNeighbors(n_neighbors=min(neighbors, len(picked))).fit(fitted)
+        for start, block in chunks(embeddings, chunk):
+            distances, nearest = index.kneighbors(block)
+            weights = 1 / (distances + 1e-12)
+            weights /= weights.sum(axis=1, keepdims=True)
+            result[start:start + len(block)] = np.einsum('nk,nkc->nc', weights, placed[nearest])
+        result[picked] = placed
+        return result
+    raise ValueError(f"Unknown reducer: {method}")
+
+
+def matrix_hash(matrix, chunk: int = 65536) -> str:
+    # chunked, so a memory mapped matrix (or a RowView) is hashed without loading it at once
+    matrix = matrix if hasattr(matrix, "shape") else np.asarray(matrix)
+    digest = hashlib.sha256(json.dumps([list(matrix.shape), np.dtype(matrix.dtype).str]).encode())
+    for start in range(0, len(matrix), chunk):
+        digest.update(np.ascontiguousarray(matrix[start:start + chunk]).tobytes())
+    return digest.hexdigest()
+
+
+class ReducerService:
+    def __init__(self, cache_dir: str = "resources/cache/projections", workers: int = None, streaming: bool = False,
+                 chunk: int = 10_000, sample: int = 20_000):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        # the streaming reductions run one at a time, in parallel they would hold several chunks (and samples)
+        self.streaming = {"chunk": chunk, "sample": sample} if streaming else None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def parameters(method: str, params: dict = None) -> dict:
+        return {**DEFAULTS.get(method, {}), **(params or {})}
+
+    def filename(self, matrix, method: str, params: dict) -> str:
+        key = hashlib.sha256(
+            json.dumps([matrix_hash(matrix), method, params, self.streaming], sort_keys=True).encode()
+        ).hexdigest()
+        return os.path.join(self.cache_dir, f"{method}-{key}.npy")
+
+    def _store(self, filename: str, projection):
+        temporary = filename + ".tmp.npy"
+        np.save(temporary, projection)
+        os.replace(temporary, filename)
+
+    def project(self, embeddings, method: str, **params) -> np.ndarray:
+        return self.project_many([(embeddings, method, params)])[0]
+
+    def project_many(self, jobs: list) -> list:
+        """
+        Projects every `(embeddings, method, params)` job, the ones not cached in parallel (with more than one).
+        """
+        matrices = [embeddings.matrix() if hasattr(embeddings, "matrix") else embeddings for embeddings, _, _ in jobs]
+        parameters = [self.parameters(method, params) for _, method, params in jobs]
+        filenames = [self.filename(matrix, method, params)
+                     for matrix, (_, method, _), params in zip(matrices, jobs, parameters)]
+        results = [np.load(filename) if os.path.exists(filename) else None for filename in filenames]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if self.streaming:
+            for i in missing:
+                results[i] = streaming_reduce(matrices[i], jobs[i][1], parameters[i], **self.streaming)
+                self._store(filenames[i], results[i])
+        elif len(missing) > 1 and self.workers != 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {i: pool.submit(reduce, matrices[i], jobs[i][1], parameters[i]) for i in missing}
+                for i in missing:
+                    results[i] = futures[i].result()
+                    self._store(filenames[i], results[i])
+        else:
+            for i in missing:
+                results[i] = reduce(matrices[i], jobs[i][1], parameters[i])
+                self._store(filenames[i], results[i])
+        return results
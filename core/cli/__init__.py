@@ -0,0 +1,4 @@
+"""
+Subcommands of `python -m core`. Every module exposes `configure(parser)`, which only declares the arguments,
+and `run(args)`, which imports what the command needs: building the parser stays cheap.
+"""
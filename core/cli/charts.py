@@ -0,0 +1,100 @@
+"""
+Draws the projections of the reply embeddings already in the store: PCA, UMAP and t-SNE of every mode and of
+all the modes together. No service is contacted.
+"""
+
+
+def add_projection_arguments(parser):
+    parser.add_argument('--projections-cache',
+                        type=str,
+                        help='Where the 2-D projections are cached',
+                        default="resources/cache/projections")
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Processes computing the projections (default: one per CPU)',
+                        default=None)
+    parser.add_argument('--streaming',
+                        action='store_true',
+                        help='Project chunk by chunk from the embedding store instead of loading every mode in '
+                             'memory')
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        help='Rows per chunk in streaming mode',
+                        default=10_000)
+    parser.add_argument('--sample-size',
+                        type=int,
+                        help='Rows used to fit UMAP and t-SNE in streaming mode',
+                        default=20_000)
+    add_render_arguments(parser)
+
+
+def add_render_arguments(parser):
+    parser.add_argument('--render',
+                        type=str,
+                        choices=["scatter", "raster", "density"],
+                        help='How the points are drawn: one by one, as a raster layer or binned into a density '
+                             'image (bounded time and file size for large projections)',
+                        default="scatter")
+    parser.add_argument('--bins',
+                        type=int,
+                        help='Bins per axis of the density images',
+                        default=256)
+
+
+def configure(parser):
+    parser.add_argument('--embeddings-file',
+                        type=str,
+                        help='The embedding store directory',
+                        default="resources/embeddings/replies-openai")
+    add_projection_arguments(parser)
+
+
+def draw(store, args):
+    import logging
+    import os
+
+    from matplotlib import pyplot as plt
+
+    from core.charting import pca_chart, umap_chart, tsne_chart
+    from core.charting.reduction import ReducerService
+
+    logging.warning("Computing projections")
+    reducers = ReducerService(args.projections_cache, args.workers, streaming=args.streaming,
+                              chunk=args.chunk_size, sample=args.sample_size)
+    modes = store.modes()
+    methods = ["pca", "umap", "tsne"]
+    all_embeddings = store.matrix()
+    # every mode and the ensemble are independent reductions, the ones not cached run in parallel
+    mode_embeddings = store.mode_view if args.streaming else store.mode_matrix
+    jobs = [(mode_embeddings(mode), method, {}) for mode in modes for method in methods]
+    jobs += [(all_embeddings, method, {}) for method in methods]
+    projections = iter(reducers.project_many(jobs))
+    logging.warning("Creating charts -- overall picture")
+    fig, axs = plt.subplots(len(modes), 3, figsize=(20, 40))
+    for i, mode in enumerate(modes):
+        print(f"Processing: {mode}")
+        pca_chart(None, None, alpha=0.1, title=f"PCA {mode}", axis=axs[i, 0],
+                  projection=next(projections), render=args.render, bins=args.bins)
+        umap_chart(None, None, alpha=0.1, title=f"UMAP {mode}", axis=axs[i, 1],
+                   projection=next(projections), render=args.render, bins=args.bins)
+        tsne_chart(None, None, alpha=0.1, title=f"TSNE {mode}", axis=axs[i, 2],
+                   projection=next(projections), render=args.render, bins=args.bins)
+    # store figure
+    os.makedirs("charts/embeddings", exist_ok=True)
+    plt.savefig("charts/embeddings/replies.pdf")
+    # embeddings as one big picture
+    all_classes = [mode for mode, _, _ in store.keys]
+    logging.warning("Creating charts -- ensemble PCA")
+    pca_chart(None, where="charts/embeddings/replies_all_pca.pdf", alpha=0.5, size=5, labels=all_classes,
+              projection=next(projections), render=args.render, bins=args.bins)
+    logging.warning("Creating charts -- ensemble UMAP")
+    umap_chart(None, where="charts/embeddings/replies_all_umap.pdf", alpha=0.5, size=5, labels=all_classes,
+               projection=next(projections), render=args.render, bins=args.bins)
+    logging.warning("Creating charts -- ensemble TSNE")
+    tsne_chart(None, where="charts/embeddings/replies_all_tsne.pdf", alpha=0.5, size=5, labels=all_classes,
+               projection=next(projections), render=args.render, bins=args.bins)
+
+
+def run(args):
+    from core.utils.store import EmbeddingStore
+    draw(EmbeddingStore(args.embeddings_file), args)
@@ -0,0 +1,60 @@
+"""
+Embeds the questions of a dataset with a given service and draws their PCA, t-SNE and UMAP projections.
+"""
+from core.cli import charts
+
+
+def configure(parser):
+    parser.add_argument('--dataset',
+                        type=str,
+                        help='The dataset to load (Parquet, pickle, JSON or CSV)',
+                        default="resources/datasets/dataset_humans_cleaned.pkl")
+    parser.add_argument('--service',
+                        type=str,
+                        help='The service to use for the embeddings',
+                        default="resources/services/text-embedding.json")
+    parser.add_argument('--embeddings-file',
+                        type=str,
+                        help='Where to store the embeddings: an embedding store directory or a legacy .json file',
+                        default="resources/embeddings/embeddings-openai")
+    parser.add_argument('--request-cache',
+                        type=str,
+                        help='The SQLite request cache (empty to disable it)',
+                        default="resources/cache/requests.sqlite")
+    parser.add_argument('--projections-cache',
+                        type=str,
+                        help='Where the 2-D projections are cached',
+                        default="resources/cache/projections")
+    charts.add_render_arguments(parser)
+
+
+def run(args):
+    import logging
+    import os
+
+    import numpy as np
+
+    from core.charting import pca_chart, tsne_chart, umap_chart
+    from core.charting.reduction import ReducerService
+    from core.utils import embed_questions_if_not_cached
+    from core.utils.cache import CachedService, RequestCache
+    from core.utils.llm import LlmService
+    from core.utils.table import load_dataset_file
+
+    service = LlmService.from_file(os.path.dirname(args.service), os.path.basename(args.service))
+    if args.request_cache:
+        service = CachedService(service, RequestCache(args.request_cache))
+    # only the questions are needed
+    dataset = load_dataset_file(args.dataset, columns=["question"])
+    embeddings = np.asarray(embed_questions_if_not_cached(service, dataset, args.embeddings_file))
+    name = os.path.basename(args.embeddings_file).split(".")[0]
+    os.makedirs(f"charts/embedding/{name}", exist_ok=True)
+    logging.warning("Projections")
+    reducers = ReducerService(args.projections_cache)
+    pca, tsne, umap = reducers.project_many([(embeddings, method, {}) for method in ["pca", "tsne", "umap"]])
+    logging.warning("PCA chart")
+    pca_chart(embeddings, f"charts/embedding/{name}/pca.pdf", projection=pca, render=args.render, bins=args.bins)
+    logging.warning("TSN chart")
+    tsne_chart(embeddings, f"charts/embedding/{name}/tsn.pdf", projection=tsne, render=args.render, bins=args.bins)
+    logging.warning("UMAP chart")
+    umap_chart(embeddings, f"charts/embedding/{name}/umap.pdf", projection=umap, render=args.render, bins=args.bins)
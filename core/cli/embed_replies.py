@@ -0,0 +1,92 @@
+"""
+Embeds the replies of every model and of the humans into an embedding store, computes the variability metrics
+and, unless skipped, draws the projections.
+"""
+from core.cli import charts
+
+
+def configure(parser):
+    parser.add_argument('--replies',
+                        type=str,
+                        help='The replies data',
+                        default="resources/replies/data.json")
+    parser.add_argument('--service',
+                        type=str,
+                        help='The service to use for the embeddings',
+                        default="resources/services/text-embedding.json")
+    parser.add_argument('--embeddings-file',
+                        type=str,
+                        help='The embedding store directory',
+                        default="resources/embeddings/replies-openai")
+    parser.add_argument('--request-cache',
+                        type=str,
+                        help='The SQLite request cache (empty to disable it)',
+                        default="resources/cache/requests.sqlite")
+    parser.add_argument('--max-batch-tokens',
+                        type=int,
+                        help='Estimated token budget of one embedding request',
+                        default=100_000)
+    parser.add_argument('--max-batch-items',
+                        type=int,
+                        help='Maximum number of texts in one embedding request',
+                        default=100)
+    parser.add_argument('--concurrency',
+                        type=int,
+                        help='Embedding requests in flight',
+                        default=4)
+    parser.add_argument('--telemetry-log',
+                        type=str,
+                        help='The JSON-lines log of every embedding request (empty to disable it)',
+                        default="resources/telemetry/embeddings.jsonl")
+    parser.add_argument('--metrics-file',
+                        type=str,
+                        help='The Prometheus textfile of the embedding request metrics (empty to disable it)',
+                        default="resources/telemetry/embeddings.prom")
+    parser.add_argument('--metrics-dir',
+                        type=str,
+                        help='Where to store the variability metrics',
+                        default="resources/metrics")
+    parser.add_argument('--skip-charts',
+                        action='store_true',
+                        help='Only embed and compute the metrics (the charts can be drawn later with `charts`)')
+    charts.add_projection_arguments(parser)
+
+
+def run(args):
+    import json
+    import logging
+    import os
+    import time
+
+    from core.metrics import variability
+    from core.utils import embed_replies_if_not_cached
+    from core.utils.cache import CachedService, RequestCache
+    from core.utils.instrument import InstrumentedService, Telemetry
+    from core.utils.llm import LlmService
+    from core.utils.store import EmbeddingStore
+
+    with open(args.replies, 'r') as f:
+        replies = json.load(f)
+    service = LlmService.from_file(os.path.dirname(args.service), os.path.basename(args.service))
+    telemetry = Telemetry(args.telemetry_log, args.metrics_file) if args.telemetry_log or args.metrics_file else None
+    if telemetry is not None:
+        service = InstrumentedService(service, telemetry, os.path.basename(args.service).split(".")[0])
+    if args.request_cache:
+        service = CachedService(service, RequestCache(args.request_cache))
+    store = EmbeddingStore(args.embeddings_file)
+    start = time.time()
+    embed_replies_if_not_cached(service, replies, store, max_tokens=args.max_batch_tokens,
+                                max_items=args.max_batch_items, concurrency=args.concurrency)
+    logging.warning(f"Time: {time.time() - start}")
+    if telemetry is not None:
+        telemetry.close()
+    ## variability
+    logging.warning("Computing variability metrics")
+    metrics, between = variability(store)
+    os.makedirs(args.metrics_dir, exist_ok=True)
+    metrics.to_csv(f"{args.metrics_dir}/variability.csv", index=False)
+    for metric in between:
+        between[metric].to_csv(f"{args.metrics_dir}/centroid_distances_{metric}.csv")
+    print(metrics.groupby("mode").mean(numeric_only=True))
+    if not args.skip_charts:
+        charts.draw(store, args)
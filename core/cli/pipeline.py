@@ -0,0 +1,169 @@
+"""
+Runs the stages of the experiment that are out of date: the replies (one partition per service), the question
+embeddings and the reply embeddings (one partition per mode). Every stage runs its command with the default
+paths; the content hashes of the last run are kept in a state file, a changed service only regenerates (and
+embeds again) its own replies, and the question embeddings run alongside the replies.
+"""
+
+STAGES = ["prepare-dataset", "replies", "embed-questions", "embed-replies"]
+
+
+def configure(parser):
+    parser.add_argument('--state-file',
+                        type=str,
+                        help='Where the content hashes of the last run are kept',
+                        default="resources/pipeline/state.json")
+    parser.add_argument('--dataset-file',
+                        type=str,
+                        help='The questions to reply to and to embed (e.g., the output of prepare-dataset)',
+                        default="resources/datasets/sampled_questions_gpt-3.5.json")
+    parser.add_argument('--services-file',
+                        type=str,
+                        help='The file with the services configuration',
+                        default="resources/replies/services.json")
+    parser.add_argument('--embedding-service',
+                        type=str,
+                        help='The service to use for the embeddings',
+                        default="resources/services/text-embedding.json")
+    parser.add_argument('--how-many',
+                        type=int,
+                        help='The number of replies for each question',
+                        default=3)
+    parser.add_argument('--stages',
+                        type=str,
+                        nargs="+",
+                        choices=STAGES,
+                        help='The stages to bring up to date, with the ones they depend on (default: all but '
+                             'prepare-dataset)',
+                        default=STAGES[1:])
+    parser.add_argument('--force',
+                        type=str,
+                        nargs="+",
+                        choices=STAGES,
+                        help='Stages to run in full even if up to date',
+                        default=[])
+    parser.add_argument('--dry-run',
+                        action='store_true',
+                        help='Only print the stale partitions of every stage')
+
+
+def command(name: str, *arguments):
+    """
+    The action running `python -m core <name> <arguments>` in a new process; the commands resume from what is
+    missing, so the stale partitions only need to be refreshed.
+    """
+    def action(partitions):
+        import subprocess
+        import sys
+        subprocess.run([sys.executable, "-m", "core", name, *arguments], check=True)
+    return action
+
+
+def service_entries(services_file: str) -> dict:
+    # what defines a service: its entry and the service file it points to
+    import json
+    import os
+
+    with open(services_file, 'r') as f:
+        entries = json.load(f)
+    for name, entry in entries.items():
+        if "filename" in entry and "where" in entry:
+            with open(os.path.join(entry["where"], entry["filename"]), 'r') as f:
+                entries[name] = {**entry, "file": json.load(f)}
+    return entries
+
+
+def reply_modes(replies_file: str) -> dict:
+    import json
+    import os
+
+    from core.utils.stages import digest
+
+    if not os.path.exists(replies_file):
+        # no replies yet, the modes are known once the replies ran
+        return {"all": None}
+    with open(replies_file, 'r') as f:
+        replies = json.load(f)
+    return {mode: digest(replies[mode]) for mode in replies}
+
+
+def drop_replies(log_file: str, cache_file: str, service: str):
+    """
+    Forgets the replies of `service`, so that the replies command generates them again: from the log and from the
+    data.json/data.pkl files, which the command imports into the log.
+    """
+    import json
+    import os
+
+    import pandas
+
+    from core.utils.checkpoint import ReplyLog
+
+    log = ReplyLog(log_file)
+    log.drop(service)
+    log.close()
+    base = os.path.splitext(cache_file)[0]
+    if os.path.exists(base + ".json"):
+        with open(base + ".json", 'r') as f:
+            replies = json.load(f)
+        replies.pop(service, None)
+        with open(base + ".json", 'w') as f:
+            json.dump(replies, f)
+    if os.path.exists(base + ".pkl"):
+        replies = pandas.read_pickle(base + ".pkl")
+        replies.pop(service, None)
+        pandas.to_pickle(replies, base + ".pkl")
+
+
+def build_stages(args) -> list:
+    import os
+
+    from core.__main__ import build_parser
+    from core.utils.stages import Stage
+    from core.utils.store import EmbeddingStore
+
+    parser = build_parser()
+    # the paths the commands use by default
+    prepare, replies, questions, embeddings = (parser.parse_args([name]) for name in STAGES)
+
+    def drop_embeddings(directory):
+        def refresh(mode):
+            if os.path.isdir(directory):
+                EmbeddingStore(directory).drop(mode)
+        return refresh
+
+    return [
+        Stage("prepare-dataset", command("prepare-dataset"),
+              inputs=[f"resources/services/{prepare.babbage_config}", f"resources/services/{prepare.gpt35_config}"],
+              outputs=["resources/filtered/dataset_humans.parquet",
+                       "resources/filtered/sampled_questions_extended.parquet"]),
+        Stage("replies", command("replies", "--dataset_file", args.dataset_file, "--services_file",
+                                 args.services_file, "--how_many", str(args.how_many)),
+              inputs=[args.dataset_file], outputs=[replies.cache_file, "resources/datasets/replies_long.parquet"],
+              params={"how_many": args.how_many}, partitions=lambda: service_entries(args.services_file),
+              refresh=lambda service: drop_replies(replies.log_file, replies.cache_file, service)),
+        Stage("embed-questions", command("embed-questions", "--dataset", args.dataset_file, "--service",
+                                         args.embedding_service),
+              inputs=[args.dataset_file, args.embedding_service], outputs=[questions.embeddings_file],
+              refresh=lambda _: drop_embeddings(questions.embeddings_file)("question")),
+        # a partition per mode: the replies of a service that did not change are not embedded again
+        Stage("embed-replies", command("embed-replies", "--replies", replies.cache_file, "--service",
+                                       args.embedding_service),
+              inputs=[args.embedding_service], after=["replies"],
+              outputs=[embeddings.embeddings_file, os.path.join(embeddings.metrics_dir, "variability.csv")],
+              partitions=lambda: reply_modes(replies.cache_file), refresh=drop_embeddings(embeddings.embeddings_file)),
+    ]
+
+
+def run(args):
+    import logging
+
+    from core.utils.stages import StageRunner
+
+    runner = StageRunner(args.state_file, build_stages(args))
+    if args.dry_run:
+        for stage, partitions in runner.plan().items():
+            print(f"{stage}: {', '.join(map(str, partitions)) if partitions else 'up to date'}")
+        return
+    ran = runner.run(args.stages, force=args.force)
+    logging.warning(f"Ran: {ran}")
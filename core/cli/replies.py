@@ -0,0 +1,154 @@
+"""
+Generates the replies of every service to the questions of the dataset.
+Every reply is appended to a log as soon as it is produced, a crashed run resumes from the missing ones; with
+workers, the generation is sharded through a SQLite work queue.
+"""
+from core.utils.table import EXPORTS
+
+
+def configure(parser):
+    parser.add_argument("--dataset_file",
+                        type=str,
+                        help="The dataset file (Parquet, JSON, pickle or CSV)",
+                        default="resources/datasets/sampled_questions_gpt-3.5.json")
+    parser.add_argument("--services_file",
+                        type=str,
+                        help="The file with the services configuration",
+                        default="resources/replies/services.json")
+    parser.add_argument("--cache_file",
+                        type=str,
+                        help="The cache file for the rows to remove for safety concern",
+                        default="resources/replies/data.json")
+    parser.add_argument("--concurrency",
+                        type=int,
+                        help="Questions in flight per service (default: the value in the services configuration, "
+                             "or 1)",
+                        default=None)
+    parser.add_argument("--how_many",
+                        type=int,
+                        help="The number of replies for each question",
+                        default=3)
+    parser.add_argument("--request_cache",
+                        type=str,
+                        help="The SQLite request cache (empty to disable it)",
+                        default="resources/cache/requests.sqlite")
+    parser.add_argument("--log_file",
+                        type=str,
+                        help="The append-only log of the produced replies, used to resume an interrupted run",
+                        default="resources/replies/data.log.jsonl")
+    parser.add_argument("--workers",
+                        type=int,
+                        help="Worker processes sharing a work queue (0 to generate in this process, service by "
+                             "service). Ollama entries with several 'hosts' spread the workers across them",
+                        default=0)
+    parser.add_argument("--queue_file",
+                        type=str,
+                        help="The SQLite work queue used by the workers",
+                        default="resources/replies/queue.sqlite")
+    parser.add_argument("--telemetry_log",
+                        type=str,
+                        help="The JSON-lines log of every LLM request (latency, tokens, retries, errors; empty to "
+                             "disable it)",
+                        default="resources/telemetry/replies.jsonl")
+    parser.add_argument("--metrics_file",
+                        type=str,
+                        help="The Prometheus textfile of the LLM request metrics, rewritten during the run (empty to "
+                             "disable it)",
+                        default="resources/telemetry/replies.prom")
+    parser.add_argument("--formats", type=str, nargs="+", choices=EXPORTS,
+                        help="The formats of the dataset with the responses (Parquet, plus the optional CSV, JSON and "
+                             "pickle exports)",
+                        default=["parquet"])
+
+
+def run(args):
+    import json
+    import multiprocessing
+    import os
+    import time
+
+    import pandas
+
+    from core.utils import generation_worker, produce_response_for, residency_order, services_loader
+    from core.utils import store_pandas_in
+    from core.utils.cache import RequestCache
+    from core.utils.checkpoint import ReplyLog
+    from core.utils.instrument import Telemetry
+    from core.utils.llm import release, shares_model, warm_up
+    from core.utils.merge import human_replies, long_replies, with_responses
+    from core.utils.table import load_dataset_file, write_table
+    from core.utils.workqueue import WorkQueue
+
+    replies = {}
+    if os.path.exists(args.cache_file):
+        with open(args.cache_file, 'r') as f:
+            replies = json.load(f)
+
+    log = ReplyLog(args.log_file)
+    # replies of a run made before the log existed
+    log.import_replies({service: replies[service] for service in replies if service != "human"})
+    cache = RequestCache(args.request_cache) if args.request_cache else None
+    telemetry = Telemetry(args.telemetry_log, args.metrics_file) if args.telemetry_log or args.metrics_file else None
+    services = services_loader(args.services_file, cache, telemetry=telemetry)
+    dataset = load_dataset_file(args.dataset_file)
+
+    if args.workers > 0:
+        queue = WorkQueue(args.queue_file)
+        for service in services:
+            queue.enqueue(service, [(row, sample, question)
+                                    for row, question in zip(dataset.index, dataset["question"])
+                                    for sample in log.missing(service, row, args.how_many)])
+        start = time.time()
+        workers = [multiprocessing.Process(target=generation_worker,
+                                           args=(args.queue_file, args.services_file, worker, args.request_cache,
+                                                 250, args.telemetry_log, args.metrics_file))
+                   for worker in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print(f"Time: {time.time() - start}, items: {queue.counts()}")
+        for service, row, sample, text, timing in queue.results():
+            if sample in log.missing(service, row, args.how_many):
+                log.append(service, row, sample, text, **timing)
+    # without workers this is the generation, with workers it only retries what they could not produce
+    order = residency_order(services)
+    loaded = None
+    for position, service in enumerate(order):
+        print(f"Policy: {service}")
+        missing = any(log.missing(service, row, args.how_many) for row in dataset.index)
+        load = 0
+        if missing:
+            load = warm_up(service, services[service]) or 0
+            loaded = service
+        start = time.time()
+        produce_response_for(llm_service=services[service], dataset=dataset, max_tokens=250, how_many=args.how_many,
+                             concurrency=args.concurrency, log=log, name=service)
+        end = time.time()
+        # the model stays loaded when the next service uses it too
+        following = order[position + 1] if position + 1 < len(order) else None
+        if loaded is not None and (following is None or not shares_model(services[loaded], services[following])):
+            release(loaded, services[loaded])
+            loaded = None
+        print(f"Load: {load}, Generation: {end - start}")
+    if telemetry is not None:
+        telemetry.close()
+    replies = log.compact(list(services), dataset.index, args.how_many)
+    # add human answers (keyed by index label, like the services)
+    replies["human"] = human_replies(dataset)
+
+    cache_dir = os.path.dirname(args.cache_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    # get the name without the extension
+    cache_name = os.path.basename(args.cache_file).split(".")[0]
+    with open(f"{cache_dir}/{cache_name}.pkl", 'wb') as f:
+        pandas.to_pickle(replies, f)
+    with open(f"{cache_dir}/{cache_name}.json", 'w') as f:
+        json.dump(replies, f)
+
+    # one long table of every reply, the wide dataset is a view of it
+    where = "resources/datasets/"
+    os.makedirs(os.path.dirname(where), exist_ok=True)
+    long = long_replies(dataset, replies)
+    write_table(long, where + "replies_long.parquet")
+    store_pandas_in(with_responses(dataset, long), where + "dataset_with_llm_responses", args.formats)
@@ -0,0 +1,123 @@
+"""
+Variability metrics over the reply embeddings.
+Embeddings are grouped in a `(modes x questions x samples x dim)` tensor with a `(modes x questions x samples)`
+mask for the missing samples (e.g., questions with fewer human answers). Every metric is a batched NumPy
+operation over the tensor; `variability` walks the questions in chunks, so only the pairwise matrices of one
+chunk exist at a time.
+"""
+import numpy as np
+import pandas as pd
+
+METRICS = ("cosine", "euclidean")
+
+
+def pairwise_distances(a, b, metric="cosine"):
+    """
+    Distances between the vectors of `a` (..., S, D) and `b` (..., T, D), the result is (..., S, T).
+    """
+    dots = np.einsum('...sd,...td->...st', a, b)
+    if metric == "cosine":
+        norms_a = np.linalg.norm(a, axis=-1)[..., :, None]
+        norms_b = np.linalg.norm(b, axis=-1)[..., None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 1 - dots / (norms_a * norms_b)
+    if metric == "euclidean":
+        squared_a = np.einsum('...sd,...sd->...s', a, a)[..., :, None]
+        squared_b = np.einsum('...td,...td->...t', b, b)[..., None, :]
+        return np.sqrt(np.maximum(squared_a + squared_b - 2 * dots, 0))
+    raise ValueError(f"Unknown metric: {metric}")
+
+
+def _masked_mean(values, weights, axis):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(weights, values, 0).sum(axis=axis) / weights.sum(axis=axis)
+
+
+def centroids(tensor, mask):
+    """
+    Mean of the valid samples of each group, (modes, questions, dim); NaN for groups without samples.
+    """
+    return _masked_mean(tensor, mask[..., None], axis=-2)
+
+
+def dispersion(tensor, mask, metric="cosine"):
+    """
+    Mean pairwise distance between the samples of each (mode, question) group, NaN with less than two samples.
+    """
+    distances = pairwise_distances(tensor, tensor, metric)
+    samples = mask.shape[-1]
+    pairs = mask[..., :, None] & mask[..., None, :] & ~np.eye(samples, dtype=bool)
+    return _masked_mean(distances, pairs, axis=(-2, -1))
+
+
+def distance_to_reference(tensor, mask, reference: int, metric="cosine"):
+    """
+    Mean distance between the samples of each (mode, question) group and the centroid of the reference mode
+    (e.g., the human answers) for the same question.
+    """
+    reference_centroids = centroids(tensor[reference:reference + 1], mask[reference:reference + 1])
+    distances = pairwise_distances(tensor, reference_centroids[..., None, :], metric)[..., 0]
+    return _masked_mean(distances, mask, axis=-1)
+
+
+def centroid_distances(tensor, mask, metric="cosine"):
+    """
+    Distances between the centroids of the modes for each question, (questions, modes, modes).
+    """
+    per_question = np.swapaxes(centroids(tensor, mask), 0, 1)
+    return pairwise_distances(per_question, per_question, metric)
+
+
+def group_offsets(store, modes, rows, samples=None):
+    """
+    Matrix rows of the `(mode, row, sample)` keys of an EmbeddingStore as a (modes, questions, samples) array,
+    -1 where the sample does not exist.
+    """
+    if samples is None:
+        samples = 1 + max((key[2] for key in store.keys if key[0] in modes), default=-1)
+    offsets = np.full((len(modes), len(rows), samples), -1, dtype=np.int64)
+    modes_index = {mode: i for i, mode in enumerate(modes)}
+    rows_index = {row: i for i, row in enumerate(rows)}
+    for key, position in store.positions.items():
+        mode, row, sample = key
+        if mode in modes_index and row in rows_index and sample < samples:
+            offsets[modes_index[mode], rows_index[row], sample] = position
+    return offsets
+
+
+def variability(store, modes=None, rows=None, reference="human", chunk=1024):
+    """
+    Computes, for every (mode, question), the dispersion of the samples and their distance to the reference
+    mode, plus the mean distance between the mode centroids.
+    Returns the per-question metrics (long format) and a {metric: modes x modes DataFrame} of centroid distances.
+    """
+    modes = modes or store.modes()
+    rows = rows or list(dict.fromkeys(key[1] for key in store.keys))
+    offsets = group_offsets(store, modes, rows)
+    matrix = store.matrix()
+    reference = modes.index(reference) if reference in modes else None
+    columns = {f"{name}_{metric}": [] for name in ("dispersion", "reference") for metric in METRICS}
+    centroid_sum = {metric: np.zeros((len(modes), len(modes))) for metric in METRICS}
+    centroid_count = np.zeros((len(modes), len(modes)))
+    for start in range(0, len(rows), chunk):
+        group = offsets[:, start:start + chunk]
+        mask = group >= 0
+        tensor = np.where(mask[..., None], matrix[np.maximum(group, 0)], 0).astype(np.float64)
+        for metric in METRICS:
+            columns[f"dispersion_{metric}"].append(dispersion(tensor, mask, metric))
+            columns[f"reference_{metric}"].append(
+                distance_to_reference(tensor, mask, reference, metric) if reference is not None
+                else np.full(mask.shape[:2], np.nan)
+            )
+            distances = centroid_distances(tensor, mask, metric)
+            centroid_sum[metric] += np.nansum(distances, axis=0)
+        centroid_count += np.sum(~np.isnan(distances), axis=0)
+    metrics = pd.DataFrame({
+        "mode": np.repeat(modes, len(rows)),
+        "question": np.tile(np.array(rows, dtype=object), len(modes)),
+        **{name: np.concatenate(values, axis=1).ravel() for name, values in columns.items()}
+    })
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = {metric: pd.DataFrame(centroid_sum[metric] / centroid_count, index=modes, columns=modes)
+                   for metric in METRICS}
+    return metrics, between
@@ -1,69 +1,248 @@
+import asyncio
 import json
 import logging
 import os
 
 from tqdm.auto import tqdm
 
+from core.utils.cache import CachedService, RequestCache
+from core.utils.checkpoint import ReplyLog
+from core.utils.embedding import embed_texts
+from core.utils.instrument import InstrumentedService, Telemetry
 from core.utils.llm import LlmService, OllamaService
+from core.utils.llm import telemetry as call_telemetry
+from core.utils.llm.clients import HttpConfig, registry
+from core.utils.llm.ratelimit import RateLimiter
+from core.utils.store import EmbeddingStore
+from core.utils.table import write_table
+from core.utils.workqueue import WorkQueue, run_worker
 
 
-def store_pandas_in(dataset, filename):
+def store_pandas_in(dataset, filename, formats=("parquet",)):
+    """
+    Stores the dataset as `filename.<format>` for every format in `formats` (see `core.utils.table.EXPORTS`).
+    """
     os.makedirs(os.path.dirname(filename), exist_ok=True)
-    dataset.to_csv(filename + ".csv", index=False)
-    dataset.to_json(filename + ".json")
-    dataset.to_pickle(filename + ".pkl")
+    if "parquet" in formats:
+        write_table(dataset, filename + ".parquet")
+    if "csv" in formats:
+        dataset.to_csv(filename + ".csv", index=False)
+    if "json" in formats:
+        dataset.to_json(filename + ".json")
+    if "pkl" in formats:
+        dataset.to_pickle(filename + ".pkl")
 
 
-def remove_sensitive_rows(dataset, cache_file, service):
+def remove_sensitive_rows(dataset, cache_file, service, batch_size=32, concurrency=4):
     os.makedirs(os.path.dirname(cache_file), exist_ok=True)
     if os.path.exists(cache_file):
         with open(cache_file, 'r') as f:
             rows_to_remove = json.load(f)
     else:
-        end = len(dataset)
-        rows_to_remove = []
-        for chuck in tqdm(range(0, end)):
-            (ok, error) = service.check(dataset["question"][chuck:chuck + 1].tolist())
-            if not ok:
-                rows_to_remove.append(chuck)
+        rows_to_remove = registry.run(
+            find_sensitive_rows(dataset["question"].tolist(), cache_file + ".partial", service, batch_size, concurrency)
+        )
+        with open(cache_file, 'w') as f:
+            json.dump(rows_to_remove, f)
+        os.remove(cache_file + ".partial")
     return rows_to_remove
 
 
+async def find_sensitive_rows(questions, progress_file, service: LlmService, batch_size=32, concurrency=4):
+    """
+    Checks the questions in batches, `concurrency` batches at a time. A rejected batch is bisected: when its first
+    half passes the check, the second one is known to hold a rejected row and is split without checking it,
+    so each rejected row costs O(log batch_size) extra calls. The last row is always checked on its own.
+    The verdict of every batch is appended to `progress_file`, an interrupted scan resumes from it.
+    """
+    covered, removed = set(), set()
+    if os.path.exists(progress_file):
+        valid = 0
+        with open(progress_file, 'r+b') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # a torn last line from a crash, cut so that the next verdict starts a line
+                    break
+                verdict = json.loads(line)
+                covered.update(range(verdict["start"], verdict["end"]))
+                removed.update(verdict["remove"])
+                valid += len(line)
+            f.truncate(valid)
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def rejected(start, end, known=False):
+        # a single row is checked even when known: the batch may be rejected only for a combination of rows
+        if not known or end - start == 1:
+            async with in_flight:
+                ok, error = await service.acheck(questions[start:end])
+            if ok:
+                return []
+        if end - start == 1:
+            return [start]
+        middle = (start + end) // 2
+        left = await rejected(start, middle)
+        return left + await rejected(middle, end, known=not left)
+
+    # the rows no verdict covers, in batches of consecutive rows: the scan may have started with another batch size
+    batches = []
+    for row in range(len(questions)):
+        if row in covered:
+            continue
+        if batches and batches[-1][1] == row and row - batches[-1][0] < batch_size:
+            batches[-1][1] = row + 1
+        else:
+            batches.append([row, row + 1])
+
+    with open(progress_file, 'a') as progress_log:
+        progress = tqdm(total=len(questions), initial=len(questions) - sum(end - start for start, end in batches))
+
+        async def check_batch(start, end):
+            remove = await rejected(start, end)
+            removed.update(remove)
+            progress_log.write(json.dumps({"start": start, "end": end, "remove": remove}) + "\n")
+            progress_log.flush()
+            progress.update(end - start)
+
+        await asyncio.gather(*[check_batch(start, end) for start, end in batches])
+        progress.close()
+    return sorted(removed)
+
+
 def embed_questions_if_not_cached(service: LlmService, dataset, embeddings_file: str):
+    """
+    With a `.json` file the embeddings are a list of float lists, otherwise `embeddings_file` is an
+    `EmbeddingStore` directory: only the questions not yet stored are embedded and the result is a memory map.
+    """
+    if not embeddings_file.endswith(".json"):
+        store = EmbeddingStore(embeddings_file)
+        keys = [("question", row, 0) for row in dataset.index]
+        questions = dict(zip(keys, dataset["question"]))
+        embed_if_not_stored(service, store, questions)
+        return store.get(keys)
     if os.path.exists(embeddings_file):
-        logging.warning("Embeddings already computed")
         with open(embeddings_file, 'r') as f:
-            return json.load(f)
-    else:
-        logging.warning("Computing embeddings")
-        embeddings = []
-        chuck = 100
-        for i in tqdm(range(0, len(dataset), chuck)):
-            current = service.embedChucks(dataset[i:i + chuck]['question'].tolist())
-            embeddings.extend(current)
-        with open(embeddings_file, 'w') as f:
-            json.dump(embeddings, f)
-        logging.warning(f"Embeddings computed and stored in {embeddings_file}")
-        return embeddings
-
-
-def produce_response_for(llm_service: LlmService, dataset, max_tokens=250, how_many=3):
-    store = []  ## row, responses
-    for f in tqdm(list(dataset.iterrows())):
-        question = f[1]["question"]
-        collect_replies = []
+            embeddings = json.load(f)
+        if len(embeddings) == len(dataset):
+            logging.warning("Embeddings already computed")
+            return embeddings
+        # the dataset changed, with a request cache only the new questions reach the service
+        logging.warning("Embeddings computed for a different dataset, computing them again")
+    logging.warning("Computing embeddings")
+    embeddings = embed_texts(service, dataset['question'].tolist())
+    with open(embeddings_file, 'w') as f:
+        json.dump(embeddings, f)
+    logging.warning(f"Embeddings computed and stored in {embeddings_file}")
+    return embeddings
+
+
+def embed_replies_if_not_cached(service: LlmService, replies: dict, store: EmbeddingStore, **pipeline):
+    """
+    Embeds the replies (`{mode: [(row, [replies])]}`) into the store as `(mode, row, sample)`.
+    Nested replies (the human answers, each one repeated in a list) are flattened keeping one copy of each, so the
+    sample is the position of the answer: repeated copies would be zero-distance pairs lowering the dispersion.
+    A mode stored with other samples (e.g., with the repeated copies) is dropped and embedded again.
+    """
+    texts = {}
+    for mode in replies:
+        for row, responses in replies[mode]:
+            flatten = [item for response in responses
+                       for item in (dict.fromkeys(response) if isinstance(response, list) else [response])]
+            texts.update(((mode, row, sample), text) for sample, text in enumerate(flatten))
+    stale = {key[0] for key in store.keys if key[0] in replies and key not in texts}
+    for mode in stale:
+        logging.warning(f"Embeddings of {mode} stored with other samples, computing them again")
+        store.drop(mode)
+    embed_if_not_stored(service, store, texts, **pipeline)
+    return store
+
+
+def embed_if_not_stored(service: LlmService, store: EmbeddingStore, texts: dict, chuck=5000, **pipeline):
+    """
+    Embeds the `{key: text}` entries missing from the store through the embedding pipeline (`embed_texts`),
+    `chuck` keys at a time so that an interrupted run keeps what it already stored.
+    """
+    missing = [key for key in texts if key not in store]
+    if not missing:
+        logging.warning("Embeddings already computed")
+        return
+    logging.warning(f"Computing {len(missing)} embeddings")
+    for i in range(0, len(missing), chuck):
+        keys = missing[i:i + chuck]
+        store.extend(keys, embed_texts(service, [texts[key] for key in keys], **pipeline))
+
+
+def produce_response_for(llm_service: LlmService, dataset, max_tokens=250, how_many=3, concurrency=None, log=None,
+                         name=None):
+    return registry.run(
+        produce_response_for_async(llm_service, dataset, max_tokens, how_many, concurrency, log, name)
+    )
+
+
+async def produce_response_for_async(llm_service: LlmService, dataset, max_tokens=250, how_many=3, concurrency=None,
+                                     log: ReplyLog = None, name: str = None):
+    """
+    Keeps up to `concurrency` (default: the service one) questions in flight, each one asking its `how_many`
+    samples through `complete_samples`.
+    With a `ReplyLog`, every sample is appended to it (as `name`) when produced, with its time to first token and
+    decoding rate (None for a cached reply), and only the samples missing from the log are asked.
+    The result keeps the dataset order, questions with a failing sample are dropped.
+    """
+    in_flight = asyncio.Semaphore(concurrency or llm_service.concurrency)
+    progress = tqdm(total=len(dataset))
+
+    async def timed(question, samples):
+        # the replies with the timing of each one: the samples of a question may stream concurrently
+        record = call_telemetry.new_record()
+        with call_telemetry.recording(record):
+            texts = await llm_service.acomplete_samples(question, max_tokens, samples)
+        return [(text, call_telemetry.sample_timing(record, sample)) for sample, text in zip(samples, texts)]
+
+    async def ask(question, missing):
+        # by index, a request cache must not give back the samples already in the log
         try:
-            for i in range(how_many):
-                response_service = llm_service.complete(question, max_tokens)
-                collect_replies.append(response_service)
+            return await timed(question, missing)
+        except Exception:
+            if log is None:
+                raise
+            # one sample at a time, so the ones that succeed are kept in the log
+            replies = await asyncio.gather(*[timed(question, [sample]) for sample in missing], return_exceptions=True)
+            return [reply if isinstance(reply, Exception) else reply[0] for reply in replies]
+
+    async def replies_for(index, question):
+        samples = log.samples(name, index) if log else {}
+        missing = [sample for sample in range(how_many) if sample not in samples]
+        try:
+            if missing:
+                async with in_flight:
+                    produced = await ask(question, missing)
+                for sample, reply in zip(missing, produced):
+                    if isinstance(reply, Exception):
+                        continue
+                    text, timing = reply
+                    samples[sample] = text
+                    log.append(name, index, sample, text, **timing) if log else None
+                errors = [reply for reply in produced if isinstance(reply, Exception)]
+                if errors:
+                    raise errors[0]
         except Exception as e:
             print(f"Error: {e}")
-            collect_replies = []
-            continue
-        store.append((f[0], collect_replies))
-    return store
+            return None
+        finally:
+            progress.update(1)
+        return index, [samples[sample] for sample in range(how_many)]
 
-def services_loader(file):
+    store = await asyncio.gather(*[replies_for(index, question)
+                                   for index, question in zip(dataset.index, dataset["question"])])
+    progress.close()
+    return [row for row in store if row is not None]
+
+
+def services_loader(file, cache=None, worker=None, telemetry=None):
+    """
+    Loads the services described in `file`, when a `RequestCache` is given each service is wrapped by it.
+    An Ollama entry can list several `hosts`: the worker `worker` uses `hosts[worker % len(hosts)]`.
+    With a `Telemetry`, the calls that reach the backends (not the cache hits) are recorded under the entry name.
+    """
     services = {}
 
     with open(file, 'r') as f:
@@ -72,5 +251,52 @@ def services_loader(file):
             if "filename" in llms[llm] and "where" in llms[llm]:
                 services[llm] = LlmService.from_file(llms[llm]["where"], llms[llm]["filename"])
             elif "model" in llms[llm]:
-                services[llm] = OllamaService(llms[llm]["model"])
+                hosts = llms[llm].get("hosts", [None])
+                host = hosts[(worker or 0) % len(hosts)]
+                limiter = RateLimiter.from_config(llms[llm].get("rate_limit"))
+                services[llm] = OllamaService(llms[llm]["model"], limiter, host, llms[llm].get("keep_alive", "30m"),
+                                              HttpConfig.from_config(llms[llm].get("http")))
+            if "concurrency" in llms[llm]:
+                services[llm].concurrency = llms[llm]["concurrency"]
+            if telemetry is not None:
+                services[llm] = InstrumentedService(services[llm], telemetry, llm)
+            if cache is not None:
+                services[llm] = CachedService(services[llm], cache)
         return services
+
+
+def residency_order(services: dict) -> list:
+    """
+    Orders the services so that the ones sharing a model run one after the other and the largest local models
+    are loaded first, while the memory holds nothing else; remote services (no footprint) come first.
+    """
+    footprints = {}
+    for name in services:
+        try:
+            footprints[name] = services[name].footprint()
+        except Exception as e:
+            logging.warning(f"Footprint of {name} not available: {e}")
+            footprints[name] = 0
+    return sorted(services, key=lambda name: (footprints[name] > 0, -footprints[name],
+                                              getattr(services[name], "model", name)))
+
+
+def generation_worker(queue_file, services_file, worker, request_cache=None, max_tokens=250, telemetry_log=None,
+                      metrics_file=None):
+    """
+    Entry point of a worker process of the sharded generation.
+    The workers share the telemetry log; each one writes its own metrics file, `<name>-worker-<worker>.prom`.
+    """
+    cache = RequestCache(request_cache) if request_cache else None
+    telemetry = None
+    if telemetry_log or metrics_file:
+        base, extension = os.path.splitext(metrics_file) if metrics_file else (None, None)
+        telemetry = Telemetry(telemetry_log, f"{base}-worker-{worker}{extension}" if metrics_file else None,
+                              labels={"worker": f"worker-{worker}"})
+    services = services_loader(services_file, cache, worker, telemetry)
+    try:
+        load_times = run_worker(WorkQueue(queue_file), services, f"worker-{worker}", max_tokens)
+    finally:
+        if telemetry is not None:
+            telemetry.close()
+    print(f"Load times (worker-{worker}): {load_times}")
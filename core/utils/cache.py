@@ -0,0 +1,187 @@
+"""
+Request level cache for LLM services.
+Every completion, embedding and safety check is stored in a local SQLite file, keyed by the hash of the service
+identity (backend, model, sampling parameters), the operation, the input and, for completions, the sample index.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from core.utils.llm import LlmService, ServiceWrapper
+
+
+class RequestCache:
+    def __init__(self, filename: str, max_bytes: int = 2 ** 30):
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def key(**parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict:
+        if not keys:
+            return {}
+        with self.lock:
+            found = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self.connection.execute(f"SELECT key, value FROM entries WHERE key IN ({marks})", chunk)
+                found.update((key, json.loads(value)) for key, value in rows)
+                self.connection.execute(f"UPDATE entries SET accessed = ? WHERE key IN ({marks})",
+                                        [time.time(), *chunk])
+            return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, entries: dict):
+        if not entries:
+            return
+        with self.lock:
+            now = time.time()
+            rows = [(key, json.dumps(value)) for key, value in entries.items()]
+            replaced = self._sizes([key for key, _ in rows])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in rows]
+            )
+            self.size += sum(len(value) for _, value in rows) - replaced
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def put(self, key: str, value):
+        self.put_many({key: value})
+
+    def _sizes(self, keys: list[str]) -> int:
+        marks = ",".join("?" * len(keys))
+        return self.connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({marks})",
+                                       keys).fetchone()[0]
+
+    def _evict(self):
+        # least recently used entries go first, down to 90% of the budget to avoid evicting at every insert
+        excess = self.size - self.max_bytes * 0.9
+        victims = []
+        for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY accessed, rowid"):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+            self.size -= size
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedService(ServiceWrapper):
+    """
+    Wraps a service so that only requests never seen before reach the backend.
+    Completions are cached per sample index: asking 4 samples after 3 only produces the 4th, asking the samples
+    `[1, 2]` (`complete_samples`) only reuses the cached samples 1 and 2.
+    """
+
+    def __init__(self, service: LlmService, cache: RequestCache):
+        super().__init__(service)
+        self.cache = cache
+
+    def _key(self, operation: str, text, **parameters) -> str:
+        return RequestCache.key(service=self.identity(), operation=operation, input=text, **parameters)
+
+    def _completion_keys(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        return [self._key("complete", text, max_output=max_output, sample=i) for i in samples]
+
+    def _fill(self, keys: list[str], found: dict, produced: list) -> list:
+        missing = [key for key in keys if key not in found]
+        self.cache.put_many(dict(zip(missing, produced)))
+        found.update(zip(missing, produced))
+        return [found[key] for key in keys]
+
+    def complete(self, text: str, max_output: int) -> str:
+        return self.complete_many(text, max_output, 1)[0]
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        return (await self.acomplete_many(text, max_output, 1))[0]
+
+    def complete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return self.complete_samples(text, max_output, list(range(n)))
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return await self.acomplete_samples(text, max_output, list(range(n)))
+
+    def complete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        keys = self._completion_keys(text, max_output, samples)
+        found = self.cache.get_many(keys)
+        missing = [sample for sample, key in zip(samples, keys) if key not in found]
+        produced = self.service.complete_samples(text, max_output, missing) if missing else []
+        return self._fill(keys, found, produced)
+
+    async def acomplete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        keys = self._completion_keys(text, max_output, samples)
+        found = self.cache.get_many(keys)
+        missing = [sample for sample, key in zip(samples, keys) if key not in found]
+        produced = await self.service.acomplete_samples(text, max_output, missing) if missing else []
+        return self._fill(keys, found, produced)
+
+    # through the cache, a reply comes at once
+    def stream(self, text: str, max_output: int):
+        yield self.complete(text, max_output)
+
+    async def astream(self, text: str, max_output: int):
+        yield await self.acomplete(text, max_output)
+
+    def embed(self, text: str):
+        return self.embedChucks([text])[0]
+
+    async def aembed(self, text: str):
+        key = self._key("embed", text)
+        found = self.cache.get(key)
+        if found is None:
+            found = await self.service.aembed(text)
+            self.cache.put(key, found)
+        return found
+
+    def embedChucks(self, text: list[str]):
+        keys = [self._key("embed", t) for t in text]
+        found = self.cache.get_many(keys)
+        missing = [t for t, key in zip(text, keys) if key not in found]
+        produced = self.service.embedChucks(missing) if missing else []
+        return self._fill(keys, found, produced)
+
+    async def aembedChucks(self, text: list[str]):
+        keys = [self._key("embed", t) for t in text]
+        found = self.cache.get_many(keys)
+        missing = [t for t, key in zip(text, keys) if key not in found]
+        produced = await self.service.aembedChucks(missing) if missing else []
+        return self._fill(keys, found, produced)
+
+    def check(self, text) -> (bool, object):
+        key = self._key("check", text)
+        found = self.cache.get(key)
+        if found is None:
+            ok, error = self.service.check(text)
+            found = [ok, str(error) if not ok else {}]
+            self.cache.put(key, found)
+        return found[0], found[1]
+
+    async def acheck(self, text) -> (bool, object):
+        key = self._key("check", text)
+        found = self.cache.get(key)
+        if found is None:
+            ok, error = await self.service.acheck(text)
+            found = [ok, str(error) if not ok else {}]
+            self.cache.put(key, found)
+        return found[0], found[1]
@@ -0,0 +1,100 @@
+"""
+Append-only log of the generated replies.
+Each finished (service, row, sample) is written as one JSON line as soon as it is produced, so a crashed run
+resumes from the exact missing samples. `compact` rewrites the log keeping one line per sample and returns the
+replies in the `{service: [(row, [replies])]}` shape used by the data.json/data.pkl artifacts.
+"""
+import json
+import os
+import threading
+
+
+def plain(value):
+    # numpy/pandas scalars (e.g., the dataset index) are not json serializable
+    return value.item() if hasattr(value, "item") else value
+
+
+class ReplyLog:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}  # service -> row -> sample -> record
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if os.path.exists(filename):
+            self._load()
+        self.file = open(filename, 'a')
+
+    def _load(self):
+        valid = 0
+        with open(self.filename, 'r+b') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # a torn last line from a crash, cut so that the next append starts a line; the sample is asked
+                    # again
+                    break
+                self._remember(json.loads(line))
+                valid += len(line)
+            f.truncate(valid)
+
+    def _remember(self, record):
+        self.entries.setdefault(record["service"], {}).setdefault(record["row"], {})[record["sample"]] = record
+
+    def append(self, service: str, row, sample: int, text: str, **extra):
+        record = {"service": service, "row": plain(row), "sample": sample, "text": text, **extra}
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            self._remember(record)
+
+    def samples(self, service: str, row) -> dict:
+        return {sample: record["text"] for sample, record in self.entries.get(service, {}).get(plain(row), {}).items()}
+
+    def missing(self, service: str, row, how_many: int) -> list[int]:
+        done = self.entries.get(service, {}).get(plain(row), {})
+        return [sample for sample in range(how_many) if sample not in done]
+
+    def replies(self, service: str, rows, how_many: int) -> list:
+        result = []
+        for row in rows:
+            samples = self.samples(service, row)
+            if all(sample in samples for sample in range(how_many)):
+                result.append((plain(row), [samples[sample] for sample in range(how_many)]))
+        return result
+
+    def import_replies(self, replies: dict):
+        # seeds the log with a previous data.json, rows are [row, [replies]]
+        for service in replies:
+            for row, responses in replies[service]:
+                for sample, text in enumerate(responses):
+                    if sample not in self.samples(service, row):
+                        self.append(service, row, sample, text)
+
+    def drop(self, service: str):
+        with self.lock:
+            self.entries.pop(service, None)
+        self.compact()
+
+    def compact(self, services=None, rows=None, how_many=None):
+        """
+        Rewrites the log with one line per sample (atomically) and, when `services`, `rows` and `how_many` are
+        given, returns the complete replies of each service.
+        """
+        with self.lock:
+            self.file.close()
+            temporary = self.filename + ".compact"
+            with open(temporary, 'w') as f:
+                for service in self.entries:
+                    for row in self.entries[service]:
+                        for sample in sorted(self.entries[service][row]):
+                            f.write(json.dumps(self.entries[service][row][sample]) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.filename)
+            self.file = open(self.filename, 'a')
+        if services is None:
+            return None
+        return {service: self.replies(service, rows, how_many) for service in services}
+
+    def close(self):
+        self.file.close()
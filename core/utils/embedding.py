@@ -0,0 +1,76 @@
+"""
+Embedding pipeline: identical texts are embedded once (deduplicated by hash), the unique texts are packed in
+batches bounded by an estimated token budget and a maximum number of inputs, and the batches are sent
+concurrently. The vectors are then fanned out to every position that referenced the text.
+"""
+import asyncio
+import hashlib
+
+from tqdm.auto import tqdm
+
+from core.utils.llm import LlmService, estimate_tokens
+from core.utils.llm.clients import registry
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def deduplicate(texts: list[str]):
+    """
+    Returns the unique texts and, for every text, the position of its unique copy.
+    """
+    positions = {}
+    unique = []
+    references = []
+    for text in texts:
+        digest = text_hash(text)
+        if digest not in positions:
+            positions[digest] = len(unique)
+            unique.append(text)
+        references.append(positions[digest])
+    return unique, references
+
+
+def pack_batches(texts: list[str], max_tokens: int = 100_000, max_items: int = 100) -> list[list[int]]:
+    """
+    Groups the positions of `texts` in batches of at most `max_items` texts and `max_tokens` estimated tokens,
+    a text larger than the budget goes in a batch of its own.
+    """
+    batches = []
+    current, tokens = [], 0
+    for i, text in enumerate(texts):
+        size = estimate_tokens(text)
+        if current and (len(current) >= max_items or tokens + size > max_tokens):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(i)
+        tokens += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def aembed_texts(service: LlmService, texts: list[str], max_tokens: int = 100_000, max_items: int = 100,
+                       concurrency: int = 4, progress: bool = True) -> list:
+    unique, references = deduplicate(texts)
+    batches = pack_batches(unique, max_tokens, max_items)
+    vectors = [None] * len(unique)
+    in_flight = asyncio.Semaphore(concurrency)
+    bar = tqdm(total=len(unique), disable=not progress)
+
+    async def embed(batch):
+        async with in_flight:
+            result = await service.aembedChucks([unique[i] for i in batch])
+        for i, vector in zip(batch, result):
+            vectors[i] = vector
+        bar.update(len(batch))
+
+    await asyncio.gather(*[embed(batch) for batch in batches])
+    bar.close()
+    return [vectors[i] for i in references]
+
+
+def embed_texts(service: LlmService, texts: list[str], max_tokens: int = 100_000, max_items: int = 100,
+                concurrency: int = 4, progress: bool = True) -> list:
+    return registry.run(aembed_texts(service, texts, max_tokens, max_items, concurrency, progress))
@@ -0,0 +1,209 @@
+"""
+Approximate nearest-neighbour index (IVF) over the vectors of an EmbeddingStore.
+The vectors are clustered with k-means in `lists` inverted lists; a query only scans the lists of its `probes`
+nearest centroids. The index covers the first rows of the store and keeps, per row, its list and its mode
+(the first element of the store key), so the vectors are read from the store memory map and the queries can be
+restricted to some modes. Rows appended to the store later are added to their nearest list by `update`; the
+saved index keeps the generation of the store, an index of a rewritten store is discarded and trained again.
+"""
+import os
+
+import numpy as np
+
+
+def _prepare(vectors, metric: str) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric == "cosine":
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+    return vectors
+
+
+def _distances(queries, vectors, metric: str) -> np.ndarray:
+    # on prepared (i.e., normalized for cosine) vectors
+    dots = queries @ vectors.T
+    if metric == "cosine":
+        return 1 - dots
+    squared = (queries ** 2).sum(axis=1)[:, None] + (vectors ** 2).sum(axis=1)[None, :]
+    return np.sqrt(np.maximum(squared - 2 * dots, 0))
+
+
+def _top(distances, k: int):
+    k = min(k, distances.shape[1])
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(distances, top, axis=1).argsort(axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def nearest_centroid(vectors, centroids, metric: str, chunk: int = 65536) -> np.ndarray:
+    return np.concatenate([_distances(vectors[start:start + chunk], centroids, metric).argmin(axis=1)
+                           for start in range(0, len(vectors), chunk)] or [np.empty(0, dtype=np.int64)])
+
+
+def kmeans(vectors, clusters: int, metric: str = "cosine", iterations: int = 20, seed: int = 42) -> np.ndarray:
+    """
+    Lloyd's k-means on prepared vectors (spherical for cosine); empty clusters are moved to random vectors.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(vectors, centroids, metric)
+        counts = np.bincount(assignment, minlength=clusters)
+        order = np.argsort(assignment, kind="stable")
+        sums = np.zeros_like(centroids)
+        sums[counts > 0] = np.add.reduceat(vectors[order], np.cumsum(counts)[counts > 0] - counts[counts > 0])
+        empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = _prepare(centroids, metric)
+    return centroids
+
+
+def exact_search(matrix, queries, k: int = 10, metric: str = "cosine", candidates=None, chunk: int = 65536):
+    """
+    Brute-force k-NN of `queries` among the rows of `matrix` (or its `candidates` rows), read chunk by chunk.
+    Returns the (queries x k) distances and row offsets.
+    """
+    queries = _prepare(queries, metric)
+    candidates = np.arange(len(matrix)) if candidates is None else np.asarray(candidates)
+    best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+    best_offsets = np.full((len(queries), 0), -1, dtype=np.int64)
+    for start in range(0, len(candidates), chunk):
+        offsets = candidates[start:start + chunk]
+        distances = np.concatenate([best_distances, _distances(queries, _prepare(matrix[offsets], metric), metric)],
+                                   axis=1)
+        offsets = np.concatenate([best_offsets, np.broadcast_to(offsets, (len(queries), len(offsets)))], axis=1)
+        top = _top(distances, k)
+        best_distances = np.take_along_axis(distances, top, axis=1)
+        best_offsets = np.take_along_axis(offsets, top, axis=1)
+    return best_distances, best_offsets
+
+
+class IvfIndex:
+    def __init__(self, store, filename: str = None, metric: str = "cosine", lists: int = None,
+                 iterations: int = 20, sample: int = 50_000, seed: int = 42):
+        self.store = store
+        self.filename = filename or os.path.join(store.directory, f"ivf-{metric}.npz")
+        self.metric = metric
+        self.lists = lists
+        self.iterations = iterations
+        self.sample = sample
+        self.seed = seed
+        self.centroids = None
+        self.assignment = np.empty(0, dtype=np.int64)
+        self.mode_codes = np.empty(0, dtype=np.int32)
+        self.modes = []
+        if os.path.exists(self.filename):
+            with np.load(self.filename) as data:
+                # an index of the store before a rewrite (e.g., a mode dropped) is trained again
+                if self._matches(data):
+                    self.centroids = data["centroids"]
+                    self.assignment = data["assignment"]
+                    self.mode_codes = data["mode_codes"]
+                    self.modes = data["modes"].tolist()
+                    self.lists = len(self.centroids)
+        self._group()
+
+    def _matches(self, data) -> bool:
+        # the rows of the store are only appended within a generation
+        return ("generation" in data.files and int(data["generation"]) == self.store.generation
+                and len(data["assignment"]) <= len(self.store))
+
+    def __len__(self):
+        return len(self.assignment)
+
+    def _group(self):
+        # the rows of every list, contiguous in `members`
+        self.members = np.argsort(self.assignment, kind="stable")
+        self.bounds = np.searchsorted(self.assignment[self.members], np.arange((self.lists or 0) + 1))
+
+    def train(self):
+        """
+        Clusters a sample of the store rows; the rows already indexed are assigned again.
+        """
+        matrix = self.store.matrix()
+        lists = min(len(matrix), self.lists or max(1, int(4 * np.sqrt(len(matrix)))))
+        rng = np.random.default_rng(self.seed)
+        picked = np.sort(rng.choice(len(matrix), size=min(len(matrix), max(self.sample, lists)), replace=False))
+        self.centroids = kmeans(_prepare(matrix[picked], self.metric), lists, self.metric, self.iterations, self.seed)
+        self.lists = lists
+        indexed = len(self)
+        self.assignment = np.empty(0, dtype=np.int64)
+        self.mode_codes = self.mode_codes[:0]
+        self._add(0, indexed)
+
+    def update(self, chunk: int = 65536) -> int:
+        """
+        Indexes the store rows appended since the last update (training the index the first time) and saves it.
+        Returns the number of rows added.
+        """
+        start = len(self)
+        if start == len(self.store):
+            return 0
+        if self.centroids is None:
+            self.train()
+        self._add(len(self), len(self.store), chunk)
+        self.save()
+        return len(self) - start
+
+    def _add(self, start: int, end: int, chunk: int = 65536):
+        matrix = self.store.matrix()
+        codes = {mode: i for i, mode in enumerate(self.modes)}
+        assignments, mode_codes = [self.assignment], [self.mode_codes]
+        for begin in range(start, end, chunk):
+            stop = min(end, begin + chunk)
+            assignments.append(nearest_centroid(_prepare(matrix[begin:stop], self.metric), self.centroids,
+                                                self.metric))
+            for key in self.store.keys[begin:stop]:
+                if key[0] not in codes:
+                    codes[key[0]] = len(self.modes)
+                    self.modes.append(key[0])
+            mode_codes.append(np.fromiter((codes[key[0]] for key in self.store.keys[begin:stop]), dtype=np.int32))
+        self.assignment = np.concatenate(assignments)
+        self.mode_codes = np.concatenate(mode_codes)
+        self._group()
+
+    def save(self):
+        temporary = self.filename + ".tmp"
+        with open(temporary, 'wb') as f:
+            np.savez(f, centroids=self.centroids, assignment=self.assignment, mode_codes=self.mode_codes,
+                     modes=np.array(self.modes, dtype=str), generation=self.store.generation)
+        os.replace(temporary, self.filename)
+
+    def search(self, queries, k: int = 10, modes=None, probes: int = 8):
+        """
+        Batched k-NN of `queries` among the indexed rows (of `modes` only, when given), scanning the `probes`
+        lists nearest to each query. Returns the (queries x k) distances and store offsets, padded with inf / -1
+        when fewer than k rows are found.
+        """
+        queries = _prepare(np.atleast_2d(queries), self.metric)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        offsets = np.full((len(queries), k), -1, dtype=np.int64)
+        if not len(self):
+            return distances, offsets
+        probes = min(probes, self.lists)
+        nearest = _top(_distances(queries, self.centroids, self.metric), probes)
+        allowed = None if modes is None else np.isin(self.mode_codes,
+                                                     [self.modes.index(mode) for mode in modes if mode in self.modes])
+        matrix = self.store.matrix()
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self.members[self.bounds[l]:self.bounds[l + 1]] for l in nearest[i]])
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            if not len(candidates):
+                continue
+            # sorted offsets read the memory map sequentially
+            candidates.sort()
+            found = _distances(query[None, :], _prepare(matrix[candidates], self.metric), self.metric)
+            top = _top(found, k)[0]
+            distances[i, :len(top)] = found[0, top]
+            offsets[i, :len(top)] = candidates[top]
+        return distances, offsets
+
+    def neighbors(self, keys, k: int = 10, modes=None, probes: int = 8) -> list:
+        """
+        The k nearest store keys (with their distance) of the vectors of some store `keys`.
+        """
+        distances, offsets = self.search(self.store.get(keys), k, modes, probes)
+        return [[(self.store.keys[offset], float(distance)) for distance, offset in zip(row, found) if offset >= 0]
+                for row, found in zip(distances, offsets)]
@@ -0,0 +1,266 @@
+"""
+Per-request instrumentation of the LLM services.
+`InstrumentedService` records every call of the wrapped service: latency, time to first token and decoding rate
+(tokens per second after the first one) of the streaming calls, prompt and completion tokens (as reported by the
+backend, counted on the stream), retries, truncation by the output budget and error, tagged with the service name,
+model and operation. `Telemetry` appends the records to a JSON-lines log and keeps per (service, model, operation)
+counters and latency histograms, written periodically as a Prometheus textfile (e.g., for the node exporter
+textfile collector), so a backend degrading during a sweep shows up while it runs.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from core.utils.llm import LlmService, ServiceWrapper
+from core.utils.llm import telemetry
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _labels(values: dict) -> str:
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for name, value in values.items()}
+    return ",".join(f'{name}="{value}"' for name, value in escaped.items())
+
+
+class Telemetry:
+    """
+    Sink of the call records. The `labels` (e.g., the worker) are added to every metric, so that the textfiles of
+    several processes can be collected side by side.
+    """
+
+    def __init__(self, log_file: str = None, metrics_file: str = None, interval: float = 15.0,
+                 buckets=BUCKETS, labels: dict = None):
+        self.metrics_file = metrics_file
+        self.labels = labels or {}
+        self.interval = interval
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.log = None
+        if log_file:
+            os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+            self.log = open(log_file, 'a')
+        if metrics_file:
+            os.makedirs(os.path.dirname(metrics_file) or ".", exist_ok=True)
+        # (service, model, operation) -> counters
+        self.series = defaultdict(lambda: {
+            "requests": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0, "errors": defaultdict(int),
+            "latency": [0] * len(self.buckets), "latency_sum": 0.0, "ttft": [0] * len(self.buckets),
+            "ttft_sum": 0.0, "ttft_count": 0
+        })
+        self.written = time.monotonic()
+
+    def record(self, record: dict):
+        with self.lock:
+            if self.log:
+                self.log.write(json.dumps(record) + "\n")
+                self.log.flush()
+            series = self.series[(record["service"], record["model"], record["operation"])]
+            series["requests"] += 1
+            series["retries"] += record.get("retries") or 0
+            series["prompt_tokens"] += record.get("prompt_tokens") or 0
+            series["completion_tokens"] += record.get("completion_tokens") or 0
+            if record.get("error"):
+                series["errors"][record["error"]] += 1
+            self._observe(series, "latency", record["latency"])
+            if record.get("ttft") is not None:
+                self._observe(series, "ttft", record["ttft"])
+                series["ttft_count"] += 1
+            due = self.metrics_file and time.monotonic() - self.written >= self.interval
+        if due:
+            self.write_metrics()
+
+    def _observe(self, series: dict, name: str, value: float):
+        series[f"{name}_sum"] += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[name][i] += 1
+
+    def metrics(self) -> str:
+        """
+        The counters in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def family(name, kind, description, samples):
+            lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {kind}"])
+            lines.extend(f"{name}{{{_labels(labels)}}} {value}" for labels, value in samples)
+
+        with self.lock:
+            series = {key: {**value, "errors": dict(value["errors"])} for key, value in self.series.items()}
+        keys = {key: {**self.labels, "service": key[0], "model": key[1], "operation": key[2]} for key in series}
+        family("llm_requests_total", "counter", "LLM calls.",
+               [(keys[key], value["requests"]) for key, value in series.items()])
+        family("llm_errors_total", "counter", "LLM calls that raised, by error type.",
+               [({**keys[key], "error": error}, count) for key, value in series.items()
+                for error, count in value["errors"].items()])
+        family("llm_retries_total", "counter", "Requests retried by the rate limiter.",
+               [(keys[key], value["retries"]) for key, value in series.items()])
+        family("llm_tokens_total", "counter", "Tokens reported by the backend.",
+               [({**keys[key], "kind": kind}, value[f"{kind}_tokens"]) for key, value in series.items()
+                for kind in ("prompt", "completion")])
+        for name, description, count in (("latency", "Latency of the LLM calls.", "requests"),
+                                         ("ttft", "Time to first token of the streaming LLM calls.", "ttft_count")):
+            samples = []
+            for key, value in series.items():
+                samples.extend(({**keys[key], "le": bound}, hits) for bound, hits in zip(self.buckets, value[name]))
+                samples.append(({**keys[key], "le": "+Inf"}, value[count]))
+            lines.extend([f"# HELP llm_{name}_seconds {description}", f"# TYPE llm_{name}_seconds histogram"])
+            lines.extend(f"llm_{name}_seconds_bucket{{{_labels(labels)}}} {hits}" for labels, hits in samples)
+            lines.extend(f"llm_{name}_seconds_sum{{{_labels(keys[key])}}} {value[f'{name}_sum']}"
+                         for key, value in series.items())
+            lines.extend(f"llm_{name}_seconds_count{{{_labels(keys[key])}}} {value[count]}"
+                         for key, value in series.items())
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        if not self.metrics_file:
+            return
+        # atomically, the collector must never read half a file
+        temporary = self.metrics_file + ".tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.metrics())
+        os.replace(temporary, self.metrics_file)
+        self.written = time.monotonic()
+
+    def close(self):
+        self.write_metrics()
+        if self.log:
+            self.log.close()
+
+
+class InstrumentedService(ServiceWrapper):
+    """
+    Wraps a service so that every call is recorded in a `Telemetry` as `name`.
+    """
+
+    def __init__(self, service: LlmService, sink: Telemetry, name: str = None):
+        super().__init__(service)
+        self.sink = sink
+        self.name = name or service.identity().get("model", type(service).__name__)
+
+    def _open(self, operation: str, items: int) -> dict:
+        return telemetry.new_record(time=time.time(), service=self.name, model=self.identity().get("model"),
+                                    operation=operation, items=items, latency=None, ttft=None, tokens_per_second=None,
+                                    prompt_tokens=None, completion_tokens=None, retries=0, truncated=False,
+                                    cancelled=False, error=None)
+
+    def _close(self, record: dict, error: BaseException = None):
+        record.update(telemetry.timing(record))
+        # the timing of the samples is for the caller, the log keeps the one of the call
+        del record["started"]
+        record.pop("samples", None)
+        if error is not None:
+            record["error"] = type(error).__name__
+        self.sink.record(record)
+
+    def _call(self, operation: str, items: int, function, *arguments):
+        record = self._open(operation, items)
+        try:
+            with telemetry.recording(record):
+                result = function(*arguments)
+        except Exception as e:
+            self._close(record, e)
+            raise
+        if operation == "check" and not result[0]:
+            record["error"] = "Rejected"
+        self._close(record)
+        return result
+
+    async def _acall(self, operation: str, items: int, function, *arguments):
+        record = self._open(operation, items)
+        try:
+            with telemetry.recording(record):
+                result = await function(*arguments)
+        except Exception as e:
+            self._close(record, e)
+            raise
+        if operation == "check" and not result[0]:
+            record["error"] = "Rejected"
+        self._close(record)
+        return result
+
+    def stream(self, text: str, max_output: int):
+        # the record is current only while the stream produces, not while the caller consumes
+        record = self._open("stream", 1)
+        chunks = self.service.stream(text, max_output)
+        error = None
+        try:
+            while True:
+                with telemetry.recording(record):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        except GeneratorExit:
+            # closed by the consumer before the end
+            record["cancelled"] = True
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            with telemetry.recording(record):
+                chunks.close()
+            self._close(record, error)
+
+    async def astream(self, text: str, max_output: int):
+        record = self._open("stream", 1)
+        chunks = self.service.astream(text, max_output)
+        error = None
+        try:
+            while True:
+                with telemetry.recording(record):
+                    chunk = await anext(chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        except GeneratorExit:
+            record["cancelled"] = True
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            with telemetry.recording(record):
+                await chunks.aclose()
+            self._close(record, error)
+
+    def complete(self, text: str, max_output: int) -> str:
+        return self._call("complete", 1, self.service.complete, text, max_output)
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        return await self._acall("complete", 1, self.service.acomplete, text, max_output)
+
+    def complete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return self._call("complete", n, self.service.complete_many, text, max_output, n)
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return await self._acall("complete", n, self.service.acomplete_many, text, max_output, n)
+
+    def complete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        return self._call("complete", len(samples), self.service.complete_samples, text, max_output, samples)
+
+    async def acomplete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        return await self._acall("complete", len(samples), self.service.acomplete_samples, text, max_output,
+                                 samples)
+
+    def embed(self, text: str):
+        return self._call("embed", 1, self.service.embed, text)
+
+    async def aembed(self, text: str):
+        return await self._acall("embed", 1, self.service.aembed, text)
+
+    def embedChucks(self, text: list[str]):
+        return self._call("embed", len(text), self.service.embedChucks, text)
+
+    async def aembedChucks(self, text: list[str]):
+        return await self._acall("embed", len(text), self.service.aembedChucks, text)
+
+    def check(self, text) -> (bool, object):
+        return self._call("check", len(text) if isinstance(text, list) else 1, self.service.check, text)
+
+    async def acheck(self, text) -> (bool, object):
+        return await self._acall("check", len(text) if isinstance(text, list) else 1, self.service.acheck, text)
@@ -1,9 +1,14 @@
+import asyncio
 import json
+import logging
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
-import ollama
-from openai import BadRequestError
-from openai.lib.azure import AzureOpenAI
+from core.utils.llm import telemetry
+from core.utils.llm.clients import HttpConfig, registry
+from core.utils.llm.ratelimit import RateLimiter, retry_after_seconds
 
 
 class KeyLoader(ABC):
@@ -23,6 +28,8 @@ class FileKeyLoader(KeyLoader):
 
 
 class LlmService:
+    # how many requests the generation engine keeps in flight for this service
+    concurrency = 1
 
     def embed(self, text: str): pass
 
@@ -32,59 +39,497 @@ class LlmService:
 
     def complete(self, text: str, max_output: int) -> str: pass
 
+    # what makes two replies of this service comparable (backend, model, sampling parameters)
+    def identity(self) -> dict:
+        return {"backend": type(self).__name__}
+
+    # model residency, only meaningful for local backends: the memory needed by the model, loading it ahead of the
+    # requests (returns the load time in seconds) and unloading it
+    def footprint(self) -> int:
+        return 0
+
+    def warm_up(self) -> float:
+        return 0.0
+
+    def release(self): pass
+
+    # async variants, by default the blocking call is moved to a worker thread
+    async def aembed(self, text: str):
+        return await asyncio.to_thread(self.embed, text)
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        return await asyncio.to_thread(self.complete, text, max_output)
+
+    async def acheck(self, text) -> (bool, object):
+        return await asyncio.to_thread(self.check, text)
+
+    async def aembedChucks(self, text: list[str]):
+        return await asyncio.to_thread(self.embedChucks, text)
+
+    # n samples for the same prompt, backends without a native way fall back to concurrent calls, each one timed as
+    # its own sample
+    def complete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        def one(position):
+            with telemetry.sample(position):
+                return self.complete(text, max_output)
+        with ThreadPoolExecutor(max_workers=max(n, 1)) as pool:
+            return list(pool.map(telemetry.propagate(one), range(n)))
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        async def one(position):
+            with telemetry.sample(position):
+                return await self.acomplete(text, max_output)
+        return list(await asyncio.gather(*[one(position) for position in range(n)]))
+
+    # the samples of a prompt with the given indices: a backend only needs how many, a cache tells the samples apart
+    # by index (e.g., a resumed run asking the samples 1 and 2 must not get back the cached 0 and 1)
+    def complete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        with telemetry.samples(samples):
+            return self.complete_many(text, max_output, len(samples))
+
+    async def acomplete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        with telemetry.samples(samples):
+            return await self.acomplete_many(text, max_output, len(samples))
+
+    # the reply piece by piece (about a token each, at most `max_output`), closing the stream cancels the request;
+    # backends without streaming yield the whole reply at once
+    def stream(self, text: str, max_output: int):
+        yield self.complete(text, max_output)
+
+    async def astream(self, text: str, max_output: int):
+        yield await self.acomplete(text, max_output)
+
     @staticmethod
     def from_file(where: str, filename: str):
         with open(where + "/" + filename, 'r') as f:
             data = json.load(f)
             if data["type"] == "OpenAi":
                 loader = FileKeyLoader(data["keyfile"])
-                return OpenAiService(loader, data["endpoint"], data["deployment"], data["version"], data["model"])
+                return OpenAiService(loader, data["endpoint"], data["deployment"], data["version"], data["model"],
+                                     RateLimiter.from_config(data.get("rate_limit")),
+                                     HttpConfig.from_config(data.get("http")))
             elif data["type"] == "Ollama":
-                return OllamaService(data["model"])
+                return OllamaService(data["model"], RateLimiter.from_config(data.get("rate_limit")), data.get("host"),
+                                     data.get("keep_alive", "30m"), HttpConfig.from_config(data.get("http")))
+
+
+class ServiceWrapper(LlmService):
+    """
+    Base of the services wrapping another one (cache, instrumentation): every call goes to the wrapped service
+    unless the subclass redefines it, the other attributes (e.g., `model`) are the ones of the wrapped service.
+    """
+
+    def __init__(self, service: LlmService):
+        self.service = service
+
+    def __getattr__(self, item):
+        # before __init__ (e.g., while unpickling) there is no service to delegate to
+        if item == "service":
+            raise AttributeError(item)
+        return getattr(self.service, item)
+
+    @property
+    def concurrency(self):
+        return self.service.concurrency
+
+    def identity(self) -> dict:
+        return self.service.identity()
+
+    def footprint(self) -> int:
+        return self.service.footprint()
+
+    def warm_up(self) -> float:
+        return self.service.warm_up()
+
+    def release(self):
+        self.service.release()
+
+    def embed(self, text: str):
+        return self.service.embed(text)
+
+    def embedChucks(self, text: list[str]):
+        return self.service.embedChucks(text)
+
+    def check(self, text) -> (bool, object):
+        return self.service.check(text)
+
+    def complete(self, text: str, max_output: int) -> str:
+        return self.service.complete(text, max_output)
+
+    def complete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return self.service.complete_many(text, max_output, n)
+
+    def complete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        return self.service.complete_samples(text, max_output, samples)
+
+    def stream(self, text: str, max_output: int):
+        return self.service.stream(text, max_output)
+
+    async def aembed(self, text: str):
+        return await self.service.aembed(text)
+
+    async def aembedChucks(self, text: list[str]):
+        return await self.service.aembedChucks(text)
+
+    async def acheck(self, text) -> (bool, object):
+        return await self.service.acheck(text)
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        return await self.service.acomplete(text, max_output)
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return await self.service.acomplete_many(text, max_output, n)
+
+    async def acomplete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        return await self.service.acomplete_samples(text, max_output, samples)
+
+    def astream(self, text: str, max_output: int):
+        return self.service.astream(text, max_output)
+
+
+def warm_up(name: str, service: LlmService):
+    """
+    Loads the model of the service, best-effort: a failure is logged and the requests load the model (or fail) on
+    their own. Returns the load time, None when the model could not be loaded.
+    """
+    try:
+        return service.warm_up()
+    except Exception as e:
+        logging.warning(f"Warm-up of {name} failed: {e}")
+        return None
+
+
+def release(name: str, service: LlmService):
+    """
+    Unloads the model of the service, best-effort: a model left loaded only expires with its keep-alive.
+    """
+    try:
+        service.release()
+    except Exception as e:
+        logging.warning(f"Release of {name} failed: {e}")
+
+
+def shares_model(service: LlmService, other: LlmService) -> bool:
+    # the model of one stays loaded for the other: the same model on the same host
+    model = getattr(service, "model", None)
+    return model is not None and (model, getattr(service, "host", None)) == \
+        (getattr(other, "model", None), getattr(other, "host", None))
+
+
+def estimate_tokens(text) -> int:
+    # about 4 characters per token, enough to pace a tokens per minute quota
+    texts = [text] if isinstance(text, str) else text
+    return sum(len(t) for t in texts) // 4 + 1
+
+
+def _count_token(produced: int, position: int = None):
+    # every piece of a stream is a token, of the sample at `position` (or the current one)
+    if produced == 0:
+        telemetry.first_token()
+    telemetry.add(completion_tokens=1)
+    telemetry.sample_token(position)
+
 
 class OpenAiService(LlmService):
-    def __init__(self, api_loader: KeyLoader, endpoint: str, deployment: str, version: str, model: str):
-        self.key = api_loader.key()
+    def __init__(self, api_loader: KeyLoader, endpoint: str, deployment: str, version: str, model: str,
+                 limiter: RateLimiter = None, http: HttpConfig = None):
+        self.api_loader = api_loader
         self.model = model
-        self.service = AzureOpenAI(
-            azure_endpoint=endpoint,
-            azure_deployment=deployment,
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.version = version
+        self.limiter = limiter or RateLimiter()
+        self.http = http or HttpConfig()
+        self.sampling = dict(temperature=1, top_p=0.5, frequency_penalty=0.0, presence_penalty=0, stop=None)
+
+    # the key and the clients (with the openai import) are loaded on first use
+    @cached_property
+    def key(self) -> str:
+        return registry.api_key(self.api_loader)
+
+    def _client_key(self) -> tuple:
+        return "azure", self.endpoint, self.deployment, self.version, self.key, self.http.key()
+
+    # the deployments of an endpoint share its connection pool
+    @cached_property
+    def service(self):
+        return registry.client(self._client_key(), lambda: self._client(registry.http_client(self.endpoint, self.http)))
+
+    @property
+    def async_service(self):
+        return registry.async_client(self._client_key(), lambda: self._async_client(
+            registry.async_http_client(self.endpoint, self.http)))
+
+    def _client(self, http_client):
+        from openai.lib.azure import AzureOpenAI
+        # retries are handled by the rate limiter
+        return AzureOpenAI(
+            azure_endpoint=self.endpoint,
+            azure_deployment=self.deployment,
             api_key=self.key,
-            api_version=version
+            api_version=self.version,
+            max_retries=0,
+            timeout=self.http.timeouts(),
+            http_client=http_client
         )
 
+    def _async_client(self, http_client):
+        from openai.lib.azure import AsyncAzureOpenAI
+        return AsyncAzureOpenAI(
+            azure_endpoint=self.endpoint,
+            azure_deployment=self.deployment,
+            api_key=self.key,
+            api_version=self.version,
+            max_retries=0,
+            timeout=self.http.timeouts(),
+            http_client=http_client
+        )
+
+    def identity(self) -> dict:
+        return {"backend": "OpenAi", "endpoint": self.endpoint, "deployment": self.deployment, "model": self.model,
+                "sampling": self.sampling}
+
+    @staticmethod
+    def _classify(error):
+        from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+        if isinstance(error, RateLimitError):
+            headers = error.response.headers
+            retry_after = headers.get("retry-after-ms")
+            retry_after = float(retry_after) / 1000 if retry_after else retry_after_seconds(headers.get("retry-after"))
+            return True, True, retry_after
+        return isinstance(error, (APITimeoutError, APIConnectionError, InternalServerError)), False, None
+
+    @staticmethod
+    def _usage(parsed):
+        usage = getattr(parsed, "usage", None)
+        if usage is not None:
+            telemetry.add(prompt_tokens=usage.prompt_tokens,
+                          completion_tokens=getattr(usage, "completion_tokens", None))
+        return parsed
+
+    def _call(self, request, tokens: float):
+        def attempt():
+            response = request()
+            self.limiter.observe(response.headers)
+            return self._usage(response.parse())
+        return self.limiter.call(attempt, self._classify, tokens)
+
+    async def _acall(self, request, tokens: float):
+        async def attempt():
+            response = await request()
+            self.limiter.observe(response.headers)
+            return self._usage(response.parse())
+        return await self.limiter.acall(attempt, self._classify, tokens)
+
     def embed(self, text: str):
-        return self.service.embeddings.create(model=self.model, input=text).data[0].embedding
+        return self.embedChucks([text])[0]
 
     def embedChucks(self, text: list[str]):
-        all = self.service.embeddings.create(model=self.model, input=text).data
+        all = self._call(lambda: self.service.embeddings.with_raw_response.create(model=self.model, input=text),
+                         estimate_tokens(text)).data
         return [a.embedding for a in all]
 
+    async def aembed(self, text: str):
+        return (await self.aembedChucks([text]))[0]
+
+    async def aembedChucks(self, text: list[str]):
+        response = await self._acall(
+            lambda: self.async_service.embeddings.with_raw_response.create(model=self.model, input=text),
+            estimate_tokens(text)
+        )
+        return [a.embedding for a in response.data]
+
     def check(self, text: str) -> (bool, object):
+        from openai import BadRequestError
         try:
-            self.service.completions.create(
+            self._call(lambda: self.service.completions.with_raw_response.create(
                 model=self.model,
                 prompt=text,
                 max_tokens=1
-            )
+            ), estimate_tokens(text))
             return True, {}
         except BadRequestError as e:
             return False, e
 
-    def complete(self, text: str, max_output: int) -> str:
-        result = None
-        while result is None:
-            result = self.service.chat.completions.create(
+    async def acheck(self, text) -> (bool, object):
+        from openai import BadRequestError
+        try:
+            await self._acall(lambda: self.async_service.completions.with_raw_response.create(
                 model=self.model,
-                messages=[{"role": "user", "content": text}],
-                max_tokens=max_output,
-                temperature=1,
-                top_p=0.5,
-                frequency_penalty=0.0,
-                presence_penalty=0,
-                stop=None
-            ).choices[0].message.content
-        return result
+                prompt=text,
+                max_tokens=1
+            ), estimate_tokens(text))
+            return True, {}
+        except BadRequestError as e:
+            return False, e
+
+    def complete(self, text: str, max_output: int) -> str:
+        return self.complete_many(text, max_output, 1)[0]
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        return (await self.acomplete_many(text, max_output, 1))[0]
+
+    # the chat api returns all the samples of a prompt in one call (n choices)
+    def complete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        results = []
+        for _ in range(self.limiter.max_retries + 1):
+            missing = n - len(results)
+            completion = self._call(
+                lambda: self.service.chat.completions.with_raw_response.create(
+                    **self._chat_request(text, max_output, missing)
+                ),
+                estimate_tokens(text) + max_output * missing
+            )
+            results.extend(self._contents(completion))
+            if len(results) >= n:
+                return results[:n]
+        raise ValueError(f"{self.model} keeps replying without content")
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        results = []
+        for _ in range(self.limiter.max_retries + 1):
+            missing = n - len(results)
+            completion = await self._acall(
+                lambda: self.async_service.chat.completions.with_raw_response.create(
+                    **self._chat_request(text, max_output, missing)
+                ),
+                estimate_tokens(text) + max_output * missing
+            )
+            results.extend(self._contents(completion))
+            if len(results) >= n:
+                return results[:n]
+        raise ValueError(f"{self.model} keeps replying without content")
+
+    # a stream holds its slot of the rate limiter until its last piece
+    def stream(self, text: str, max_output: int):
+        return self.limiter.stream(lambda: self._deltas(text, max_output), self._classify,
+                                   estimate_tokens(text) + max_output)
+
+    def astream(self, text: str, max_output: int):
+        return self.limiter.astream(lambda: self._adeltas(text, max_output), self._classify,
+                                    estimate_tokens(text) + max_output)
+
+    def _deltas(self, text: str, max_output: int):
+        response = self.service.chat.completions.with_raw_response.create(
+            **self._chat_request(text, max_output, 1), stream=True
+        )
+        self.limiter.observe(response.headers)
+        chunks = response.parse()
+        try:
+            produced = 0
+            for chunk in chunks:
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        if produced >= max_output:
+                            telemetry.mark(truncated=True)
+                            return
+                        _count_token(produced)
+                        produced += 1
+                        yield choice.delta.content
+        finally:
+            chunks.close()
+
+    async def _adeltas(self, text: str, max_output: int):
+        response = await self.async_service.chat.completions.with_raw_response.create(
+            **self._chat_request(text, max_output, 1), stream=True
+        )
+        self.limiter.observe(response.headers)
+        chunks = response.parse()
+        try:
+            produced = 0
+            async for chunk in chunks:
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        if produced >= max_output:
+                            telemetry.mark(truncated=True)
+                            return
+                        _count_token(produced)
+                        produced += 1
+                        yield choice.delta.content
+        finally:
+            await chunks.close()
+
+    # the generation streams the n choices, so that the first token is timed as on the other backends; the whole
+    # stream is one call of the rate limiter, a stream cut in the middle is asked again
+    def complete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        results = []
+        for _ in range(self.limiter.max_retries + 1):
+            missing = len(samples) - len(results)
+            with telemetry.samples(samples[len(results):]):
+                pieces = self.limiter.call(lambda: self._choices(text, max_output, missing), self._classify,
+                                           estimate_tokens(text) + max_output * missing)
+            results.extend("".join(pieces[choice]) for choice in sorted(pieces))
+            if len(results) >= len(samples):
+                return results[:len(samples)]
+        raise ValueError(f"{self.model} keeps replying without content")
+
+    async def acomplete_samples(self, text: str, max_output: int, samples: list[int]) -> list[str]:
+        results = []
+        for _ in range(self.limiter.max_retries + 1):
+            missing = len(samples) - len(results)
+            with telemetry.samples(samples[len(results):]):
+                pieces = await self.limiter.acall(lambda: self._achoices(text, max_output, missing), self._classify,
+                                                  estimate_tokens(text) + max_output * missing)
+            results.extend("".join(pieces[choice]) for choice in sorted(pieces))
+            if len(results) >= len(samples):
+                return results[:len(samples)]
+        raise ValueError(f"{self.model} keeps replying without content")
+
+    def _choices(self, text: str, max_output: int, n: int) -> dict:
+        response = self.service.chat.completions.with_raw_response.create(
+            **self._chat_request(text, max_output, n), stream=True
+        )
+        self.limiter.observe(response.headers)
+        chunks = response.parse()
+        pieces = {}
+        try:
+            for chunk in chunks:
+                self._collect(chunk, pieces, max_output)
+        finally:
+            chunks.close()
+        return pieces
+
+    async def _achoices(self, text: str, max_output: int, n: int) -> dict:
+        response = await self.async_service.chat.completions.with_raw_response.create(
+            **self._chat_request(text, max_output, n), stream=True
+        )
+        self.limiter.observe(response.headers)
+        chunks = response.parse()
+        pieces = {}
+        try:
+            async for chunk in chunks:
+                self._collect(chunk, pieces, max_output)
+        finally:
+            await chunks.close()
+        return pieces
+
+    @staticmethod
+    def _collect(chunk, pieces: dict, max_output: int):
+        # the pieces of every choice, at most `max_output` each; choices without content (e.g., filtered) are left
+        # out, to be asked again
+        for choice in chunk.choices:
+            if choice.delta.content:
+                produced = len(pieces.get(choice.index, ()))
+                if produced >= max_output:
+                    telemetry.mark(truncated=True)
+                    continue
+                _count_token(produced, choice.index)
+                pieces.setdefault(choice.index, []).append(choice.delta.content)
+
+    def _chat_request(self, text: str, max_output: int, n: int):
+        return dict(
+            model=self.model,
+            messages=[{"role": "user", "content": text}],
+            max_tokens=max_output,
+            n=n,
+            **self.sampling
+        )
+
+    @staticmethod
+    def _contents(completion) -> list[str]:
+        # choices without content (e.g., filtered) are asked again
+        return [choice.message.content for choice in completion.choices if choice.message.content is not None]
+
     # static factory method to load from a file
     @staticmethod
     def from_file(where: str, filename: str):
@@ -92,26 +537,166 @@ class OpenAiService(LlmService):
         with open(where + "/" + filename, 'r') as f:
             data = json.load(f)
             loader = FileKeyLoader(data["keyfile"])
-            return OpenAiService(loader, data["endpoint"], data["deployment"], data["version"], data["model"])
+            return OpenAiService(loader, data["endpoint"], data["deployment"], data["version"], data["model"],
+                                 RateLimiter.from_config(data.get("rate_limit")),
+                                 HttpConfig.from_config(data.get("http")))
+
 
 class OllamaService(LlmService):
-    def __init__(self, model: str):
+    def __init__(self, model: str, limiter: RateLimiter = None, host: str = None, keep_alive="30m",
+                 http: HttpConfig = None):
         self.model = model
+        self.host = host
+        # how long the server keeps the model loaded after the last request
+        self.keep_alive = keep_alive
+        self.limiter = limiter or RateLimiter()
+        self.http = http or HttpConfig()
+
+    # the models of a host share one client (and its connection pool); without a host, the clients use
+    # OLLAMA_HOST or the local daemon
+    @cached_property
+    def service(self):
+        import ollama
+        return registry.client(("ollama", self.host, self.http.key()),
+                               lambda: ollama.Client(self.host, **self.http.options()))
+
+    @property
+    def async_service(self):
+        import ollama
+        return registry.async_client(("ollama", self.host, self.http.key()),
+                                     lambda: ollama.AsyncClient(self.host, **self.http.options()))
+
+    def identity(self) -> dict:
+        return {"backend": "Ollama", "model": self.model}
+
+    @staticmethod
+    def _classify(error):
+        import httpx
+        import ollama
+        if isinstance(error, ollama.ResponseError):
+            # 503 is the answer of a server with a full queue
+            return error.status_code in (429, 500, 502, 503, 504), error.status_code in (429, 503), None
+        return isinstance(error, (httpx.TimeoutException, httpx.TransportError)), False, None
+
+    def footprint(self) -> int:
+        # the size of the model files, the closest estimate of the memory it needs once loaded
+        name = self.model if ":" in self.model else self.model + ":latest"
+        sizes = {model["name"]: model["size"] for model in self.service.list()["models"]}
+        return sizes.get(name, 0)
+
+    def warm_up(self) -> float:
+        # a request without prompt only loads the model
+        start = time.time()
+        self.limiter.call(lambda: self.service.generate(model=self.model, keep_alive=self.keep_alive), self._classify)
+        return time.time() - start
+
+    def release(self):
+        self.limiter.call(lambda: self.service.generate(model=self.model, keep_alive=0), self._classify)
 
     def embed(self, text: str):
-        return ollama.embeddings(model=self.model, prompt=text)['embedding']
+        return self.limiter.call(
+            lambda: self.service.embeddings(model=self.model, prompt=text, keep_alive=self.keep_alive),
+            self._classify, estimate_tokens(text)
+        )['embedding']
 
     def embedChucks(self, text: list[str]):
-        return [self.embed(t) for t in text]
+        # no batch endpoint: concurrent requests, paced by the rate limiter
+        with ThreadPoolExecutor(max_workers=max(1, min(len(text), self.limiter.max_concurrency))) as pool:
+            return list(pool.map(telemetry.propagate(self.embed), text))
 
     def check(self, text: str) -> (bool, object):
         return True, {}
 
+    def _generation(self, text: str, max_output: int) -> dict:
+        return dict(model=self.model, prompt=text, options={"num_predict": max_output}, keep_alive=self.keep_alive,
+                    stream=True)
+
+    # the replies are streamed: the budget holds even for a server ignoring `num_predict`, and the first token is
+    # timed. A stream holds its slot of the rate limiter until its last piece; a completion is one call of the rate
+    # limiter, a stream cut in the middle is asked again
     def complete(self, text: str, max_output: int) -> str:
-        return ollama.generate(model=self.model, prompt=text, options={"eval_count": max_output})["response"]
+        return self.limiter.call(lambda: "".join(self._pieces(text, max_output)), self._classify,
+                                 estimate_tokens(text) + max_output)
+
+    def stream(self, text: str, max_output: int):
+        return self.limiter.stream(lambda: self._pieces(text, max_output), self._classify,
+                                   estimate_tokens(text) + max_output)
+
+    def _pieces(self, text: str, max_output: int):
+        # the errors of the request come with the first chunk
+        chunks = self.service.generate(**self._generation(text, max_output))
+        try:
+            produced = 0
+            for chunk in chunks:
+                if chunk.get("response"):
+                    if produced >= max_output:
+                        telemetry.mark(truncated=True)
+                        return
+                    _count_token(produced)
+                    produced += 1
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    telemetry.add(prompt_tokens=chunk.get("prompt_eval_count"))
+                    return
+        finally:
+            chunks.close()
+
+    async def aembedChucks(self, text: list[str]):
+        return list(await asyncio.gather(*[self.aembed(t) for t in text]))
+
+    async def aembed(self, text: str):
+        response = await self.limiter.acall(
+            lambda: self.async_service.embeddings(model=self.model, prompt=text, keep_alive=self.keep_alive),
+            self._classify, estimate_tokens(text)
+        )
+        return response['embedding']
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        async def attempt():
+            return "".join([piece async for piece in self._apieces(text, max_output)])
+        return await self.limiter.acall(attempt, self._classify, estimate_tokens(text) + max_output)
+
+    def astream(self, text: str, max_output: int):
+        return self.limiter.astream(lambda: self._apieces(text, max_output), self._classify,
+                                    estimate_tokens(text) + max_output)
+
+    async def _apieces(self, text: str, max_output: int):
+        chunks = await self.async_service.generate(**self._generation(text, max_output))
+        try:
+            produced = 0
+            while True:
+                try:
+                    chunk = await anext(chunks, None)
+                except RuntimeError as e:
+                    raise self._status_error(e)
+                if chunk is None:
+                    return
+                if chunk.get("response"):
+                    if produced >= max_output:
+                        telemetry.mark(truncated=True)
+                        return
+                    _count_token(produced)
+                    produced += 1
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    telemetry.add(prompt_tokens=chunk.get("prompt_eval_count"))
+                    return
+        finally:
+            await chunks.aclose()
+
+    @staticmethod
+    def _status_error(error: RuntimeError) -> Exception:
+        # the async client fails reading the body of an error status while streaming, the status is in the context
+        import httpx
+        import ollama
+        if isinstance(error.__context__, httpx.HTTPStatusError):
+            response = error.__context__.response
+            return ollama.ResponseError(response.reason_phrase, response.status_code)
+        return error
 
     @staticmethod
     def from_file(where: str, filename: str):
         with open(where + "/" + filename, 'r') as f:
             data = json.load(f)
-            return OllamaService(data["model"])
+            return OllamaService(data["model"], RateLimiter.from_config(data.get("rate_limit")), data.get("host"),
+                                 data.get("keep_alive", "30m"), HttpConfig.from_config(data.get("http")))
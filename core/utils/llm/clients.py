@@ -0,0 +1,146 @@
+"""
+Registry of the clients shared by the services.
+The services of the same endpoint (e.g., every model of an Ollama host, every deployment of an Azure resource) share
+one pooled HTTP client, so concurrent requests reuse the open connections instead of paying a new TCP/TLS setup
+each; async clients are bound to the event loop of their connections, so they are shared per loop. The pool and
+the timeouts come from the `http` section of a service configuration (`HttpConfig`), HTTP/2 needs the `h2` package
+(`httpx[http2]`). Keys read from files are read once. Every lookup is thread-safe. `run` is `asyncio.run`
+closing the async clients of its loop before the loop ends, `close` closes the others.
+"""
+import asyncio
+import inspect
+import threading
+import weakref
+
+
+class HttpConfig:
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 30.0,
+                 timeout: float = 600.0, connect_timeout: float = 10.0, http2: bool = False):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.http2 = http2
+
+    @staticmethod
+    def from_config(config: dict = None):
+        return HttpConfig(**(config or {}))
+
+    def key(self) -> tuple:
+        return (self.max_connections, self.max_keepalive, self.keepalive_expiry, self.timeout, self.connect_timeout,
+                self.http2)
+
+    def timeouts(self):
+        import httpx
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def options(self) -> dict:
+        """
+        The arguments of an `httpx.Client` (or `AsyncClient`) with this configuration.
+        """
+        import httpx
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive,
+                              keepalive_expiry=self.keepalive_expiry)
+        return dict(limits=limits, timeout=self.timeouts(), http2=self.http2)
+
+
+class ClientRegistry:
+    def __init__(self):
+        # reentrant: a client factory may ask for the HTTP client it wraps
+        self.lock = threading.RLock()
+        self.clients = {}
+        # event loop -> key -> client
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.keys = {}
+
+    def client(self, key, factory):
+        """
+        The client registered as `key`, built by `factory()` on first use.
+        """
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = factory()
+            return self.clients[key]
+
+    def async_client(self, key, factory):
+        """
+        Like `client`, for the running event loop (each `asyncio.run` has its own clients).
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            clients = self.async_clients.setdefault(loop, {})
+            if key not in clients:
+                clients[key] = factory()
+            return clients[key]
+
+    def http_client(self, endpoint: str, config: HttpConfig):
+        import httpx
+        return self.client(("http", endpoint, config.key()), lambda: httpx.Client(**config.options()))
+
+    def async_http_client(self, endpoint: str, config: HttpConfig):
+        import httpx
+        return self.async_client(("http", endpoint, config.key()), lambda: httpx.AsyncClient(**config.options()))
+
+    def api_key(self, loader) -> str:
+        # the keys of a file are read once, the other loaders are asked every time
+        filename = getattr(loader, "filename", None)
+        if filename is None:
+            return loader.key()
+        with self.lock:
+            if filename not in self.keys:
+                self.keys[filename] = loader.key()
+            return self.keys[filename]
+
+    @staticmethod
+    def _closer(client):
+        # the ollama clients have no close, their httpx client has
+        if not hasattr(client, "close") and not hasattr(client, "aclose"):
+            client = getattr(client, "_client", None)
+        return getattr(client, "aclose", None) or getattr(client, "close", None)
+
+    async def aclose(self):
+        """
+        Closes the async clients of the running loop, their connections do not outlive it.
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            clients = list(self.async_clients.pop(loop, {}).values())
+        for client in clients:
+            close = self._closer(client)
+            result = close() if close is not None else None
+            if inspect.isawaitable(result):
+                await result
+
+    def run(self, main):
+        """
+        `asyncio.run(main)`, closing the async clients made in its loop before the loop ends.
+        """
+        async def closing():
+            try:
+                return await main
+            finally:
+                await self.aclose()
+        return asyncio.run(closing())
+
+    def close(self):
+        with self.lock:
+            clients, self.clients = list(self.clients.values()), {}
+            loops, self.async_clients = list(self.async_clients.items()), weakref.WeakKeyDictionary()
+            self.keys = {}
+        for client in clients:
+            close = self._closer(client)
+            if close is not None:
+                close()
+        # the clients of a loop still open (not run through `run`); a closed loop took its connections with it
+        for loop, async_clients in loops:
+            if not loop.is_closed() and not loop.is_running():
+                for client in async_clients.values():
+                    close = self._closer(client)
+                    result = close() if close is not None else None
+                    if inspect.isawaitable(result):
+                        loop.run_until_complete(result)
+
+
+# shared by every service of the process
+registry = ClientRegistry()
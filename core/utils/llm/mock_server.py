@@ -0,0 +1,292 @@
+"""
+Local stand-in for the LLM backends, to test and benchmark the pipeline offline.
+It serves the Azure OpenAI chat completions, completions and embeddings endpoints
+(`/openai/deployments/<deployment>/...`) and the Ollama generate, embeddings, tags and pull endpoints (`/api/...`).
+Every request waits `latency` (+ `per_token` for each generated token, with `jitter`), fails with a 500 with
+probability `error_rate` and is rate limited (429 with retry-after) with probability `rate_limit_rate`.
+Prompts containing one of the `blocked` words are rejected by the content filter (400) of the Azure endpoints.
+Completions stream when asked (server-sent events for Azure, JSON lines for Ollama), one token per `per_token`;
+with `ignore_limit` the replies are always `reply_tokens` long, like a model ignoring the output limit.
+Embeddings are deterministic pseudo-random unit vectors of the text.
+
+    with MockServer(latency=0.05) as server:
+        service = OllamaService("llama3", host=server.url)
+
+or `python -m core.utils.llm.mock_server --port 11434 --latency 0.05`.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class MockServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, per_token: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 0.05, blocked=("unsafe",), dim: int = 64, reply_tokens: int = 50,
+                 models: dict = None, seed: int = 42, ignore_limit: bool = False):
+        self.latency = latency
+        self.per_token = per_token
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.blocked = tuple(blocked)
+        self.dim = dim
+        self.reply_tokens = reply_tokens
+        self.ignore_limit = ignore_limit
+        # the models listed by /api/tags, name -> size in bytes
+        self.models = models or {"llama3:latest": 4_661_224_676}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # (path, status) -> count
+        self.requests = Counter()
+        # streams closed by the client before the end
+        self.cancelled = 0
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _draw(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def _wait(self, tokens: int = 0):
+        delay = self.latency + self.per_token * tokens
+        if self.jitter:
+            with self.lock:
+                delay += self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, delay))
+
+    def embedding(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).normal(size=self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def pieces(self, prompt: str, max_tokens: int, choice: int = 0) -> list[str]:
+        """
+        The tokens of a reply.
+        """
+        limit = self.reply_tokens if self.ignore_limit else min(max_tokens or self.reply_tokens, self.reply_tokens)
+        words = [f"reply{choice}"] + (prompt.split() or ["..."]) * limit
+        return [words[0]] + [" " + word for word in words[1:max(1, limit)]]
+
+    def reply(self, prompt: str, max_tokens: int, choice: int = 0) -> tuple[str, int]:
+        pieces = self.pieces(prompt, max_tokens, choice)
+        return "".join(pieces), len(pieces)
+
+    def injected(self):
+        """
+        The injected failure of a request, if any: (status, body, headers).
+        """
+        if self.rate_limit_rate and self._draw() < self.rate_limit_rate:
+            headers = {"retry-after-ms": str(int(self.retry_after * 1000)), "retry-after": str(self.retry_after)}
+            return 429, {"error": {"code": "429", "message": "Rate limit reached"}}, headers
+        if self.error_rate and self._draw() < self.error_rate:
+            return 500, {"error": {"code": "500", "message": "Injected failure"}}, {}
+        return None
+
+    def handle(self, method: str, path: str, body: dict):
+        path = path.split("?")[0]
+        if method == "GET" and path == "/api/tags":
+            return 200, {"models": [{"name": name, "model": name, "size": size}
+                                    for name, size in self.models.items()]}
+        if path == "/api/pull":
+            return 200, {"status": "success"}
+        failure = self.injected()
+        if failure:
+            self._wait()
+            return failure
+        if path.startswith("/openai/deployments/"):
+            # /openai/deployments/<deployment>/<operation>
+            return self._azure(path.split("/", 4)[-1], body)
+        if path == "/api/generate":
+            return self._ollama_generate(body)
+        if path == "/api/embeddings":
+            self._wait()
+            return 200, {"embedding": self.embedding(body.get("prompt", ""))}
+        return 404, {"error": f"unknown endpoint {path}"}
+
+    def _filtered(self, texts) -> bool:
+        return any(word in text for text in texts for word in self.blocked)
+
+    def _azure(self, operation: str, body: dict):
+        if operation == "embeddings":
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            self._wait()
+            data = [{"object": "embedding", "index": i, "embedding": self.embedding(text)}
+                    for i, text in enumerate(texts)]
+            tokens = sum(len(text) // 4 + 1 for text in texts)
+            return 200, {"object": "list", "data": data, "model": body.get("model"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+        if operation == "chat/completions":
+            prompts = [message["content"] for message in body["messages"]]
+        elif operation == "completions":
+            prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+        else:
+            return 404, {"error": f"unknown operation {operation}"}
+        if self._filtered(prompts):
+            self._wait()
+            return 400, {"error": {"code": "content_filter", "message": "The prompt triggered the content filter",
+                                   "param": "prompt", "type": None}}
+        n = body.get("n", 1)
+        if body.get("stream"):
+            return 200, self._azure_stream(operation, body, prompts[-1], n), {"content-type": "text/event-stream"}
+        replies = [self.reply(prompts[-1], body.get("max_tokens"), i) for i in range(n)]
+        # the choices are generated side by side
+        self._wait(max(tokens for _, tokens in replies))
+        usage = {"prompt_tokens": sum(len(p) // 4 + 1 for p in prompts),
+                 "completion_tokens": sum(tokens for _, tokens in replies)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if operation == "chat/completions":
+            choices = [{"index": i, "finish_reason": "length", "message": {"role": "assistant", "content": text}}
+                       for i, (text, _) in enumerate(replies)]
+            kind = "chat.completion"
+        else:
+            choices = [{"index": i, "finish_reason": "length", "text": text, "logprobs": None}
+                       for i, (text, _) in enumerate(replies)]
+            kind = "text_completion"
+        return 200, {"id": "mock", "object": kind, "created": int(time.time()), "model": body.get("model"),
+                     "choices": choices, "usage": usage}
+
+    def _azure_stream(self, operation: str, body: dict, prompt: str, n: int):
+        chat = operation == "chat/completions"
+        replies = [self.pieces(prompt, body.get("max_tokens"), i) for i in range(n)]
+
+        def event(i, content, finish=None):
+            choice = {"index": i, "finish_reason": finish, "logprobs": None}
+            choice.update({"delta": {"content": content}} if chat else {"text": content or ""})
+            return {"id": "mock", "object": "chat.completion.chunk" if chat else "text_completion",
+                    "created": int(time.time()), "model": body.get("model"), "choices": [choice]}
+
+        def events():
+            self._wait()
+            for position in range(max(len(pieces) for pieces in replies)):
+                time.sleep(self.per_token)
+                for i, pieces in enumerate(replies):
+                    if position < len(pieces):
+                        yield event(i, pieces[position])
+            for i in range(n):
+                yield event(i, None, "length")
+        return self._sse(events())
+
+    @staticmethod
+    def _sse(events):
+        for event in events:
+            yield f"data: {json.dumps(event)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    def _ollama_generate(self, body: dict):
+        if not body.get("prompt"):
+            # a request without prompt loads (or unloads) the model
+            self._wait()
+            return 200, {"model": body["model"], "response": "", "done": True}
+        options = body.get("options") or {}
+        pieces = self.pieces(body["prompt"], options.get("num_predict"))
+        final = {"model": body["model"], "response": "", "done": True, "eval_count": len(pieces),
+                 "prompt_eval_count": len(body["prompt"]) // 4 + 1}
+        # like Ollama, streaming unless asked otherwise
+        if body.get("stream", True):
+            return 200, self._ollama_stream(body["model"], pieces, final), {"content-type": "application/x-ndjson"}
+        self._wait(len(pieces))
+        return 200, {**final, "response": "".join(pieces)}
+
+    def _ollama_stream(self, model: str, pieces: list[str], final: dict):
+        self._wait()
+        for piece in pieces:
+            time.sleep(self.per_token)
+            yield (json.dumps({"model": model, "response": piece, "done": False}) + "\n").encode()
+        yield (json.dumps(final) + "\n").encode()
+
+
+def _handler(server: MockServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _serve(self, method: str):
+            length = int(self.headers.get("content-length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            answer = server.handle(method, self.path, body)
+            status, payload = answer[:2]
+            headers = answer[2] if len(answer) > 2 else {}
+            with server.lock:
+                server.requests[(self.path.split("?")[0], status)] += 1
+            if not isinstance(payload, (dict, list)):
+                return self._stream(status, payload, headers)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, status: int, chunks, headers: dict):
+            self.send_response(status)
+            self.send_header("transfer-encoding", "chunked")
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                for chunk in chunks:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                with server.lock:
+                    server.cancelled += 1
+                self.close_connection = True
+
+        def do_GET(self):
+            self._serve("GET")
+
+        def do_POST(self):
+            self._serve("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mock Azure OpenAI and Ollama server')
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, help='Seconds per request', default=0.05)
+    parser.add_argument('--per-token', type=float, help='Seconds per generated token', default=0.0)
+    parser.add_argument('--jitter', type=float, help='Uniform jitter of the latency', default=0.0)
+    parser.add_argument('--error-rate', type=float, help='Probability of a 500', default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, help='Probability of a 429', default=0.0)
+    args = parser.parse_args()
+    mock = MockServer(args.host, args.port, args.latency, args.per_token, args.jitter, args.error_rate,
+                      args.rate_limit_rate)
+    print(f"Serving on {mock.url}")
+    mock.server.serve_forever()
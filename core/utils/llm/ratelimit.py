@@ -0,0 +1,248 @@
+"""
+Shared request scheduler for the LLM backends.
+It combines token buckets (requests and tokens per minute), an adaptive concurrency limit (additive increase,
+multiplicative decrease on rate limiting) and retries with jittered exponential backoff.
+Services describe their failures through a `classify(error) -> (retryable, rate_limited, retry_after)` function
+and report the rate limit headers of the successful responses through `observe`.
+"""
+import asyncio
+import email.utils
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from core.utils.llm import telemetry
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        # a request larger than the whole bucket waits for a full one
+        amount = min(amount, self.capacity)
+        return 0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+def _seconds(value) -> float:
+    # the reset headers look like "1s", "6m0s", "250ms" or a plain number of seconds
+    if value is None:
+        return 0
+    try:
+        return float(value)
+    except ValueError:
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(amount) * units[unit] for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value))
+
+
+def retry_after_seconds(value) -> float:
+    """
+    The wait asked by a Retry-After header, a number of seconds or an HTTP date; None when missing or not
+    parseable, the backoff decides.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, max_concurrency: int = 64,
+                 min_concurrency: int = 1, max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_config(config: dict = None):
+        return RateLimiter(**(config or {}))
+
+    def _try_acquire(self, tokens: float) -> float:
+        """
+        Takes a slot when possible (returns 0), otherwise returns how long to wait before trying again.
+        """
+        with self.lock:
+            wait = self.paused_until - time.monotonic()
+            if wait > 0:
+                return wait
+            if self.in_flight >= int(self.limit):
+                return 0.05
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill()
+                    wait = max(wait, bucket.wait_for(amount))
+            if wait > 0:
+                return wait
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.level -= amount
+            self.in_flight += 1
+            return 0
+
+    def _release(self, rate_limited: bool):
+        with self.lock:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe(self, headers):
+        """
+        Aligns the buckets with the remaining quota announced by the server.
+        """
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        with self.lock:
+            if remaining_requests is not None and self.requests is not None:
+                self.requests.level = min(self.requests.level, float(remaining_requests))
+            if remaining_tokens is not None and self.tokens is not None:
+                self.tokens.level = min(self.tokens.level, float(remaining_tokens))
+        if remaining_requests is not None and float(remaining_requests) <= 0:
+            self.pause(_seconds(headers.get("x-ratelimit-reset-requests")))
+        if remaining_tokens is not None and float(remaining_tokens) <= 0:
+            self.pause(_seconds(headers.get("x-ratelimit-reset-tokens")))
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+    def call(self, function, classify, tokens: float = 1):
+        attempt = 0
+        while True:
+            while (wait := self._try_acquire(tokens)) > 0:
+                time.sleep(wait)
+            try:
+                result = function()
+            except Exception as e:
+                retryable, rate_limited, retry_after = classify(e)
+                self._release(rate_limited)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                self._on_retry(rate_limited, retry_after)
+                time.sleep(self.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+            self._release(False)
+            return result
+
+    async def acall(self, function, classify, tokens: float = 1):
+        attempt = 0
+        while True:
+            while (wait := self._try_acquire(tokens)) > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await function()
+            except Exception as e:
+                retryable, rate_limited, retry_after = classify(e)
+                self._release(rate_limited)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                self._on_retry(rate_limited, retry_after)
+                await asyncio.sleep(self.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+            self._release(False)
+            return result
+
+    def stream(self, function, classify, tokens: float = 1):
+        """
+        The items of the generator returned by `function`, holding the slot until it is exhausted or closed, so that
+        the concurrency limit bounds the generations and not only their start. The failures before the first item are
+        retried; the ones after it are raised (the consumer already has the first items), the adaptive limit still
+        learns from them.
+        """
+        attempt = 0
+        while True:
+            while (wait := self._try_acquire(tokens)) > 0:
+                time.sleep(wait)
+            started = False
+            try:
+                items = function()
+                try:
+                    for item in items:
+                        started = True
+                        yield item
+                finally:
+                    items.close()
+            except Exception as e:
+                retryable, rate_limited, retry_after = classify(e)
+                self._release(rate_limited)
+                if started or not retryable or attempt >= self.max_retries:
+                    raise
+                self._on_retry(rate_limited, retry_after)
+                time.sleep(self.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+            except BaseException:
+                # closed by the consumer
+                self._release(False)
+                raise
+            self._release(False)
+            return
+
+    async def astream(self, function, classify, tokens: float = 1):
+        attempt = 0
+        while True:
+            while (wait := self._try_acquire(tokens)) > 0:
+                await asyncio.sleep(wait)
+            started = False
+            try:
+                items = function()
+                try:
+                    async for item in items:
+                        started = True
+                        yield item
+                finally:
+                    await items.aclose()
+            except Exception as e:
+                retryable, rate_limited, retry_after = classify(e)
+                self._release(rate_limited)
+                if started or not retryable or attempt >= self.max_retries:
+                    raise
+                self._on_retry(rate_limited, retry_after)
+                await asyncio.sleep(self.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+            except BaseException:
+                self._release(False)
+                raise
+            self._release(False)
+            return
+
+    def _on_retry(self, rate_limited: bool, retry_after: float):
+        telemetry.count_retry()
+        # a server asking to slow down stops every caller, not only the one that got the answer
+        if rate_limited and retry_after:
+            self.pause(retry_after)
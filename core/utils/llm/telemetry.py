@@ -0,0 +1,151 @@
+"""
+Record of the LLM call in progress, shared through a context variable.
+`core.utils.instrument.InstrumentedService` opens a record for every call; the backends and the rate limiter add
+to it what only they know (token usage, retries, first token) without knowing who is listening.
+The records nest: what reaches the current record reaches the ones around it too, so a caller can time a request
+made of several (instrumented) calls. Asyncio tasks inherit the records of the call that created them; functions
+run by worker threads must be wrapped with `propagate`.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# the records in progress, the innermost last
+_current = contextvars.ContextVar("llm_call", default=())
+# the indices of the samples asked together and the position of the one being produced: the tokens of concurrent
+# streams (or of the choices of one stream) are timed per sample
+_samples = contextvars.ContextVar("llm_samples", default=None)
+_position = contextvars.ContextVar("llm_position", default=None)
+_lock = threading.Lock()
+
+
+def new_record(**fields) -> dict:
+    return {**fields, "started": time.perf_counter()}
+
+
+@contextmanager
+def recording(record: dict):
+    """
+    Makes `record` the current one, inside the records already current; a streaming call enters it around every
+    step of the stream.
+    """
+    token = _current.set(_current.get() + (record,))
+    try:
+        yield record
+    finally:
+        _current.reset(token)
+
+
+def add(**values):
+    """
+    Adds the (not None) `values` to the counters of the current records, if any.
+    """
+    with _lock:
+        for record in _current.get():
+            for name, value in values.items():
+                if value is not None:
+                    record[name] = (record.get(name) or 0) + value
+
+
+def mark(**values):
+    """
+    Sets the `values` in the current records, if any.
+    """
+    for record in _current.get():
+        record.update(values)
+
+
+def count_retry():
+    add(retries=1)
+
+
+def first_token():
+    # only the first call counts, the following tokens of the stream do not move it
+    now = time.perf_counter()
+    for record in _current.get():
+        if record.get("ttft") is None:
+            record["ttft"] = now - record["started"]
+
+
+@contextmanager
+def samples(indices):
+    """
+    Names the samples asked inside: the sample at position `i` is `indices[i]`.
+    """
+    token = _samples.set(list(indices))
+    try:
+        yield
+    finally:
+        _samples.reset(token)
+
+
+@contextmanager
+def sample(position: int):
+    """
+    Makes the stream produced inside the one of the sample at `position` among the samples asked.
+    """
+    token = _position.set(position)
+    try:
+        yield
+    finally:
+        _position.reset(token)
+
+
+def sample_token(position: int = None):
+    """
+    Times a token of the sample at `position` (default: the current one, if any) in the current records.
+    """
+    position = _position.get() if position is None else position
+    if position is None:
+        return
+    indices = _samples.get()
+    name = indices[position] if indices is not None and position < len(indices) else position
+    now = time.perf_counter()
+    with _lock:
+        for record in _current.get():
+            tokens = record.setdefault("samples", {}).setdefault(name, {"first": now, "tokens": 0})
+            tokens["tokens"] += 1
+            tokens["last"] = now
+
+
+def sample_timing(record: dict, index) -> dict:
+    """
+    The time to first token and decoding rate of the sample `index` of `record`; the ones of the whole record when
+    its samples were not told apart, None for a sample that produced nothing (e.g., a cached one).
+    """
+    if "samples" not in record:
+        whole = timing(record)
+        return {"ttft": whole["ttft"], "tokens_per_second": whole["tokens_per_second"]}
+    tokens = record["samples"].get(index)
+    if tokens is None:
+        return {"ttft": None, "tokens_per_second": None}
+    rate = None
+    if tokens["tokens"] > 1 and tokens["last"] > tokens["first"]:
+        rate = (tokens["tokens"] - 1) / (tokens["last"] - tokens["first"])
+    return {"ttft": tokens["first"] - record["started"], "tokens_per_second": rate}
+
+
+def timing(record: dict) -> dict:
+    """
+    The latency of `record` so far, its time to first token and its decoding rate (tokens per second after the
+    first one, None without a stream).
+    """
+    latency = time.perf_counter() - record["started"]
+    tokens, ttft = record.get("completion_tokens"), record.get("ttft")
+    rate = None
+    if ttft is not None and tokens and tokens > 1 and latency > ttft:
+        rate = (tokens - 1) / (latency - ttft)
+    return {"latency": latency, "ttft": ttft, "tokens_per_second": rate}
+
+
+def propagate(function):
+    """
+    `function` running, in any thread, with the records (and the sample) of the caller.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # a context is entered by one thread at a time
+        return context.copy().run(function, *args, **kwargs)
+    return run
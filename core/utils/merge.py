@@ -0,0 +1,89 @@
+"""
+Merge of the generated replies with the dataset.
+Every reply (and human answer) is a row of one long table `(question_id, source, sample_idx, text)`, built by
+exploding the reply lists with repeat/concatenate; the wide datasets (one `<source>_response` list column per
+service) are views derived from it.
+"""
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from core.utils.checkpoint import plain
+
+COLUMNS = ["question_id", "source", "sample_idx", "text"]
+
+
+def _explode(rows, dtype):
+    # (question_id, [texts]) rows as repeated question ids (of the index `dtype`, even without rows), sample positions
+    # and the flattened texts
+    rows = list(rows)
+    lengths = np.fromiter((len(texts) for _, texts in rows), dtype=np.int64, count=len(rows))
+    questions = np.repeat(np.array([row for row, _ in rows], dtype=dtype), lengths)
+    samples = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    texts = np.fromiter(chain.from_iterable(texts for _, texts in rows), dtype=object, count=lengths.sum())
+    return questions, samples, texts
+
+
+def long_replies(dataset, replies: dict, human: str = "human_answers") -> pd.DataFrame:
+    """
+    The long table of the `replies` (`{service: [(row, [texts])]}`) and of the `human` column of the dataset,
+    sorted by source, question and sample. Missing replies (None) are left out.
+    """
+    groups = {}
+    if human in dataset:
+        groups["human"] = _explode(zip(dataset.index, dataset[human]), dataset.index.dtype)
+    for service, rows in replies.items():
+        if service != "human":
+            groups[service] = _explode(rows, dataset.index.dtype)
+    if not groups:
+        return pd.DataFrame(columns=COLUMNS)
+    sources = list(groups)
+    codes = np.repeat(np.arange(len(sources)), [len(texts) for _, _, texts in groups.values()])
+    questions, samples, texts = (np.concatenate(parts) for parts in zip(*groups.values()))
+    order = np.lexsort((samples, questions, codes))
+    long = pd.DataFrame({
+        "question_id": questions[order],
+        "source": pd.Categorical.from_codes(codes[order], sources),
+        "sample_idx": samples[order],
+        "text": texts[order],
+    })
+    return long[long["text"].notna().to_numpy()].reset_index(drop=True)
+
+
+def wide_view(long: pd.DataFrame, sources=None, suffix: str = "_response") -> pd.DataFrame:
+    """
+    One list column `<source><suffix>` per source (all of them when None), indexed by question.
+    """
+    columns = {}
+    for source in sources if sources is not None else long["source"].unique():
+        group = long[(long["source"] == source).to_numpy()]
+        questions = group["question_id"].to_numpy()
+        texts = group["text"].tolist()
+        # the rows of a question are contiguous (the table is sorted), cut them at every change of question
+        bounds = np.flatnonzero(np.r_[len(questions) > 0, questions[1:] != questions[:-1]]).tolist() + [len(texts)]
+        columns[f"{source}{suffix}"] = pd.Series([texts[a:b] for a, b in zip(bounds[:-1], bounds[1:])],
+                                                 index=questions[bounds[:-1]], dtype=object)
+    return pd.DataFrame(columns)
+
+
+def with_responses(dataset, long: pd.DataFrame, sources=None) -> pd.DataFrame:
+    """
+    The dataset with a `<source>_response` column per service, None for the questions without replies (and for
+    every question of a service without any).
+    """
+    if sources is None:
+        # the categories keep the services left without rows
+        sources = long["source"].cat.categories if isinstance(long["source"].dtype, pd.CategoricalDtype) \
+            else long["source"].unique()
+        sources = [source for source in sources if source != "human"]
+    wide = wide_view(long, sources).reindex(index=dataset.index, columns=[f"{source}_response" for source in sources])
+    return dataset.join(wide.astype(object).where(wide.notna(), None))
+
+
+def human_replies(dataset, human: str = "human_answers", repeat: int = 3) -> list:
+    """
+    The human answers in the replies format, `[row, [[answer] * repeat for each answer]]`, keyed by the index label.
+    """
+    return [[plain(row), [[answer] * repeat for answer in answers]]
+            for row, answers in zip(dataset.index, dataset[human])]
@@ -0,0 +1,161 @@
+"""
+Incremental runner of the pipeline stages.
+A stage declares its input files, its parameters and its outputs, and optionally splits its work in partitions
+(e.g., one per service) with their own material. The fingerprint of a partition is the content hash of the
+inputs, of the parameters and of the partition material; the fingerprints of the last successful run are kept in a
+JSON state file, and only the partitions whose fingerprint changed (or whose outputs are missing) run again.
+A stage follows the stages producing its inputs (and the ones it names in `after`); stages whose dependencies are
+done run in parallel.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Stage:
+    """
+    `action(partitions)` produces the outputs of the stale `partitions`; before it, `refresh(partition)` discards
+    what a changed partition produced in a previous run (e.g., its replies in the log), so that the action
+    recomputes it. `partitions()` is called when the stage is about to run, after its dependencies, and returns
+    `{partition: material}`; without it the stage is a single partition.
+    """
+
+    def __init__(self, name: str, action, inputs=(), outputs=(), params=None, partitions=None, refresh=None,
+                 after=()):
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.partitions = partitions or (lambda: {"all": None})
+        self.refresh = refresh
+        self.after = list(after)
+
+
+class StageRunner:
+    def __init__(self, state_file: str, stages: list, workers: int = None):
+        self.state_file = state_file
+        self.stages = {stage.name: stage for stage in stages}
+        self.workers = workers or len(stages)
+        self.lock = threading.Lock()
+        self.state = {"stages": {}, "files": {}}
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as f:
+                self.state = json.load(f)
+
+    def dependencies(self) -> dict:
+        producers = {os.path.normpath(output): stage.name for stage in self.stages.values() for output in stage.outputs}
+        return {name: {producers[os.path.normpath(i)] for i in stage.inputs if os.path.normpath(i) in producers}
+                | set(stage.after) for name, stage in self.stages.items()}
+
+    def file_hash(self, path: str) -> str:
+        """
+        The content hash of a file or of a directory (its files, recursively); unchanged files (same size and
+        modification time) are not read again.
+        """
+        if not os.path.exists(path):
+            return None
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+            return digest({os.path.relpath(file, path): self.file_hash(file) for file in files})
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            known = self.state["files"].get(path)
+        if known and known[:2] == signature:
+            return known[2]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        with self.lock:
+            self.state["files"][path] = signature + [sha.hexdigest()]
+        return sha.hexdigest()
+
+    def fingerprints(self, stage: Stage) -> dict:
+        shared = {"params": stage.params, "inputs": {path: self.file_hash(path) for path in stage.inputs}}
+        return {partition: digest([shared, material]) for partition, material in stage.partitions().items()}
+
+    def stale(self, stage: Stage, fingerprints: dict) -> list:
+        recorded = self.state["stages"].get(stage.name, {})
+        if not all(os.path.exists(output) for output in stage.outputs):
+            return list(fingerprints)
+        return [partition for partition, value in fingerprints.items() if recorded.get(partition) != value]
+
+    def _save(self):
+        temporary = self.state_file + ".tmp"
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        with open(temporary, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(temporary, self.state_file)
+
+    def _run(self, name: str, force: bool) -> list:
+        stage = self.stages[name]
+        fingerprints = self.fingerprints(stage)
+        partitions = list(fingerprints) if force else self.stale(stage, fingerprints)
+        if not partitions:
+            logging.warning(f"{name}: up to date")
+            return []
+        logging.warning(f"{name}: running {partitions}")
+        recorded = self.state["stages"].get(name, {})
+        if stage.refresh is not None:
+            for partition in partitions:
+                if partition in recorded:
+                    stage.refresh(partition)
+        stage.action(partitions)
+        # the partitions gone from the stage are forgotten
+        with self.lock:
+            self.state["stages"][name] = {partition: value for partition, value in fingerprints.items()
+                                          if partition in partitions or recorded.get(partition) == value}
+            self._save()
+        return partitions
+
+    def plan(self) -> dict:
+        """
+        The stale partitions of every stage, as of now: a stage after a stale one may turn stale once it ran.
+        """
+        return {name: self.stale(stage, self.fingerprints(stage)) for name, stage in self.stages.items()}
+
+    def run(self, only=None, force=()) -> dict:
+        """
+        Runs the stale partitions of the stages (of the `only` ones and of their dependencies, when given), every
+        partition of the `force` ones. Returns the partitions run by every stage, stops at the first failure once
+        the stages already running are done.
+        """
+        dependencies = self.dependencies()
+        selected = set(only or self.stages)
+        pending = list(selected)
+        while pending:
+            for dependency in dependencies[pending.pop()] - selected:
+                selected.add(dependency)
+                pending.append(dependency)
+        done, ran, running, failure = set(), {}, {}, None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while len(done) < len(selected):
+                if failure is None:
+                    for name in sorted(selected - done - set(running.values())):
+                        if dependencies[name] & selected <= done:
+                            running[pool.submit(self._run, name, name in force)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        ran[name] = future.result()
+                    except Exception as e:
+                        logging.error(f"{name} failed: {e}")
+                        failure = failure or e
+                    done.add(name)
+        if failure is not None:
+            raise failure
+        if len(done) < len(selected):
+            raise ValueError(f"Cyclic dependencies among {sorted(selected - done)}")
+        return ran
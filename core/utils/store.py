@@ -0,0 +1,174 @@
+"""
+Binary embedding store.
+Vectors live in one contiguous raw matrix (`vectors.bin`, float32 or float16) read through `np.memmap`, the
+`index.jsonl` file maps every line (i.e., matrix row) to its `(mode, row, sample)` key.
+Appending writes the vectors first and the index after, so a crash between the two leaves only unindexed bytes
+that are dropped on the next open. `drop` rewrites both files into temporaries (vectors first) and swaps them in
+the same order, an interrupted swap is completed on the next open; the indexes saved in the directory are
+deleted, to be built again.
+"""
+import json
+import os
+
+import numpy as np
+
+
+class RowView:
+    """
+    Lazy selection of rows of a matrix, read only when sliced (e.g., one chunk at a time).
+    """
+
+    def __init__(self, matrix, offsets):
+        self.source = matrix
+        self.offsets = offsets
+        self.shape = (len(offsets), matrix.shape[1])
+        self.dtype = matrix.dtype
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, item):
+        return self.source[self.offsets[item]]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.source[self.offsets], dtype=dtype)
+
+
+class EmbeddingStore:
+    def __init__(self, directory: str, dtype: str = "float32"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta_file = os.path.join(directory, "meta.json")
+        self.vectors_file = os.path.join(directory, "vectors.bin")
+        self.index_file = os.path.join(directory, "index.jsonl")
+        self.dim = None
+        self.dtype = np.dtype(dtype)
+        # bumped by every rewrite, so that what is derived from the rows (e.g., an index) can tell it is stale
+        self.generation = 0
+        self._recover()
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r') as f:
+                meta = json.load(f)
+            self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+            self.generation = meta.get("generation", 0)
+        self.keys = []
+        self.positions = {}
+        if os.path.exists(self.index_file):
+            valid = 0
+            with open(self.index_file, 'r+b') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._remember(tuple(json.loads(line)))
+                    valid += len(line)
+                f.truncate(valid)
+        if os.path.exists(self.vectors_file) and self.dim is not None:
+            with open(self.vectors_file, 'r+b') as f:
+                f.truncate(len(self.keys) * self.dim * self.dtype.itemsize)
+
+    def _recover(self):
+        vectors, index = self.vectors_file + ".tmp", self.index_file + ".tmp"
+        if os.path.exists(vectors):
+            # the rewrite stopped before the swap, the store is still the old one
+            for temporary in (vectors, index):
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+        elif os.path.exists(index):
+            # the vectors were swapped, the index was not
+            os.replace(index, self.index_file)
+
+    def _remember(self, key):
+        self.positions[key] = len(self.keys)
+        self.keys.append(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return tuple(key) in self.positions
+
+    def modes(self) -> list:
+        return list(dict.fromkeys(key[0] for key in self.keys))
+
+    def extend(self, keys: list, vectors):
+        keys = [(mode, row.item() if hasattr(row, "item") else row, sample) for mode, row, sample in keys]
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._save_meta()
+        with open(self.vectors_file, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors).tobytes())
+        with open(self.index_file, 'a') as f:
+            f.writelines(json.dumps(list(key)) + "\n" for key in keys)
+        for key in keys:
+            self._remember(key)
+
+    def _save_meta(self):
+        with open(self.meta_file, 'w') as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "generation": self.generation}, f)
+
+    def append(self, key, vector):
+        self.extend([key], [vector])
+
+    def matrix(self) -> np.ndarray:
+        if not self.keys:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        return np.memmap(self.vectors_file, dtype=self.dtype, mode='r', shape=(len(self.keys), self.dim))
+
+    def offsets(self, keys) -> np.ndarray:
+        return np.fromiter((self.positions[tuple(key)] for key in keys), dtype=np.int64)
+
+    def get(self, keys) -> np.ndarray:
+        return self._rows(self.offsets(keys))
+
+    def drop(self, mode):
+        """
+        Removes the vectors of `mode` from the store (e.g., the replies of a service generated again).
+        """
+        keep = np.array([position for position, key in enumerate(self.keys) if key[0] != mode], dtype=np.int64)
+        if len(keep) == len(self.keys):
+            return
+        keys = [self.keys[position] for position in keep]
+        vectors, index = self.vectors_file + ".tmp", self.index_file + ".tmp"
+        with open(vectors, 'wb') as f:
+            for start in range(0, len(keep), 10_000):
+                f.write(np.ascontiguousarray(self.matrix()[keep[start:start + 10_000]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(index, 'w') as f:
+            f.writelines(json.dumps(list(key)) + "\n" for key in keys)
+            f.flush()
+            os.fsync(f.fileno())
+        # before the swap: an interrupted drop at worst makes the indexes of the old rows stale
+        self.generation += 1
+        self._save_meta()
+        os.replace(vectors, self.vectors_file)
+        os.replace(index, self.index_file)
+        # the nearest-neighbour indexes saved next to the store (`IvfIndex`) refer to the old rows
+        for name in os.listdir(self.directory):
+            if name.startswith("ivf-") and name.endswith(".npz"):
+                os.remove(os.path.join(self.directory, name))
+        self.keys, self.positions = [], {}
+        for key in keys:
+            self._remember(key)
+
+    def mode_keys(self, mode) -> list:
+        return [key for key in self.keys if key[0] == mode]
+
+    def mode_matrix(self, mode) -> np.ndarray:
+        return self._rows(self.offsets(self.mode_keys(mode)))
+
+    def mode_view(self, mode):
+        # like mode_matrix, but scattered rows are not gathered up front
+        offsets = self.offsets(self.mode_keys(mode))
+        if len(offsets) and np.all(np.diff(offsets) == 1):
+            return self._rows(offsets)
+        return RowView(self.matrix(), offsets)
+
+    def _rows(self, offsets) -> np.ndarray:
+        # contiguous offsets are a view on the memory map (no copy), the others a gather
+        if len(offsets) and offsets[-1] - offsets[0] == len(offsets) - 1 and np.all(np.diff(offsets) == 1):
+            return self.matrix()[offsets[0]:offsets[-1] + 1]
+        return self.matrix()[offsets]
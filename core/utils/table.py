@@ -0,0 +1,56 @@
+"""
+Columnar storage of the datasets (Parquet).
+The list columns (`human_answers`, `chatgpt_answers`, `<service>_response`) are stored as Arrow lists of
+strings, not as nested text. A reader asks only for the columns it uses and can filter the rows with
+predicates on the row-group statistics (e.g., `[("source", "=", "reddit_eli5")]`); the file is memory mapped.
+CSV, JSON and pickle remain available as optional exports.
+"""
+import os
+
+EXPORTS = ("parquet", "csv", "json", "pkl")
+
+
+def write_table(dataset, filename: str, row_group_size: int = 4096):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(dataset, preserve_index=True)
+    temporary = filename + ".tmp"
+    pq.write_table(table, temporary, row_group_size=row_group_size)
+    os.replace(temporary, filename)
+
+
+def read_table(filename: str, columns: list = None, filters=None, memory_map: bool = True):
+    """
+    Reads `columns` (all when None, the index is always restored) of the rows matching `filters`.
+    """
+    import pyarrow.parquet as pq
+    table = pq.read_table(filename, columns=columns, filters=filters, memory_map=memory_map,
+                          use_pandas_metadata=True)
+    return table.to_pandas()
+
+
+def load_dataset_file(filename: str, columns: list = None, filters=None):
+    """
+    Loads a dataset from Parquet (with projection and filters) or from a legacy CSV, JSON or pickle export
+    (read entirely, then projected and filtered).
+    """
+    import pandas as pd
+    if filename.endswith(".parquet"):
+        return read_table(filename, columns, filters)
+    readers = {".json": pd.read_json, ".pkl": pd.read_pickle, ".csv": pd.read_csv}
+    dataset = readers[os.path.splitext(filename)[1]](filename)
+    for column, operator, value in filters or []:
+        dataset = dataset[_compare(dataset[column], operator, value)]
+    return dataset[columns] if columns is not None else dataset
+
+
+def _compare(series, operator: str, value):
+    if operator in ("=", "=="):
+        return series == value
+    if operator == "!=":
+        return series != value
+    if operator == "in":
+        return series.isin(value)
+    if operator == "not in":
+        return ~series.isin(value)
+    return {"<": series.__lt__, "<=": series.__le__, ">": series.__gt__, ">=": series.__ge__}[operator](value)
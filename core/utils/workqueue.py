@@ -0,0 +1,184 @@
+"""
+Sharded generation through a local SQLite work queue.
+Every (service, row, sample) is a work item; worker processes lease batches of items, produce the replies and
+mark them done. A lease expires after `lease_seconds`, so the items of a dead worker go back to the others.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+from collections import defaultdict
+
+from tqdm.auto import tqdm
+
+from core.utils.llm import release, shares_model, telemetry, warm_up
+from core.utils.llm.clients import registry
+
+
+class WorkQueue:
+    def __init__(self, filename: str, lease_seconds: float = 300, max_attempts: int = 5):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(filename, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS items (service TEXT, row TEXT, sample INTEGER, question TEXT, "
+            "status TEXT DEFAULT 'pending', owner TEXT, expires REAL DEFAULT 0, attempts INTEGER DEFAULT 0, "
+            "text TEXT, ttft REAL, tokens_per_second REAL, PRIMARY KEY (service, row, sample))"
+        )
+        # queues made before the timing was recorded
+        columns = {column[1] for column in self.connection.execute("PRAGMA table_info(items)")}
+        for column in ["ttft", "tokens_per_second"]:
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE items ADD COLUMN {column} REAL")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status, expires)")
+
+    def enqueue(self, service: str, items):
+        """
+        Adds the `(row, sample, question)` items of a service, the ones already queued are left untouched.
+        """
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO items (service, row, sample, question) VALUES (?, ?, ?, ?)",
+            [(service, json.dumps(row), sample, question) for row, sample, question in items]
+        )
+
+    def lease(self, owner: str, limit: int = 16, services=None, prefer: str = None) -> list[dict]:
+        """
+        Leases up to `limit` pending (or expired) items of one service, `prefer` when it has work, sorted by row so
+        that the samples of a question stay together.
+        """
+        now = time.time()
+        services = list(services) if services is not None else None
+        where = "(status = 'pending' OR (status = 'leased' AND expires < ?))"
+        parameters = [now]
+        if services is not None:
+            where += f" AND service IN ({','.join('?' * len(services))})"
+            parameters += services
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            service = self.connection.execute(
+                f"SELECT service FROM items WHERE {where} ORDER BY service != ?, service LIMIT 1",
+                [*parameters, prefer or ""]
+            ).fetchone()
+            rows = self.connection.execute(
+                f"SELECT service, row, sample, question FROM items WHERE {where} AND service = ? "
+                f"ORDER BY row, sample LIMIT ?", [*parameters, service[0] if service else None, limit]
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE items SET status = 'leased', owner = ?, expires = ?, attempts = attempts + 1 "
+                "WHERE service = ? AND row = ? AND sample = ?",
+                [(owner, now + self.lease_seconds, service, row, sample) for service, row, sample, _ in rows]
+            )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return [{"service": service, "row": json.loads(row), "sample": sample, "question": question}
+                for service, row, sample, question in rows]
+
+    def complete(self, item: dict, text: str, ttft: float = None, tokens_per_second: float = None):
+        self.connection.execute(
+            "UPDATE items SET status = 'done', text = ?, ttft = ?, tokens_per_second = ? "
+            "WHERE service = ? AND row = ? AND sample = ?",
+            (text, ttft, tokens_per_second, item["service"], json.dumps(item["row"]), item["sample"])
+        )
+
+    def fail(self, *items: dict):
+        # back to the queue, until they fail too many times; in one transaction, so that another worker does not
+        # lease only part of the samples of a question
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.executemany(
+            "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, expires = 0 "
+            "WHERE service = ? AND row = ? AND sample = ? AND status = 'leased'",
+            [(self.max_attempts, item["service"], json.dumps(item["row"]), item["sample"]) for item in items]
+        )
+        self.connection.execute("COMMIT")
+
+    def counts(self) -> dict:
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+
+    def unfinished(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM items WHERE status IN ('pending', 'leased')"
+        ).fetchone()[0]
+
+    def results(self, service: str = None):
+        """
+        The `(service, row, sample, text, timing)` of the done items, the timing of the stream that produced the
+        text (`ttft` and `tokens_per_second`).
+        """
+        query = "SELECT service, row, sample, text, ttft, tokens_per_second FROM items WHERE status = 'done'"
+        rows = self.connection.execute(query + (" AND service = ?" if service else ""), (service,) if service else ())
+        for service, row, sample, text, ttft, tokens_per_second in rows:
+            yield service, json.loads(row), sample, text, {"ttft": ttft, "tokens_per_second": tokens_per_second}
+
+    def close(self):
+        self.connection.close()
+
+
+def run_worker(queue: WorkQueue, services: dict, owner: str, max_tokens: int = 250, batch: int = 16,
+               idle: float = 1.0):
+    """
+    Leases batches until the queue has no unfinished items. The samples of a question in a batch are asked
+    with one `complete_samples`, the questions of a batch concurrently (up to the service concurrency).
+    The worker sticks to the service of its previous batch while it has work; when it moves to another one, the
+    previous model is released (unless the next service uses it too) and the next one warmed up, the load times are
+    returned per service. Loading and unloading are best-effort: the items of a model that cannot be loaded go back
+    to the queue.
+    """
+    current = None
+    load_times = defaultdict(float)
+    progress = tqdm(desc=owner, unit="replies")
+    while True:
+        items = queue.lease(owner, batch, services=services.keys(), prefer=current)
+        if not items:
+            if not queue.unfinished():
+                break
+            # the remaining items are leased by other workers, wait in case a lease expires
+            time.sleep(idle)
+            continue
+        if items[0]["service"] != current:
+            following = items[0]["service"]
+            if current is not None and not shares_model(services[current], services[following]):
+                release(current, services[current])
+            current = following
+            load = warm_up(current, services[current])
+            if load is None:
+                # back to the queue at once, not after the lease expires
+                queue.fail(*items)
+                current = None
+                continue
+            load_times[current] += load
+        registry.run(_produce(queue, services, items, max_tokens))
+        progress.update(len(items))
+    if current is not None:
+        release(current, services[current])
+    progress.close()
+    return dict(load_times)
+
+
+async def _produce(queue: WorkQueue, services: dict, items: list[dict], max_tokens: int):
+    groups = defaultdict(list)
+    for item in items:
+        groups[(item["service"], json.dumps(item["row"]))].append(item)
+    in_flight = {service: asyncio.Semaphore(services[service].concurrency) for service in services}
+
+    async def produce(group):
+        service = group[0]["service"]
+        record = telemetry.new_record()
+        try:
+            async with in_flight[service]:
+                with telemetry.recording(record):
+                    # by index: the other samples of the question may be in another batch, and a cache must not
+                    # give them back
+                    replies = await services[service].acomplete_samples(group[0]["question"], max_tokens,
+                                                                        [item["sample"] for item in group])
+        except Exception as e:
+            print(f"Error: {e}")
+            queue.fail(*group)
+            return
+        for item, text in zip(group, replies):
+            timing = telemetry.sample_timing(record, item["sample"])
+            queue.complete(item, text, timing["ttft"], timing["tokens_per_second"])
+
+    await asyncio.gather(*[produce(group) for group in groups.values()])
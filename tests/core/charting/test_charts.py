@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+import matplotlib
+import numpy as np
+
+from core.charting import density_image, draw_chart
+
+matplotlib.use("Agg")
+
+
+class DensityChartTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        import matplotlib.pyplot as plt
+        plt.close("all")
+        self.directory.cleanup()
+
+    def test_pixels_mix_the_colours_of_their_modes(self):
+        points = np.array([[0.1, 0.1], [0.1, 0.1], [0.1, 0.1], [0.9, 0.9], [0.1, 0.1], [5.0, 5.0]])
+        labels = ["b", "b", "a", "a", "a", "a"]
+        colors = [(1.0, 0.0, 0.0), (0.0, 0.0, 1.0)]
+        image, extent, categories = density_image(points, labels, bins=2, extent=(0, 1, 0, 1), colors=colors)
+        # in order of appearance, like the hue of seaborn
+        self.assertEqual(categories, ["b", "a"])
+        # 2 b and 2 a in the bottom left pixel, 1 a in the top right one, the point out of the extent is left out
+        np.testing.assert_allclose(image[0, 0, :3], [0.5, 0.0, 0.5])
+        np.testing.assert_allclose(image[1, 1, :3], [0.0, 0.0, 1.0])
+        self.assertEqual(image[0, 1, 3], 0)
+        self.assertAlmostEqual(image[0, 0, 3], 1.0)
+        self.assertLess(image[1, 1, 3], image[0, 0, 3])
+
+    def test_extent_covers_the_points(self):
+        points = np.random.default_rng(0).normal(size=(1000, 2))
+        image, extent, categories = density_image(points, bins=16, colors=[(0.0, 0.0, 1.0)])
+        self.assertEqual(categories, [0])
+        self.assertLess(extent[0], points[:, 0].min())
+        self.assertGreater(extent[3], points[:, 1].max())
+        self.assertEqual(image.shape, (16, 16, 4))
+
+    def test_default_colours_and_numeric_labels(self):
+        import seaborn as sns
+        points = np.random.default_rng(0).random((10, 2))
+        image, extent, categories = density_image(points, [3, 1, 2, 1, 3, 2, 1, 1, 3, 2], bins=8)
+        # sorted, like the hue levels of seaborn for numbers
+        self.assertEqual(categories, [1, 2, 3])
+        self.assertEqual(density_image(points, bins=8)[2], [0])
+        # a pixel of a single point has the colour of its category
+        single = density_image(points[:1], [5], bins=1)[0]
+        np.testing.assert_allclose(single[0, 0, :3], sns.color_palette(n_colors=1)[0])
+
+    def test_file_size_is_bounded_by_the_bins(self):
+        rng = np.random.default_rng(0)
+        for n in [2_000, 500_000]:
+            where = os.path.join(self.directory.name, f"{n}.pdf")
+            labels = np.array(["mode 0", "mode 1", "mode 2", "mode 3"])[np.arange(n) % 4]
+            draw_chart(rng.normal(size=(n, 2)), where, labels=labels, render="density", bins=128)
+            # at most the raw RGBA image, plus the axes
+            self.assertLess(os.path.getsize(where), 128 * 128 * 4 + 20_000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from core.charting.reduction import ReducerService, matrix_hash, reduce, streaming_reduce
+from core.utils.store import EmbeddingStore, RowView
+
+
+class ReducerServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.embeddings = np.random.default_rng(0).normal(size=(60, 8)).astype(np.float32)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_projection_is_cached(self):
+        reducers = ReducerService(self.directory.name, workers=1)
+        first = reducers.project(self.embeddings, "pca")
+        self.assertEqual(first.shape, (60, 2))
+        with patch("core.charting.reduction.reduce", side_effect=AssertionError("not cached")):
+            np.testing.assert_array_equal(reducers.project(self.embeddings, "pca"), first)
+
+    def test_key_depends_on_data_and_parameters(self):
+        reducers = ReducerService(self.directory.name)
+        base = reducers.filename(self.embeddings, "pca", {"n_components": 2})
+        self.assertNotEqual(base, reducers.filename(self.embeddings, "pca", {"n_components": 3}))
+        self.assertNotEqual(base, reducers.filename(self.embeddings[1:], "pca", {"n_components": 2}))
+        self.assertNotEqual(matrix_hash(self.embeddings), matrix_hash(self.embeddings.astype(np.float64)))
+
+    def test_independent_reductions_in_parallel(self):
+        reducers = ReducerService(self.directory.name, workers=2)
+        pca, tsne = reducers.project_many([(self.embeddings, "pca", {}), (self.embeddings, "tsne", {"perplexity": 5})])
+        self.assertEqual(pca.shape, (60, 2))
+        self.assertEqual(tsne.shape, (60, 2))
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+
+class StreamingReductionTests(unittest.TestCase):
+    def setUp(self):
+        # distinct variances, so that the principal components are well defined
+        scales = np.array([8, 4, 1, 1, 1, 1, 1, 1])
+        self.embeddings = (np.random.default_rng(0).normal(size=(300, 8)) * scales).astype(np.float32)
+
+    def test_incremental_pca_matches_pca(self):
+        streamed = streaming_reduce(self.embeddings, "pca", {"n_components": 2}, chunk=64)
+        exact = reduce(self.embeddings, "pca", {"n_components": 2})
+        # components are defined up to the sign
+        for axis in range(2):
+            correlation = np.corrcoef(streamed[:, axis], exact[:, axis])[0, 1]
+            self.assertGreater(abs(correlation), 0.99)
+
+    def test_tsne_places_unsampled_rows_near_their_neighbours(self):
+        clusters = np.repeat([[0] * 8, [100] * 8], 100, axis=0) + self.embeddings[:200] / 8
+        projection = streaming_reduce(clusters, "tsne", {"n_components": 2, "perplexity": 5},
+                                      chunk=64, sample=60, neighbors=3)
+        self.assertEqual(projection.shape, (200, 2))
+        first, second = projection[:100], projection[100:]
+        gap = np.linalg.norm(first.mean(axis=0) - second.mean(axis=0))
+        spread = max(np.linalg.norm(first - first.mean(axis=0), axis=1).max(),
+                     np.linalg.norm(second - second.mean(axis=0), axis=1).max())
+        self.assertLess(spread, gap)
+
+    def test_reads_rows_of_a_store_lazily(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = EmbeddingStore(directory)
+            store.extend([("a" if i % 2 else "b", i, 0) for i in range(len(self.embeddings))], self.embeddings)
+            view = store.mode_view("a")
+            self.assertIsInstance(view, RowView)
+            np.testing.assert_array_equal(view[10:20], self.embeddings[1::2][10:20])
+            self.assertEqual(matrix_hash(view), matrix_hash(self.embeddings[1::2]))
+            reducers = ReducerService(directory + "/projections", streaming=True, chunk=32)
+            self.assertEqual(reducers.project(view, "pca").shape, (150, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import itertools
+import tempfile
+import unittest
+
+import numpy as np
+
+from core.metrics import dispersion, distance_to_reference, centroid_distances, variability
+from core.utils import embed_replies_if_not_cached
+from core.utils.llm import LlmService
+from core.utils.store import EmbeddingStore
+
+
+def cosine(a, b):
+    return 1 - a @ b / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def euclidean(a, b):
+    return np.linalg.norm(a - b)
+
+
+class RandomEmbeddings(LlmService):
+    # the same vector for the same text
+    def embedChucks(self, text: list[str]):
+        return [np.random.default_rng(sum(map(ord, t))).normal(size=8).tolist() for t in text]
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.default_rng(42)
+        self.tensor = random.normal(size=(3, 5, 4, 8))
+        self.mask = np.ones((3, 5, 4), dtype=bool)
+        self.mask[0, 1, 2:] = False
+        self.mask[2, 3, 1:] = False
+
+    def valid(self, mode, question):
+        return self.tensor[mode, question][self.mask[mode, question]]
+
+    def test_dispersion_matches_loops(self):
+        for metric, distance in [("cosine", cosine), ("euclidean", euclidean)]:
+            result = dispersion(self.tensor, self.mask, metric)
+            for mode, question in itertools.product(range(3), range(5)):
+                samples = self.valid(mode, question)
+                pairs = [distance(a, b) for a, b in itertools.permutations(samples, 2)]
+                if pairs:
+                    self.assertAlmostEqual(result[mode, question], np.mean(pairs), places=4)
+                else:
+                    self.assertTrue(np.isnan(result[mode, question]))
+
+    def test_distance_to_reference_matches_loops(self):
+        result = distance_to_reference(self.tensor, self.mask, 2, "euclidean")
+        for mode, question in itertools.product(range(3), range(5)):
+            centroid = self.valid(2, question).mean(axis=0)
+            expected = np.mean([euclidean(s, centroid) for s in self.valid(mode, question)])
+            self.assertAlmostEqual(result[mode, question], expected, places=4)
+
+    def test_centroid_distances_matches_loops(self):
+        result = centroid_distances(self.tensor, self.mask, "cosine")
+        self.assertEqual(result.shape, (5, 3, 3))
+        expected = cosine(self.valid(0, 1).mean(axis=0), self.valid(2, 1).mean(axis=0))
+        self.assertAlmostEqual(result[1, 0, 2], expected, places=4)
+
+    def test_variability_over_chunks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = EmbeddingStore(directory)
+            keys = [(mode, question, sample) for mode, question, sample in zip(*np.nonzero(self.mask))]
+            store.extend([(["a", "b", "human"][m], int(q), int(s)) for m, q, s in keys],
+                         self.tensor[self.mask])
+            metrics, between = variability(store, chunk=2)
+            self.assertEqual(len(metrics), 15)
+            expected = dispersion(self.tensor, self.mask, "cosine")
+            np.testing.assert_allclose(metrics["dispersion_cosine"].to_numpy(dtype=float), expected.ravel(),
+                                       rtol=1e-4)
+            self.assertEqual(list(between["euclidean"].index), ["a", "b", "human"])
+            self.assertAlmostEqual(between["euclidean"].loc["a", "a"], 0, places=4)
+
+    def test_repeated_human_answers_do_not_lower_the_dispersion(self):
+        answers = ["first answer", "second answer", "third answer"]
+        replies = {"m": [[0, answers]], "human": [[0, [[answer] * 3 for answer in answers]]]}
+        with tempfile.TemporaryDirectory() as directory:
+            store = embed_replies_if_not_cached(RandomEmbeddings(), replies, EmbeddingStore(directory))
+            metrics, _ = variability(store)
+        dispersions = metrics.set_index("mode")["dispersion_cosine"]
+        self.assertAlmostEqual(dispersions["human"], dispersions["m"], places=6)
+        self.assertAlmostEqual(metrics.set_index("mode")["reference_euclidean"]["m"],
+                               metrics.set_index("mode")["reference_euclidean"]["human"], places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import pandas
+
+from core.__main__ import COMMANDS, build_parser
+from core.cli.pipeline import drop_replies
+from core.utils import produce_response_for
+from core.utils.checkpoint import ReplyLog
+from core.utils.llm import LlmService
+
+HEAVY = ["openai", "ollama", "httpx", "umap", "sklearn", "seaborn", "datasets", "matplotlib"]
+
+
+class NewReplies(LlmService):
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return ["new"] * n
+
+
+class CliTests(unittest.TestCase):
+    def test_every_command_is_registered(self):
+        parser = build_parser()
+        for name in COMMANDS:
+            args = parser.parse_args([name])
+            self.assertTrue(callable(args.run))
+
+    def test_wrappers_keep_the_script_options(self):
+        args = build_parser().parse_args(["replies", "--how_many", "5", "--workers", "2"])
+        self.assertEqual((args.how_many, args.workers), (5, 2))
+        args = build_parser().parse_args(["embed-replies", "--streaming", "--skip-charts"])
+        self.assertTrue(args.streaming and args.skip_charts)
+        args = build_parser().parse_args(["pipeline", "--stages", "embed-replies", "--force", "replies"])
+        self.assertEqual((args.stages, args.force), (["embed-replies"], ["replies"]))
+
+    def test_refreshed_replies_are_generated_again(self):
+        dataset = pandas.DataFrame({"question": ["q"]})
+        with tempfile.TemporaryDirectory() as directory:
+            log_file, cache_file = os.path.join(directory, "data.log.jsonl"), os.path.join(directory, "data.json")
+            replies = {"a": [[0, ["old"]]], "b": [[0, ["old"]]]}
+            with open(cache_file, 'w') as f:
+                json.dump(replies, f)
+            pandas.to_pickle(replies, os.path.join(directory, "data.pkl"))
+            log = ReplyLog(log_file)
+            log.import_replies(replies)
+            log.close()
+            drop_replies(log_file, cache_file, "a")
+            # what the replies command does
+            with open(cache_file) as f:
+                log = ReplyLog(log_file)
+                log.import_replies(json.load(f))
+            generated = {service: produce_response_for(NewReplies(), dataset, how_many=1, log=log, name=service)
+                         for service in ["a", "b"]}
+            log.close()
+            self.assertEqual(pandas.read_pickle(os.path.join(directory, "data.pkl")), {"b": [[0, ["old"]]]})
+        self.assertEqual(generated, {"a": [(0, ["new"])], "b": [(0, ["old"])]})
+
+    def test_startup_does_not_import_the_backends(self):
+        # in a fresh interpreter, the modules already imported by the test runner do not count
+        code = ("import sys; from core.__main__ import build_parser; build_parser(); "
+                "import core.utils, core.utils.llm, core.charting; "
+                "from core.utils.llm import OpenAiService, OllamaService; OllamaService('llama3'); "
+                f"print(','.join(m for m in {HEAVY!r} if m in sys.modules))")
+        loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(loaded.strip(), "")
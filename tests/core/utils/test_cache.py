@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from core.utils.cache import RequestCache, CachedService
+from core.utils.llm import LlmService
+
+
+class CountingService(LlmService):
+    def __init__(self):
+        self.completions = 0
+        self.embedded = []
+
+    def identity(self) -> dict:
+        return {"backend": "Counting"}
+
+    def complete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        replies = [f"{text} {self.completions + i}" for i in range(n)]
+        self.completions += n
+        return replies
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        return self.complete_many(text, max_output, n)
+
+    def embedChucks(self, text: list[str]):
+        self.embedded.extend(text)
+        return [[float(len(t))] for t in text]
+
+
+class RequestCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "requests.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_only_new_samples_are_requested(self):
+        inner = CountingService()
+        service = CachedService(inner, RequestCache(self.filename))
+        first = service.complete_many("question", 10, 3)
+        second = service.complete_many("question", 10, 4)
+        self.assertEqual(second[:3], first)
+        self.assertEqual(inner.completions, 4)
+
+    def test_cache_survives_reopening(self):
+        CachedService(CountingService(), RequestCache(self.filename)).complete_many("question", 10, 2)
+        inner = CountingService()
+        CachedService(inner, RequestCache(self.filename)).complete_many("question", 10, 2)
+        self.assertEqual(inner.completions, 0)
+
+    def test_sampling_parameters_are_part_of_the_key(self):
+        inner = CountingService()
+        service = CachedService(inner, RequestCache(self.filename))
+        service.complete_many("question", 10, 1)
+        service.complete_many("question", 20, 1)
+        self.assertEqual(inner.completions, 2)
+
+    def test_embed_only_missing_texts(self):
+        inner = CountingService()
+        service = CachedService(inner, RequestCache(self.filename))
+        service.embedChucks(["a", "bb"])
+        result = service.embedChucks(["bb", "ccc", "a"])
+        self.assertEqual(result, [[2.0], [3.0], [1.0]])
+        self.assertEqual(inner.embedded, ["a", "bb", "ccc"])
+
+    def test_eviction_keeps_size_bounded(self):
+        cache = RequestCache(self.filename, max_bytes=1000)
+        for i in range(100):
+            cache.put(str(i), "x" * 50)
+        self.assertLessEqual(cache.size, 1000)
+        self.assertIsNotNone(cache.get("99"))
+        self.assertIsNone(cache.get("0"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+import pandas
+
+from core.utils import produce_response_for
+from core.utils.cache import CachedService, RequestCache
+from core.utils.checkpoint import ReplyLog
+from core.utils.llm import LlmService
+
+
+class FlakyService(LlmService):
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.asked = []
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        if text in self.failing:
+            # the samples asked one by one fail only the first time
+            if n == 1:
+                self.failing.remove(text)
+            raise ValueError("failure")
+        self.asked.append((text, n))
+        return [f"{text} {i}" for i in range(n)]
+
+
+class CountingService(LlmService):
+    def __init__(self):
+        self.produced = 0
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        self.produced += n
+        return [f"reply-{self.produced - n + i}" for i in range(n)]
+
+
+class ReplyLogTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "data.log.jsonl")
+        self.dataset = pandas.DataFrame({"question": ["a", "b", "c"]}, index=[5, 6, 7])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume_asks_only_missing_samples(self):
+        log = ReplyLog(self.filename)
+        result = produce_response_for(FlakyService(failing=["b"]), self.dataset, how_many=3, log=log, name="s")
+        self.assertEqual([row for row, _ in result], [5, 7])
+        # the samples of "b" that succeeded one by one are kept
+        self.assertEqual(log.missing("s", 6, 3), [0])
+        log.close()
+
+        service = FlakyService()
+        log = ReplyLog(self.filename)
+        result = produce_response_for(service, self.dataset, how_many=3, log=log, name="s")
+        self.assertEqual([row for row, _ in result], [5, 6, 7])
+        self.assertEqual(service.asked, [("b", 1)])
+        log.close()
+
+    def test_cached_resume_asks_new_samples(self):
+        inner = CountingService()
+        service = CachedService(inner, RequestCache(os.path.join(self.directory.name, "requests.sqlite")))
+        log = ReplyLog(self.filename)
+        produce_response_for(service, self.dataset.iloc[:1], how_many=1, log=log, name="s")
+        # resumed with more samples: the cached sample 0 is not given back as sample 1
+        self.assertEqual(produce_response_for(service, self.dataset.iloc[:1], how_many=3, log=log, name="s"),
+                         [(5, ["reply-0", "reply-1", "reply-2"])])
+        self.assertEqual(produce_response_for(service, self.dataset.iloc[:1], how_many=4, log=log, name="s"),
+                         [(5, ["reply-0", "reply-1", "reply-2", "reply-3"])])
+        self.assertEqual(inner.produced, 4)
+        log.close()
+
+    def test_torn_line_is_ignored(self):
+        log = ReplyLog(self.filename)
+        log.append("s", 5, 0, "first")
+        log.close()
+        with open(self.filename, 'a') as f:
+            f.write('{"service": "s", "row": 5, "sam')
+        log = ReplyLog(self.filename)
+        self.assertEqual(log.missing("s", 5, 2), [1])
+        log.append("s", 5, 1, "second")
+        log.close()
+        log = ReplyLog(self.filename)
+        self.assertEqual(log.samples("s", 5), {0: "first", 1: "second"})
+        log.close()
+
+    def test_compact_keeps_one_line_per_sample(self):
+        log = ReplyLog(self.filename)
+        log.append("s", 5, 0, "old")
+        log.append("s", 5, 0, "new")
+        log.append("s", 5, 1, "other")
+        log.append("s", 6, 0, "incomplete")
+        replies = log.compact(["s"], [5, 6], 2)
+        log.close()
+        self.assertEqual(replies, {"s": [(5, ["new", "other"])]})
+        with open(self.filename) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
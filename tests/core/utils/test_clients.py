@@ -0,0 +1,88 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from core.utils.llm import FileKeyLoader, OllamaService, OpenAiService
+from core.utils.llm.clients import ClientRegistry, HttpConfig
+from core.utils.llm.mock_server import MockServer
+
+
+class ClientRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = ClientRegistry()
+        patcher = patch("core.utils.llm.registry", self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.registry.close)
+
+    def test_services_of_an_endpoint_share_the_connections(self):
+        first = OllamaService("llama3", host="http://localhost:11434")
+        second = OllamaService("gemma2", host="http://localhost:11434")
+        other = OllamaService("llama3", host="http://localhost:11435")
+        self.assertIs(first.service, second.service)
+        self.assertIsNot(first.service, other.service)
+        azure = [OpenAiService(FileKeyLoader(os.devnull), "http://localhost", deployment, "2024-02-01", "model")
+                 for deployment in ["gpt-4o", "gpt-35"]]
+        self.assertIs(azure[0].service._client, azure[1].service._client)
+
+    def test_a_key_file_is_read_once(self):
+        with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as f:
+            f.write("key")
+        self.addCleanup(os.remove, f.name)
+        with patch.object(FileKeyLoader, "key", autospec=True, side_effect=lambda loader: "key") as key:
+            for deployment in ["gpt-4o", "gpt-35"]:
+                service = OpenAiService(FileKeyLoader(f.name), "http://localhost", deployment, "2024-02-01", "model")
+                self.assertEqual(service.service.api_key, "key")
+        self.assertEqual(key.call_count, 1)
+
+    def test_concurrent_lookups_build_one_client(self):
+        built = []
+
+        def factory():
+            built.append(1)
+            return object()
+
+        with ThreadPoolExecutor(16) as pool:
+            clients = list(pool.map(lambda _: self.registry.client("key", factory), range(64)))
+        self.assertEqual(len(built), 1)
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+    def test_async_clients_are_shared_per_loop(self):
+        service = OllamaService("llama3", host="http://localhost:11434")
+        other = OllamaService("gemma2", host="http://localhost:11434")
+
+        async def clients():
+            return service.async_service, other.async_service
+
+        first, second = asyncio.run(clients()), asyncio.run(clients())
+        self.assertIs(first[0], first[1])
+        self.assertIsNot(first[0], second[0])
+
+    def test_the_clients_of_a_loop_are_closed_with_it(self):
+        with MockServer() as server:
+            service = OllamaService("llama3", host=server.url)
+
+            async def complete():
+                return service.async_service, await service.acomplete("Hello", 3)
+
+            client, reply = self.registry.run(complete())
+        self.assertEqual(len(reply.split()), 3)
+        self.assertTrue(client._client.is_closed)
+        self.assertEqual(len(self.registry.async_clients), 0)
+
+    def test_the_configuration_tunes_the_pool(self):
+        config = HttpConfig.from_config({"max_connections": 8, "max_keepalive": 4, "timeout": 30, "connect_timeout": 2})
+        service = OllamaService("llama3", host="http://localhost:11434", http=config)
+        pool = service.service._client._transport._pool
+        self.assertEqual((pool._max_connections, pool._max_keepalive_connections), (8, 4))
+        self.assertEqual(service.service._client.timeout.read, 30)
+        self.assertEqual(service.service._client.timeout.connect, 2)
+        # a different configuration gets its own pool
+        self.assertIsNot(service.service, OllamaService("llama3", host="http://localhost:11434").service)
+
+
+if __name__ == '__main__':
+    unittest.main()
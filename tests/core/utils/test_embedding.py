@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+from core.utils import embed_replies_if_not_cached
+from core.utils.embedding import deduplicate, pack_batches, embed_texts
+from core.utils.llm import LlmService
+from core.utils.store import EmbeddingStore
+
+
+class BatchRecorder(LlmService):
+    def __init__(self):
+        self.batches = []
+
+    def embedChucks(self, text: list[str]):
+        self.batches.append(list(text))
+        return [[float(len(t))] for t in text]
+
+
+class EmbeddingPipelineTests(unittest.TestCase):
+    def test_deduplicate(self):
+        unique, references = deduplicate(["a", "b", "a", "c", "b"])
+        self.assertEqual(unique, ["a", "b", "c"])
+        self.assertEqual(references, [0, 1, 0, 2, 1])
+
+    def test_batches_respect_the_budget(self):
+        texts = ["x" * 400, "x" * 400, "x" * 4000, "x" * 40]
+        # about 101, 101, 1001 and 11 tokens
+        self.assertEqual(pack_batches(texts, max_tokens=300), [[0, 1], [2], [3]])
+        self.assertEqual(pack_batches(texts, max_tokens=10_000, max_items=3), [[0, 1, 2], [3]])
+
+    def test_identical_texts_are_embedded_once(self):
+        service = BatchRecorder()
+        result = embed_texts(service, ["a", "bb", "a", "a"], progress=False)
+        self.assertEqual(result, [[1.0], [2.0], [1.0], [1.0]])
+        self.assertEqual(sum(len(batch) for batch in service.batches), 2)
+
+    def test_human_answers_are_embedded_once_each(self):
+        service = BatchRecorder()
+        replies = {"llama": [[0, ["yes", "no", "yes"]]], "human": [[0, [["ok", "ok", "ok"], ["fine"] * 3]]]}
+        with tempfile.TemporaryDirectory() as directory:
+            store = embed_replies_if_not_cached(service, replies, EmbeddingStore(directory))
+            self.assertEqual(len(store), 5)
+            self.assertEqual(sorted(t for batch in service.batches for t in batch), ["fine", "no", "ok", "yes"])
+            self.assertEqual(store.get([("human", 0, 1)])[0][0], 4.0)
+
+    def test_repeated_human_answers_are_embedded_again(self):
+        replies = {"human": [[0, [["ok", "ok", "ok"], ["fine"] * 3]]]}
+        with tempfile.TemporaryDirectory() as directory:
+            # a store with every copy of the answers
+            store = EmbeddingStore(directory)
+            store.extend([("human", 0, sample) for sample in range(6)], [[2.0]] * 3 + [[4.0]] * 3)
+            store = embed_replies_if_not_cached(BatchRecorder(), replies, EmbeddingStore(directory))
+            self.assertEqual(store.keys, [("human", 0, 0), ("human", 0, 1)])
+            self.assertEqual(store.get(store.keys).ravel().tolist(), [2.0, 4.0])
+
+if __name__ == '__main__':
+    unittest.main()
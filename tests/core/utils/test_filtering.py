@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import pandas
+
+from core.utils import remove_sensitive_rows, find_sensitive_rows
+from core.utils.llm import LlmService
+
+
+class FilterService(LlmService):
+    def __init__(self, bad, together=()):
+        self.bad = set(bad)
+        # rejected only when all of them are in the batch
+        self.together = set(together)
+        self.calls = 0
+
+    def check(self, text) -> (bool, object):
+        self.calls += 1
+        rejected = self.bad.intersection(text) or (self.together and self.together.issubset(text))
+        return (False, "content_filter") if rejected else (True, {})
+
+
+class RemoveSensitiveRowsTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, "rows.json")
+        self.dataset = pandas.DataFrame({"question": [f"q{i}" for i in range(100)]})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_finds_every_rejected_row(self):
+        service = FilterService(["q3", "q40", "q41", "q99"])
+        rows = remove_sensitive_rows(self.dataset, self.cache_file, service, batch_size=16)
+        self.assertEqual(rows, [3, 40, 41, 99])
+        # far less than a call per row
+        self.assertLess(service.calls, 40)
+        with open(self.cache_file) as f:
+            self.assertEqual(json.load(f), rows)
+
+    def test_rows_rejected_only_together_are_kept(self):
+        service = FilterService(["q3"], together=["q8", "q9"])
+        self.assertEqual(remove_sensitive_rows(self.dataset, self.cache_file, service, batch_size=16), [3])
+
+    def test_cache_file_is_reused(self):
+        remove_sensitive_rows(self.dataset, self.cache_file, FilterService(["q1"]))
+        service = FilterService([])
+        self.assertEqual(remove_sensitive_rows(self.dataset, self.cache_file, service), [1])
+        self.assertEqual(service.calls, 0)
+
+    def test_interrupted_scan_resumes(self):
+        progress_file = self.cache_file + ".partial"
+        with open(progress_file, 'w') as f:
+            f.write(json.dumps({"start": 0, "end": 50, "remove": [7]}) + "\n")
+        service = FilterService(["q60"])
+        rows = asyncio.run(find_sensitive_rows(self.dataset["question"].tolist(), progress_file, service, 50))
+        self.assertEqual(rows, [7, 60])
+
+    def test_resume_with_another_batch_size_checks_every_row(self):
+        progress_file = self.cache_file + ".partial"
+        with open(progress_file, 'w') as f:
+            for start in (0, 16, 32):
+                f.write(json.dumps({"start": start, "end": start + 16, "remove": []}) + "\n")
+        service = FilterService(["q50", "q70"])
+        rows = asyncio.run(find_sensitive_rows(self.dataset["question"].tolist(), progress_file, service, 32))
+        self.assertEqual(rows, [50, 70])
+
+    def test_torn_verdict_is_checked_again(self):
+        progress_file = self.cache_file + ".partial"
+        with open(progress_file, 'w') as f:
+            f.write(json.dumps({"start": 0, "end": 50, "remove": [7]}) + "\n" + '{"start": 50, "end')
+        questions = self.dataset["question"].tolist()
+        self.assertEqual(asyncio.run(find_sensitive_rows(questions, progress_file, FilterService(["q60"]), 50)),
+                         [7, 60])
+        # the verdicts written after the torn line are read back
+        service = FilterService([])
+        self.assertEqual(asyncio.run(find_sensitive_rows(questions, progress_file, service, 50)), [7, 60])
+        self.assertEqual(service.calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+
+import pandas
+
+from core.utils import produce_response_for
+from core.utils.llm import LlmService
+
+
+class SlowService(LlmService):
+    def __init__(self, failing=None):
+        self.failing = failing
+        self.in_flight = 0
+        self.peak = 0
+
+    async def acomplete(self, text: str, max_output: int) -> str:
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        # later questions finish first, the result must still follow the dataset order
+        await asyncio.sleep(0.01 / (len(text) + 1))
+        self.in_flight -= 1
+        if text == self.failing:
+            raise ValueError("failure")
+        return f"reply to {text}"
+
+
+class ProduceResponseTests(unittest.TestCase):
+    def setUp(self):
+        self.dataset = pandas.DataFrame({"question": ["a", "bb", "ccc", "dddd"]}, index=[10, 3, 7, 1])
+
+    def test_order_and_shape(self):
+        result = produce_response_for(SlowService(), self.dataset, max_tokens=5, how_many=3, concurrency=4)
+        self.assertEqual([row for row, _ in result], [10, 3, 7, 1])
+        self.assertEqual(result[1][1], ["reply to bb"] * 3)
+
+    def test_concurrency_limit(self):
+        service = SlowService()
+        produce_response_for(service, self.dataset, how_many=1, concurrency=2)
+        self.assertEqual(service.peak, 2)
+
+    def test_samples_of_a_question_run_together(self):
+        service = SlowService()
+        produce_response_for(service, self.dataset, how_many=3, concurrency=1)
+        self.assertEqual(service.peak, 3)
+
+    def test_failing_question_is_dropped(self):
+        result = produce_response_for(SlowService(failing="ccc"), self.dataset, how_many=2, concurrency=8)
+        self.assertEqual([row for row, _ in result], [10, 3, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from core.utils.index import IvfIndex, exact_search
+from core.utils.store import EmbeddingStore
+
+
+class IvfIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(20, 16))
+        self.vectors = (np.repeat(centers, 30, axis=0) + rng.normal(scale=0.2, size=(600, 16))).astype(np.float32)
+        self.keys = [("human" if i % 3 == 0 else "gpt", i // 3, i % 3) for i in range(600)]
+        self.store = EmbeddingStore(self.directory.name)
+        self.store.extend(self.keys, self.vectors)
+        self.queries = self.vectors[::37] + 0.01
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def recall(self, found, exact):
+        return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, exact)])
+
+    def test_probing_every_list_is_exact(self):
+        index = IvfIndex(self.store, lists=10)
+        index.update()
+        distances, offsets = index.search(self.queries, k=5, probes=10)
+        exact_distances, exact_offsets = exact_search(self.store.matrix(), self.queries, k=5)
+        np.testing.assert_array_equal(offsets, exact_offsets)
+        np.testing.assert_allclose(distances, exact_distances, atol=1e-5)
+
+    def test_recall_with_few_probes(self):
+        index = IvfIndex(self.store, lists=20, metric="euclidean")
+        index.update()
+        _, offsets = index.search(self.queries, k=10, probes=3)
+        _, exact = exact_search(self.store.matrix(), self.queries, k=10, metric="euclidean")
+        self.assertGreater(self.recall(offsets, exact), 0.9)
+
+    def test_mode_filter(self):
+        index = IvfIndex(self.store, lists=10)
+        index.update()
+        _, offsets = index.search(self.queries, k=5, modes=["human"], probes=10)
+        self.assertTrue(all(self.store.keys[offset][0] == "human" for offset in offsets.ravel()))
+        humans = [i for i, key in enumerate(self.keys) if key[0] == "human"]
+        _, exact = exact_search(self.store.matrix(), self.queries, k=5, candidates=humans)
+        np.testing.assert_array_equal(offsets, exact)
+
+    def test_incremental_insertion_is_persisted(self):
+        index = IvfIndex(self.store, lists=10)
+        self.assertEqual(index.update(), 600)
+        self.store.extend([("llama", 0, 0)], self.queries[:1])
+        reopened = IvfIndex(self.store)
+        self.assertEqual(len(reopened), 600)
+        self.assertEqual(reopened.update(), 1)
+        [[(key, distance), *_]] = IvfIndex(self.store).neighbors([("llama", 0, 0)], k=3, modes=["llama"])
+        self.assertEqual(key, ("llama", 0, 0))
+        self.assertAlmostEqual(distance, 0, places=5)
+
+    def test_an_index_of_a_rewritten_store_is_trained_again(self):
+        # saved outside of the store directory, so the drop does not delete it
+        elsewhere = tempfile.TemporaryDirectory()
+        self.addCleanup(elsewhere.cleanup)
+        filename = os.path.join(elsewhere.name, "ivf.npz")
+        IvfIndex(self.store, filename, lists=10).update()
+        # as many rows as before, in another order
+        self.store.drop("human")
+        humans = [i for i, key in enumerate(self.keys) if key[0] == "human"]
+        self.store.extend([self.keys[i] for i in humans], self.vectors[humans])
+        index = IvfIndex(self.store, filename, lists=10)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.update(), 600)
+        _, offsets = index.search(self.queries, k=5, modes=["human"], probes=10)
+        self.assertTrue(all(self.store.keys[offset][0] == "human" for offset in offsets.ravel()))
+
+
+if __name__ == '__main__':
+    unittest.main()
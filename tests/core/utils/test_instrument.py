@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from core.utils import produce_response_for
+from core.utils.instrument import InstrumentedService, Telemetry
+from core.utils.llm import KeyLoader, OllamaService, OpenAiService
+from core.utils.llm.mock_server import MockServer
+from core.utils.llm.ratelimit import RateLimiter
+
+
+class StaticKey(KeyLoader):
+    def key(self) -> str:
+        return "key"
+
+
+def limiter(retries=10):
+    return RateLimiter(max_retries=retries, base_delay=0.01, max_delay=0.05)
+
+
+class InstrumentedServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.directory.name, "telemetry", "requests.jsonl")
+        self.metrics = os.path.join(self.directory.name, "telemetry", "llm.prom")
+        self.telemetry = Telemetry(self.log, self.metrics)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def records(self):
+        self.telemetry.close()
+        with open(self.log) as f:
+            return [json.loads(line) for line in f]
+
+    def test_tokens_and_retries_are_recorded(self):
+        with MockServer(latency=0.001, rate_limit_rate=0.3, retry_after=0.01) as server:
+            azure = OpenAiService(StaticKey(), server.url, "gpt", "2024-02-01", "gpt-35", limiter())
+            ollama = InstrumentedService(OllamaService("llama3", limiter(), host=server.url), self.telemetry, "llama")
+            InstrumentedService(azure, self.telemetry, "azure").complete_many("Hello there", 10, 3)
+            dataset = pd.DataFrame({"question": [f"question {i}" for i in range(10)]})
+            produce_response_for(ollama, dataset, max_tokens=5, how_many=2, concurrency=4)
+            ollama.embedChucks(["a", "b"])
+            limited = sum(count for (_, status), count in server.requests.items() if status == 429)
+        records = self.records()
+        self.assertEqual(len(records), 1 + 10 + 1)
+        self.assertEqual(records[0]["service"], "azure")
+        self.assertEqual(records[0]["model"], "gpt-35")
+        self.assertEqual((records[0]["items"], records[0]["completion_tokens"]), (3, 30))
+        completions = [r for r in records if r["service"] == "llama" and r["operation"] == "complete"]
+        self.assertEqual(sum(r["items"] for r in completions), 10 * 2)
+        self.assertEqual(sum(r["completion_tokens"] for r in completions), 10 * 2 * 5)
+        self.assertTrue(all(r["prompt_tokens"] > 0 for r in records[:-1]))
+        # the Ollama embeddings endpoint reports no usage
+        self.assertIsNone(records[-1]["prompt_tokens"])
+        self.assertTrue(all(r["latency"] > 0 and r["error"] is None for r in records))
+        self.assertEqual(sum(r["retries"] for r in records), limited)
+
+    def test_errors_and_rejections(self):
+        with MockServer(error_rate=1.0) as server:
+            service = InstrumentedService(OllamaService("llama3", limiter(0), host=server.url), self.telemetry)
+            with self.assertRaises(Exception):
+                asyncio.run(service.acomplete("Hello", 5))
+        with MockServer() as server:
+            azure = OpenAiService(StaticKey(), server.url, "gpt", "2024-02-01", "gpt-35", limiter())
+            InstrumentedService(azure, self.telemetry, "azure").check(["an unsafe question"])
+        records = self.records()
+        self.assertEqual([(r["service"], r["error"]) for r in records], [("llama3", "ResponseError"),
+                                                                        ("azure", "Rejected")])
+
+    def test_prometheus_textfile(self):
+        with MockServer(error_rate=0.5, seed=1) as server:
+            service = InstrumentedService(OllamaService("llama3", limiter(0), host=server.url), self.telemetry,
+                                          "llama")
+            failures = 0
+            for _ in range(20):
+                try:
+                    service.complete("Hello", 5)
+                except Exception:
+                    failures += 1
+        self.telemetry.close()
+        with open(self.metrics) as f:
+            metrics = f.read()
+        labels = 'service="llama",model="llama3",operation="complete"'
+        self.assertIn(f"llm_requests_total{{{labels}}} 20\n", metrics)
+        self.assertIn(f'llm_errors_total{{{labels},error="ResponseError"}} {failures}\n', metrics)
+        self.assertIn(f'llm_latency_seconds_bucket{{{labels},le="+Inf"}} 20\n', metrics)
+        self.assertIn("# TYPE llm_latency_seconds histogram", metrics)
+        self.assertFalse(os.path.exists(self.metrics + ".tmp"))
+
+    def test_streams_record_the_first_token_and_the_rate(self):
+        with MockServer(latency=0.02, per_token=0.005, ignore_limit=True) as server:
+            service = InstrumentedService(OllamaService("llama3", limiter(), host=server.url), self.telemetry)
+            self.assertEqual(len(service.complete("Hello", 10).split()), 10)
+            stream = service.stream("Hello", 10)
+            next(stream)
+            stream.close()
+        complete, cancelled = self.records()
+        self.assertTrue(complete["truncated"])
+        self.assertEqual(complete["completion_tokens"], 10)
+        self.assertGreaterEqual(complete["ttft"], 0.02)
+        self.assertLess(complete["ttft"], complete["latency"])
+        self.assertGreater(complete["tokens_per_second"], 0)
+        self.assertEqual((cancelled["operation"], cancelled["cancelled"]), ("stream", True))
+        self.assertEqual(cancelled["completion_tokens"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+import pandas as pd
+
+from core.utils.merge import human_replies, long_replies, wide_view, with_responses
+
+
+class MergeTests(unittest.TestCase):
+    def setUp(self):
+        self.dataset = pd.DataFrame({
+            "question": ["q1", "q2", "q3"],
+            "human_answers": [["h1"], ["h2", "h2b"], ["h3"]],
+        }, index=[10, 20, 30])
+        self.replies = {
+            "llama": [(20, ["l2a", "l2b"]), (10, ["l1a", "l1b"])],
+            "gpt": [(30, ["g3"])],
+            "human": human_replies(self.dataset),
+        }
+
+    def test_long_format(self):
+        long = long_replies(self.dataset, self.replies)
+        self.assertEqual(list(long.columns), ["question_id", "source", "sample_idx", "text"])
+        llama = long[long["source"] == "llama"]
+        self.assertEqual(list(zip(llama["question_id"], llama["sample_idx"], llama["text"])),
+                         [(10, 0, "l1a"), (10, 1, "l1b"), (20, 0, "l2a"), (20, 1, "l2b")])
+        # the human answers come from the dataset, once each
+        self.assertEqual(list(long[long["source"] == "human"]["text"]), ["h1", "h2", "h2b", "h3"])
+
+    def test_wide_views(self):
+        long = long_replies(self.dataset, self.replies)
+        self.assertEqual(wide_view(long, ["llama"])["llama_response"].to_dict(),
+                         {10: ["l1a", "l1b"], 20: ["l2a", "l2b"]})
+        merged = with_responses(self.dataset, long)
+        self.assertEqual(sorted(merged.columns), ["gpt_response", "human_answers", "llama_response", "question"])
+        self.assertIsNone(merged.at[30, "llama_response"])
+        self.assertEqual(merged.at[30, "gpt_response"], ["g3"])
+
+    def test_service_without_replies_keeps_its_column(self):
+        long = long_replies(self.dataset, {**self.replies, "mistral": []})
+        self.assertEqual(long["question_id"].dtype, self.dataset.index.dtype)
+        merged = with_responses(self.dataset, long)
+        self.assertEqual(merged["mistral_response"].tolist(), [None, None, None])
+        self.assertEqual(merged.at[10, "llama_response"], ["l1a", "l1b"])
+
+    def test_human_replies_are_keyed_by_label(self):
+        self.assertEqual(human_replies(self.dataset)[1], [20, [["h2"] * 3, ["h2b"] * 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
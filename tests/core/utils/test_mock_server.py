@@ -0,0 +1,131 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from core.utils import produce_response_for, remove_sensitive_rows
+from core.utils.checkpoint import ReplyLog
+from core.utils.llm import KeyLoader, OllamaService, OpenAiService
+from core.utils.llm.mock_server import MockServer
+from core.utils.llm.ratelimit import RateLimiter
+
+
+class StaticKey(KeyLoader):
+    def key(self) -> str:
+        return "key"
+
+
+def limiter():
+    return RateLimiter(max_retries=10, base_delay=0.01, max_delay=0.05)
+
+
+class MockServerTests(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(latency=0.001, rate_limit_rate=0.2, retry_after=0.01).start()
+        self.azure = OpenAiService(StaticKey(), self.server.url, "gpt", "2024-02-01", "gpt-35", limiter())
+        self.ollama = OllamaService("llama3", limiter(), host=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_azure_endpoints(self):
+        self.assertEqual(len(self.azure.complete_many("Hello", 10, 3)), 3)
+        self.assertEqual(len(self.azure.embedChucks(["a", "b"])), 2)
+        self.assertEqual(self.azure.embed("a"), self.azure.embed("a"))
+        self.assertTrue(self.azure.check(["a safe question"])[0])
+        self.assertFalse(self.azure.check(["a safe question", "an unsafe one"])[0])
+
+    def test_ollama_endpoints(self):
+        self.assertTrue(self.ollama.complete("Hello", 5).startswith("reply0"))
+        self.assertEqual(len(self.ollama.embed("Hello")), self.server.dim)
+        self.assertEqual(self.ollama.footprint(), self.server.models["llama3:latest"])
+        # one async client per event loop
+        for _ in range(2):
+            self.assertEqual(len(asyncio.run(self.ollama.aembedChucks(["a", "b"]))), 2)
+
+    def test_loading_and_unloading_are_retried(self):
+        for _ in range(5):
+            self.ollama.warm_up()
+            self.ollama.release()
+        self.assertTrue(any(status == 429 for path, status in self.server.requests if path == "/api/generate"))
+
+    def test_rate_limited_requests_are_retried(self):
+        dataset = pd.DataFrame({"question": [f"question {i}" for i in range(20)]})
+        replies = produce_response_for(self.ollama, dataset, max_tokens=5, how_many=2, concurrency=4)
+        self.assertEqual(len(replies), 20)
+        self.assertTrue(any(status == 429 for _, status in self.server.requests))
+
+    def test_safety_filter(self):
+        questions = [f"question {i}" for i in range(40)]
+        questions[7] = questions[29] = "an unsafe question"
+        with tempfile.TemporaryDirectory() as directory:
+            removed = remove_sensitive_rows(pd.DataFrame({"question": questions}),
+                                            os.path.join(directory, "rows.json"), self.azure, batch_size=8)
+        self.assertEqual(removed, [7, 29])
+
+
+class StreamingTests(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(latency=0.001, per_token=0.002, ignore_limit=True).start()
+        self.azure = OpenAiService(StaticKey(), self.server.url, "gpt", "2024-02-01", "gpt-35", limiter())
+        self.ollama = OllamaService("llama3", limiter(), host=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_streams_are_cut_at_the_budget(self):
+        for service in [self.azure, self.ollama]:
+            pieces = list(service.stream("Hello there", 5))
+            self.assertEqual(len(pieces), 5)
+            self.assertTrue(pieces[0].startswith("reply0"))
+
+        async def collect(service):
+            return [piece async for piece in service.astream("Hello there", 3)]
+        for service in [self.azure, self.ollama]:
+            self.assertEqual(len(asyncio.run(collect(service))), 3)
+        # Ollama completions go through the stream
+        self.assertEqual(len(self.ollama.complete("Hello there", 4).split()), 4)
+        time.sleep(0.2)
+        self.assertEqual(self.server.cancelled, 5)
+
+    def test_generation_records_the_timing_of_the_replies(self):
+        self.server.ignore_limit = False
+        dataset = pd.DataFrame({"question": ["first question", "second question"]})
+        with tempfile.TemporaryDirectory() as directory:
+            log = ReplyLog(os.path.join(directory, "data.log.jsonl"))
+            replies = produce_response_for(self.azure, dataset, max_tokens=5, how_many=3, log=log, name="azure")
+            # one reply per choice
+            self.assertTrue(all(len(set(samples)) == 3 for _, samples in replies))
+            produce_response_for(self.ollama, dataset, max_tokens=5, how_many=3, log=log, name="ollama")
+            log.close()
+            records = [record for service in log.entries.values() for row in service.values()
+                       for record in row.values()]
+        self.assertEqual(len(records), 2 * 2 * 3)
+        self.assertTrue(all(0 < record["ttft"] and record["tokens_per_second"] > 0 for record in records))
+        # the three choices of an Azure question come from one streamed request
+        self.assertEqual(self.server.requests[("/openai/deployments/gpt/chat/completions", 200)], 2)
+
+    def test_concurrent_samples_are_timed_apart(self):
+        self.server.ignore_limit = False
+        dataset = pd.DataFrame({"question": ["first question"]})
+        with tempfile.TemporaryDirectory() as directory:
+            log = ReplyLog(os.path.join(directory, "data.log.jsonl"))
+            produce_response_for(self.ollama, dataset, max_tokens=20, how_many=3, log=log, name="ollama")
+            log.close()
+        # the rate of one stream (at most a token every `per_token`), not the sum of the three
+        rates = [record["tokens_per_second"] for record in log.entries["ollama"][0].values()]
+        self.assertEqual(len(rates), 3)
+        self.assertTrue(all(0 < rate < 1.2 / self.server.per_token for rate in rates))
+
+    def test_num_predict_limits_the_reply(self):
+        self.server.ignore_limit = False
+        self.assertEqual(len(self.ollama.complete("Hello there", 7).split()), 7)
+        self.assertEqual(len(asyncio.run(self.ollama.acomplete("Hello there", 2)).split()), 2)
+        self.assertEqual(self.server.cancelled, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
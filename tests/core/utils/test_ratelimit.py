@@ -0,0 +1,144 @@
+import asyncio
+import email.utils
+import time
+import unittest
+
+from core.utils.llm.ratelimit import RateLimiter, retry_after_seconds
+
+
+class Busy(Exception):
+    pass
+
+
+def classify(error):
+    return isinstance(error, Busy), isinstance(error, Busy), None
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_retries_until_success(self):
+        limiter = RateLimiter(base_delay=0.001, max_concurrency=8)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise Busy()
+            return "ok"
+
+        self.assertEqual(limiter.call(flaky, classify), "ok")
+        self.assertEqual(len(attempts), 3)
+        # two rate limited answers halve the concurrency twice
+        self.assertLess(limiter.limit, 8 / 2)
+
+    def test_gives_up_after_max_retries(self):
+        limiter = RateLimiter(base_delay=0.001, max_retries=2)
+
+        def failing():
+            raise Busy()
+
+        with self.assertRaises(Busy):
+            limiter.call(failing, classify)
+
+    def test_not_retryable_errors_are_raised(self):
+        limiter = RateLimiter(base_delay=0.001)
+        attempts = []
+
+        def failing():
+            attempts.append(1)
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            limiter.call(failing, classify)
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_additive_increase(self):
+        limiter = RateLimiter(max_concurrency=10)
+        limiter.limit = 2
+        limiter.call(lambda: None, classify)
+        self.assertAlmostEqual(limiter.limit, 2.5)
+
+    def test_requests_per_minute(self):
+        limiter = RateLimiter(requests_per_minute=600)
+        limiter.requests.level = 0
+        start = time.monotonic()
+        limiter.call(lambda: None, classify)
+        # 10 requests per second, the first one waits for a token
+        self.assertGreater(time.monotonic() - start, 0.05)
+
+    def test_exhausted_quota_pauses(self):
+        limiter = RateLimiter(requests_per_minute=600)
+        limiter.observe({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "150ms"})
+        self.assertEqual(limiter.requests.level, 0)
+        self.assertGreater(limiter.paused_until, time.monotonic())
+
+    def test_concurrency_limit(self):
+        limiter = RateLimiter(max_concurrency=2)
+        peak = []
+
+        async def request():
+            peak.append(limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*[limiter.acall(request, classify) for _ in range(6)])
+
+        asyncio.run(run())
+        self.assertEqual(max(peak), 2)
+
+    def test_streams_hold_the_slot_until_the_end(self):
+        limiter = RateLimiter(max_concurrency=2)
+        peak = []
+
+        async def pieces():
+            for piece in range(3):
+                peak.append(limiter.in_flight)
+                await asyncio.sleep(0.01)
+                yield piece
+
+        async def consume():
+            return [piece async for piece in limiter.astream(pieces, classify)]
+
+        async def run():
+            return await asyncio.gather(*[consume() for _ in range(6)])
+
+        self.assertEqual(asyncio.run(run()), [[0, 1, 2]] * 6)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(limiter.in_flight, 0)
+        # closed before the end
+        stream = limiter.stream(lambda: (piece for piece in range(3)), classify)
+        next(stream)
+        self.assertEqual(limiter.in_flight, 1)
+        stream.close()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_streams_retry_only_before_the_first_piece(self):
+        limiter = RateLimiter(base_delay=0.001, max_concurrency=8)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 2:
+                raise Busy()
+            yield "first"
+            raise Busy()
+
+        stream = limiter.stream(flaky, classify)
+        self.assertEqual(next(stream), "first")
+        with self.assertRaises(Busy):
+            next(stream)
+        self.assertEqual((len(attempts), limiter.in_flight), (2, 0))
+        # the failure in the middle of the stream slows down the next ones too
+        self.assertLess(limiter.limit, 8 / 2)
+
+    def test_retry_after_seconds_or_date(self):
+        self.assertEqual(retry_after_seconds("2.5"), 2.5)
+        self.assertAlmostEqual(retry_after_seconds(email.utils.formatdate(time.time() + 30, usegmt=True)), 30,
+                               delta=2)
+        self.assertEqual(retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+        self.assertIsNone(retry_after_seconds("soon"))
+        self.assertIsNone(retry_after_seconds(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
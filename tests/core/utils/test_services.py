@@ -1,8 +1,10 @@
 import unittest
-from unittest.mock import patch
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
 import ollama
 
 from core.utils import OllamaService
+from core.utils.llm import OpenAiService, KeyLoader
 
 
 class OllamaServiceTests(unittest.TestCase):
@@ -31,5 +33,55 @@ class OllamaServiceTests(unittest.TestCase):
         max_output = 1
         result = self.service.complete(text, max_output)
         self.assertIsNotNone(result)
+
+
+class StaticKey(KeyLoader):
+    def key(self) -> str:
+        return "key"
+
+
+def completion(*contents):
+    parsed = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=c)) for c in contents])
+    return SimpleNamespace(headers={}, parse=lambda: parsed)
+
+
+class OpenAiServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.service = OpenAiService(StaticKey(), "http://localhost", "deployment", "2024-02-01", "model")
+        self.service.service = MagicMock()
+
+    def test_complete_many_uses_n(self):
+        self.service.service.chat.completions.with_raw_response.create.return_value = completion("a", "b", "c")
+        result = self.service.complete_many("Hello", 10, 3)
+        self.assertEqual(result, ["a", "b", "c"])
+        self.assertEqual(self.service.service.chat.completions.with_raw_response.create.call_args.kwargs["n"], 3)
+
+    def test_complete_many_asks_again_missing_choices(self):
+        self.service.service.chat.completions.with_raw_response.create.side_effect = [completion("a", None, "c"), completion("b")]
+        result = self.service.complete_many("Hello", 10, 3)
+        self.assertEqual(result, ["a", "c", "b"])
+        self.assertEqual(self.service.service.chat.completions.with_raw_response.create.call_args.kwargs["n"], 1)
+
+    def test_retry_after_as_a_date_is_parsed(self):
+        import httpx
+        from openai import RateLimitError
+
+        def limited(retry_after):
+            response = httpx.Response(429, headers={"retry-after": retry_after},
+                                      request=httpx.Request("POST", "http://localhost"))
+            return RateLimitError("limited", response=response, body=None)
+        self.assertEqual(OpenAiService._classify(limited("Wed, 21 Oct 2015 07:28:00 GMT")), (True, True, 0))
+        self.assertEqual(OpenAiService._classify(limited("later")), (True, True, None))
+        self.assertEqual(OpenAiService._classify(limited("3")), (True, True, 3))
+
+    def test_key_and_clients_are_loaded_on_first_use(self):
+        loader = MagicMock(spec=KeyLoader)
+        loader.key.return_value = "key"
+        service = OpenAiService(loader, "http://localhost", "deployment", "2024-02-01", "model")
+        loader.key.assert_not_called()
+        service.service
+        loader.key.assert_called_once()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from core.utils.stages import Stage, StageRunner
+
+
+class StageRunnerTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self.directory.name, "state.json")
+        self.dataset = self.path("dataset.txt")
+        self.services = {"a": {"model": "a"}, "b": {"model": "b"}}
+        self.write(self.dataset, "questions")
+        self.calls = []
+        self.refreshed = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def stages(self, barrier=None):
+        def replies(partitions):
+            self.calls.append(("replies", sorted(partitions)))
+            with open(self.path("replies.json"), 'w') as f:
+                json.dump({service: f"replies of {service}" for service in self.services}, f)
+
+        def embed(name):
+            def action(partitions):
+                if barrier is not None:
+                    # both embedding stages must be running at the same time
+                    barrier.wait()
+                self.calls.append((name, sorted(partitions)))
+                self.write(self.path(f"{name}.out"), "")
+            return action
+
+        def modes():
+            with open(self.path("replies.json")) as f:
+                return json.load(f)
+
+        return [
+            Stage("replies", replies, inputs=[self.dataset], outputs=[self.path("replies.json")],
+                  partitions=lambda: dict(self.services), refresh=lambda service: self.refreshed.append(service)),
+            Stage("embed-questions", embed("embed-questions"), inputs=[self.dataset],
+                  outputs=[self.path("embed-questions.out")]),
+            Stage("embed-replies", embed("embed-replies"), after=["replies"], partitions=modes,
+                  outputs=[self.path("embed-replies.out")]),
+        ]
+
+    def run_stages(self, **kwargs):
+        return StageRunner(self.state, self.stages(), **kwargs).run()
+
+    def test_only_the_changed_partitions_run_again(self):
+        self.assertEqual(self.run_stages(), {"replies": ["a", "b"], "embed-questions": ["all"],
+                                             "embed-replies": ["a", "b"]})
+        self.assertEqual(self.run_stages(), {"replies": [], "embed-questions": [], "embed-replies": []})
+        self.services["b"] = {"model": "b", "temperature": 0.5}
+        self.services["c"] = {"model": "c"}
+        ran = self.run_stages()
+        self.assertEqual(ran["replies"], ["b", "c"])
+        self.assertEqual(ran["embed-questions"], [])
+        # only the replies of c are new, the ones of b are the same text
+        self.assertEqual(ran["embed-replies"], ["c"])
+        self.assertEqual(self.refreshed, ["b"])
+
+    def test_changed_inputs_and_missing_outputs(self):
+        self.run_stages()
+        self.write(self.dataset, "other questions")
+        ran = self.run_stages()
+        self.assertEqual((ran["replies"], ran["embed-questions"]), (["a", "b"], ["all"]))
+        os.remove(self.path("embed-questions.out"))
+        runner = StageRunner(self.state, self.stages())
+        self.assertEqual(runner.plan(), {"replies": [], "embed-questions": ["all"], "embed-replies": []})
+        self.assertEqual(runner.run(only=["embed-questions"]), {"embed-questions": ["all"]})
+
+    def test_independent_stages_run_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+        StageRunner(self.state, self.stages(barrier)).run(only=["embed-questions", "embed-replies"])
+        self.assertEqual(self.calls[0], ("replies", ["a", "b"]))
+        self.assertEqual({name for name, _ in self.calls[1:]}, {"embed-questions", "embed-replies"})
+
+    def test_a_failure_stops_the_dependent_stages(self):
+        stages = self.stages()
+        stages[0].action = lambda partitions: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            StageRunner(self.state, stages, workers=1).run()
+        self.assertNotIn("embed-replies", [name for name, _ in self.calls])
+        # nothing is recorded for the failed stage
+        self.assertEqual(StageRunner(self.state, self.stages()).run()["replies"], ["a", "b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from core.utils.store import EmbeddingStore
+
+
+class EmbeddingStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+        self.keys = [("a", 0, 0), ("a", 0, 1), ("b", 0, 0), ("a", 1, 0)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_append_and_reopen(self):
+        store = EmbeddingStore(self.directory.name)
+        store.extend(self.keys[:2], self.vectors[:2])
+        store.extend(self.keys[2:], self.vectors[2:])
+        reopened = EmbeddingStore(self.directory.name)
+        self.assertEqual(len(reopened), 4)
+        self.assertIn(("b", 0, 0), reopened)
+        np.testing.assert_array_equal(reopened.matrix(), self.vectors)
+        self.assertEqual(reopened.modes(), ["a", "b"])
+
+    def test_mode_matrix(self):
+        store = EmbeddingStore(self.directory.name)
+        store.extend(self.keys, self.vectors)
+        np.testing.assert_array_equal(store.mode_matrix("a"), self.vectors[[0, 1, 3]])
+        # contiguous rows are a view on the memory map
+        self.assertIsInstance(store.get(self.keys[:2]), np.memmap)
+
+    def test_float16(self):
+        store = EmbeddingStore(self.directory.name, dtype="float16")
+        store.extend(self.keys, self.vectors)
+        self.assertEqual(EmbeddingStore(self.directory.name).matrix().dtype, np.float16)
+
+    def test_unindexed_vectors_are_dropped(self):
+        store = EmbeddingStore(self.directory.name)
+        store.extend(self.keys[:2], self.vectors[:2])
+        # a crash after writing the vectors and in the middle of the index
+        with open(os.path.join(self.directory.name, "vectors.bin"), 'ab') as f:
+            f.write(self.vectors[2:].tobytes())
+        with open(os.path.join(self.directory.name, "index.jsonl"), 'a') as f:
+            f.write('["b", 0')
+        store = EmbeddingStore(self.directory.name)
+        self.assertEqual(len(store), 2)
+        store.extend(self.keys[2:], self.vectors[2:])
+        np.testing.assert_array_equal(EmbeddingStore(self.directory.name).matrix(), self.vectors)
+
+    def test_drop_a_mode(self):
+        store = EmbeddingStore(self.directory.name)
+        store.extend(self.keys, self.vectors)
+        store.drop("a")
+        self.assertEqual(store.keys, [("b", 0, 0)])
+        np.testing.assert_array_equal(EmbeddingStore(self.directory.name).matrix(), self.vectors[[2]])
+        store.extend([("a", 0, 0)], self.vectors[:1])
+        np.testing.assert_array_equal(EmbeddingStore(self.directory.name).get([("a", 0, 0)]), self.vectors[:1])
+
+    def test_drop_discards_the_index(self):
+        from core.utils.index import IvfIndex
+
+        store = EmbeddingStore(self.directory.name)
+        store.extend(self.keys, self.vectors)
+        IvfIndex(store, lists=2).update()
+        store.drop("a")
+        index = IvfIndex(store, lists=1)
+        self.assertEqual(index.update(), 1)
+        _, offsets = index.search(self.vectors[2], k=2)
+        self.assertEqual(offsets.tolist(), [[0, -1]])
+        self.assertEqual(index.neighbors([("b", 0, 0)], modes=["a"]), [[]])
+
+    def test_interrupted_drop(self):
+        store = EmbeddingStore(self.directory.name)
+        store.extend(self.keys, self.vectors)
+        index = os.path.join(self.directory.name, "index.jsonl")
+        # the vectors were swapped, the index was not
+        with open(index + ".tmp", 'w') as f:
+            f.write('["b", 0, 0]\n')
+        with open(os.path.join(self.directory.name, "vectors.bin"), 'wb') as f:
+            f.write(self.vectors[2].tobytes())
+        np.testing.assert_array_equal(EmbeddingStore(self.directory.name).matrix(), self.vectors[[2]])
+        # the temporaries of a rewrite that did not reach the swap are discarded
+        with open(os.path.join(self.directory.name, "vectors.bin.tmp"), 'wb') as f:
+            f.write(b"partial")
+        self.assertEqual(len(EmbeddingStore(self.directory.name)), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "vectors.bin.tmp")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from core.utils import store_pandas_in
+from core.utils.table import load_dataset_file, read_table
+
+
+class TableTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "datasets", "dataset")
+        self.dataset = pd.DataFrame({
+            "question": [f"q{i}" for i in range(10)],
+            "source": ["reddit", "medicine"] * 5,
+            "human_answers": [[f"a{i}", f"b{i}"] for i in range(10)],
+            "llama_response": [[f"r{i}"] * 3 if i % 3 else None for i in range(10)],
+        }, index=range(100, 0, -10))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parquet_only_by_default(self):
+        store_pandas_in(self.dataset, self.filename)
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ["dataset.parquet"])
+        store_pandas_in(self.dataset, self.filename, formats=("csv", "json", "pkl"))
+        self.assertEqual(len(os.listdir(os.path.dirname(self.filename))), 4)
+
+    def test_lists_and_index_round_trip(self):
+        store_pandas_in(self.dataset, self.filename)
+        loaded = read_table(self.filename + ".parquet")
+        self.assertListEqual(list(loaded.index), list(self.dataset.index))
+        self.assertEqual(list(loaded.at[90, "human_answers"]), ["a1", "b1"])
+        self.assertIsNone(loaded.at[100, "llama_response"])
+
+    def test_projection_and_filters(self):
+        store_pandas_in(self.dataset, self.filename)
+        loaded = read_table(self.filename + ".parquet", columns=["question"], filters=[("source", "=", "medicine")])
+        self.assertEqual(list(loaded.columns), ["question"])
+        self.assertListEqual(list(loaded.index), [90, 70, 50, 30, 10])
+
+    def test_legacy_exports_are_loaded_the_same_way(self):
+        store_pandas_in(self.dataset, self.filename, formats=("parquet", "pkl"))
+        for extension in (".parquet", ".pkl"):
+            loaded = load_dataset_file(self.filename + extension, columns=["question"],
+                                       filters=[("source", "in", ["reddit"])])
+            self.assertListEqual(list(loaded["question"]), ["q0", "q2", "q4", "q6", "q8"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from core.utils import residency_order
+from core.utils.cache import CachedService, RequestCache
+from core.utils.llm import LlmService, release, warm_up
+from core.utils.workqueue import WorkQueue, run_worker
+
+
+class StubHost(LlmService):
+    """
+    Stands in for an Ollama host: records the questions it served.
+    """
+
+    def __init__(self, name, failing=(), model=None, size=0, failed_loads=0, failed_releases=0):
+        self.name = name
+        self.failing = set(failing)
+        self.served = []
+        self.loads = 0
+        self.releases = 0
+        self.model = model
+        self.size = size
+        self.failed_loads = failed_loads
+        self.failed_releases = failed_releases
+
+    def footprint(self) -> int:
+        return self.size
+
+    def warm_up(self) -> float:
+        self.loads += 1
+        if self.failed_loads:
+            self.failed_loads -= 1
+            raise ValueError("model not found")
+        return 0.0
+
+    def release(self):
+        self.releases += 1
+        if self.failed_releases:
+            self.failed_releases -= 1
+            raise ValueError("failure")
+
+    async def acomplete_many(self, text: str, max_output: int, n: int) -> list[str]:
+        if text in self.failing:
+            self.failing.remove(text)
+            raise ValueError("failure")
+        self.served.append((text, n))
+        return [f"{self.name}: {text} {len(self.served)}.{i}" for i in range(n)]
+
+
+class WorkQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "queue.sqlite")
+        self.queue = WorkQueue(self.filename)
+        for service in ["llama", "mistral"]:
+            self.queue.enqueue(service, [(row, sample, f"q{row}") for row in range(10) for sample in range(3)])
+
+    def tearDown(self):
+        self.queue.close()
+        self.directory.cleanup()
+
+    def test_enqueue_is_idempotent(self):
+        self.queue.enqueue("llama", [(0, 0, "q0")])
+        self.assertEqual(self.queue.counts(), {"pending": 60})
+
+    def test_workers_share_the_queue(self):
+        hosts = [StubHost("gpu1", failing=["q4"]), StubHost("gpu2")]
+        workers = [threading.Thread(target=run_worker,
+                                    args=(WorkQueue(self.filename), {"llama": host, "mistral": host}, host.name),
+                                    kwargs={"batch": 6, "idle": 0.01})
+                   for host in hosts]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.queue.counts(), {"done": 60})
+        results = list(self.queue.results("llama"))
+        self.assertEqual(sorted((row, sample) for _, row, sample, _, _ in results),
+                         [(row, sample) for row in range(10) for sample in range(3)])
+        # the samples of a question are asked together
+        self.assertTrue(all(n == 3 for host in hosts for _, n in host.served))
+
+    def test_worker_groups_work_by_model(self):
+        host = StubHost("gpu")
+        load_times = run_worker(self.queue, {"llama": host, "mistral": host}, "worker", batch=4, idle=0.01)
+        self.assertEqual(set(load_times), {"llama", "mistral"})
+        # one load per model, not one per batch
+        self.assertEqual(host.loads, 2)
+
+    def test_samples_split_across_batches_are_distinct(self):
+        cache = RequestCache(os.path.join(self.directory.name, "requests.sqlite"))
+        service = CachedService(StubHost("gpu"), cache)
+        # 16 items: the samples of q5 are split between the first two batches
+        run_worker(self.queue, {"llama": service, "mistral": service}, "worker", batch=16, idle=0.01)
+        samples = {}
+        for _, row, sample, text, _ in self.queue.results("llama"):
+            samples.setdefault(row, []).append(text)
+        self.assertEqual(len(samples), 10)
+        self.assertTrue(all(len(set(texts)) == 3 for texts in samples.values()))
+        cache.close()
+
+    def test_failed_warm_up_gives_the_items_back(self):
+        host = StubHost("gpu", failed_loads=1)
+        load_times = run_worker(self.queue, {"llama": host, "mistral": host}, "worker", batch=16, idle=0.01)
+        # the leased items did not wait for the lease to expire
+        self.assertEqual(self.queue.counts(), {"done": 60})
+        self.assertEqual(host.loads, 3)
+        self.assertEqual(set(load_times), {"llama", "mistral"})
+
+    def test_failed_release_does_not_stop_the_worker(self):
+        services = {"llama": StubHost("gpu1", model="llama3", failed_releases=1), "mistral": StubHost("gpu2")}
+        run_worker(self.queue, services, "worker", batch=16, idle=0.01)
+        self.assertEqual(self.queue.counts(), {"done": 60})
+
+    def test_shared_model_is_kept_loaded(self):
+        services = {"llama": StubHost("a", model="llama3"), "mistral": StubHost("b", model="llama3")}
+        run_worker(self.queue, services, "worker", batch=16, idle=0.01)
+        # only once the worker is done
+        self.assertEqual((services["llama"].releases, services["mistral"].releases), (0, 1))
+
+    def test_expired_leases_are_taken_again(self):
+        queue = WorkQueue(self.filename, lease_seconds=-1)
+        first = queue.lease("dead", limit=3)
+        second = queue.lease("alive", limit=3)
+        self.assertEqual(first, second)
+        self.assertEqual(self.queue.lease("other", limit=3, prefer="mistral")[0]["service"], "mistral")
+
+
+class ResidencyTests(unittest.TestCase):
+    def test_order_groups_models_largest_first(self):
+        services = {
+            "phi": StubHost("phi", model="phi3", size=2),
+            "gpt": StubHost("gpt", model="gpt-35"),
+            "llama": StubHost("llama", model="llama3", size=8),
+            "mistral": StubHost("mistral", model="mistral", size=4),
+            "llama-hot": StubHost("llama-hot", model="llama3", size=8),
+        }
+        # remote first, then the largest local models, the services of a model one after the other
+        self.assertEqual(residency_order(services), ["gpt", "llama", "llama-hot", "mistral", "phi"])
+
+    def test_warm_up_and_release_are_best_effort(self):
+        host = StubHost("gpu", failed_loads=1, failed_releases=1)
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(warm_up("llama", host))
+            release("llama", host)
+        self.assertEqual(warm_up("llama", host), 0.0)
+        self.assertEqual((host.loads, host.releases), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()